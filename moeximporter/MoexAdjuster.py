@@ -0,0 +1,273 @@
+import concurrent.futures
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from .MoexImporter import MoexImporter
+
+class MoexAdjuster:
+    """Class MoexAdjuster implements split and dividend adjustment of
+    history quotes for many securities at once.
+
+    Dividends and splits are requested from MOEX ISS once and cached.
+    Adjusted quotes are cached too: when raw quotes are extended with new
+    days and no new corporate action comes into effect, only new rows are
+    appended, otherwise the adjusted series of the security is recomputed.
+
+    Adjustment factors are cumulative. A split multiplies prices before its
+    trade date by before/after and quantity by after/before. A dividend
+    multiplies prices before the ex-date by (1 - dividend / previous close).
+    The last day with the dividend right is one business day before the
+    registry close date (two business days before 2023-07-31, when the
+    settlement was T+2), the ex-date is the next business day; exchange
+    holidays are not taken into account.
+
+    Instance of MoexImporter should be created before.
+    """
+    price_columns = ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'WAPRICE']
+    """Price columns to adjust.
+    """
+    quantity_columns = ['QUANTITY']
+    """Quantity columns to adjust for splits.
+    """
+
+    def __init__(self, mi, dividends = True, workers = 8):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        dividends: boolean, optional
+            If `False`, quotes are adjusted for splits only.
+        workers: int, optional
+            Number of parallel requests to load corporate actions.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.dividends = dividends
+        """Adjust for dividends.
+        """
+        self.workers = workers
+        """Number of parallel requests.
+        """
+        self.actions = {}
+        """Cached corporate actions by ticker.
+        """
+        self.adjusted = {}
+        """Cached adjusted quotes by ticker with the fingerprint of
+        the actions in effect.
+        """
+        self.errors = {}
+        """Error messages by ticker for securities whose corporate actions
+        failed to load.
+        """
+        self._lock = threading.Lock()
+        if not isinstance(mi, MoexImporter):
+            print('MoexAdjuster::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    @staticmethod
+    def _parseCorporateActions(dividends, splits):
+        """Internal method to convert dividends and splits from MOEX ISS
+        replies to the list of actions.
+        """
+        _res = [
+            {
+                'type': 'dividend',
+                'date': datetime.strptime(_d['registryclosedate'], '%Y-%m-%d').date(),
+                'value': float(_d['value']),
+                'before': None,
+                'after': None,
+            } for _d in dividends if _d.get('registryclosedate') and _d.get('value')
+        ]
+        _res += [
+            {
+                'type': 'split',
+                'date': datetime.strptime(_s['tradedate'], '%Y-%m-%d').date(),
+                'value': None,
+                'before': float(_s['before']),
+                'after': float(_s['after']),
+            } for _s in splits if _s.get('tradedate') and _s.get('before') and _s.get('after')
+        ]
+        _res.sort(key=lambda _a: (_a['date'], _a['type']))
+        return _res
+
+    def _loadActions(self, seccode):
+        """Internal method requests corporate actions for the security.
+        """
+        _dv = self.mi.getDividends(seccode)
+        _sp = self.mi.getSplits(seccode)
+        if _dv is None or _sp is None:
+            raise RuntimeError(f'request failed for {seccode:s}')
+        return self._parseCorporateActions(_dv, _sp)
+
+    def loadActions(self, seccodes, refresh = False):
+        """Requests corporate actions for securities that aren't cached yet.
+
+        Parameters
+        ----------
+        seccodes: array_like
+            List of tickers.
+        refresh: boolean, optional
+            If `True`, actions are requested again for all securities. Adjusted
+            quotes are recomputed only if new actions come into effect.
+
+        Returns
+        -------
+        dict
+            Cached actions by ticker. Tickers that failed to load are missing
+            and listed in the `errors` attribute.
+        """
+        _todo = [_sc for _sc in seccodes if refresh or _sc not in self.actions]
+        if _todo:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _futures = {_pool.submit(self._loadActions, _sc): _sc for _sc in _todo}
+                for _f in concurrent.futures.as_completed(_futures):
+                    try:
+                        _acts = _f.result()
+                        with self._lock:
+                            self.actions[_futures[_f]] = _acts
+                            self.errors.pop(_futures[_f], None)
+                    except Exception as e:
+                        with self._lock:
+                            self.errors[_futures[_f]] = str(e)
+                        print('MoexAdjuster::loadActions(): ', _futures[_f], e, file=sys.stderr)
+        return {_sc: self.actions[_sc] for _sc in seccodes if _sc in self.actions}
+
+    @staticmethod
+    def _effectiveActions(dates, actions, dividends):
+        """Internal method returns actions in effect for the dates and
+        positions of the first row they don't affect.
+        """
+        _res = []
+        _n = len(dates)
+        for _a in actions:
+            if _a['type'] == 'split':
+                _dt = np.datetime64(_a['date'], 'D')
+            elif dividends:
+                _lag = 1 if _a['date'] >= date(2023, 7, 31) else 2
+                _dt = np.busday_offset(np.datetime64(_a['date'], 'D'), 1 - _lag, roll='backward')
+            else:
+                continue
+            _p = int(np.searchsorted(dates, _dt, side='left'))
+            if 0 < _p < _n:
+                _res.append((_a, _p))
+        return _res
+
+    @staticmethod
+    def _fingerprint(effective):
+        """Internal method returns the fingerprint of actions in effect.
+        """
+        return tuple((_a['type'], _a['date'], _a['value'], _a['before'], _a['after'], _p) for _a, _p in effective)
+
+    @classmethod
+    def applyActions(cls, quotes, actions, dividends = True):
+        """Adjusts quotes of several securities in one vectorized pass.
+
+        Parameters
+        ----------
+        quotes: dict
+            Raw quotes by ticker as pandas dataframes indexed by 'TRADEDATE'
+            (the format of `MoexSecurity.getHistoryQuotesAsDataFrame`).
+        actions: dict
+            Corporate actions by ticker (the format of
+            `MoexSecurity.getCorporateActions`).
+        dividends: boolean, optional
+            If `False`, quotes are adjusted for splits only.
+
+        Returns
+        -------
+        dict
+            Adjusted quotes by ticker. Tickers whose corporate actions failed
+            to load are skipped and listed in the `errors` attribute, raw
+            quotes are never returned as adjusted.
+        """
+        _keys = [_k for _k in quotes if quotes[_k] is not None]
+        _frames = [quotes[_k].sort_index() for _k in _keys]
+        _counts = np.array([len(_f) for _f in _frames], dtype=np.int64)
+        _ends = np.cumsum(_counts)
+        _starts = _ends - _counts
+        _total = int(_ends[-1]) if len(_ends) else 0
+        _lp = np.zeros(_total)
+        _lq = np.zeros(_total)
+        for _k, _f, _o in zip(_keys, _frames, _starts):
+            _dates = np.array(_f.index, dtype='datetime64[D]')
+            _close = _f['CLOSE'].to_numpy(dtype='float64', na_value=np.nan) if 'CLOSE' in _f else np.full(len(_f), np.nan)
+            for _a, _p in cls._effectiveActions(_dates, actions.get(_k, []), dividends):
+                if _a['type'] == 'split':
+                    _lp[_o + _p - 1] += np.log(_a['before'] / _a['after'])
+                    _lq[_o + _p - 1] += np.log(_a['after'] / _a['before'])
+                else:
+                    _pc = _close[:_p][~np.isnan(_close[:_p])]
+                    if len(_pc) and 0 < _a['value'] < _pc[-1]:
+                        _lp[_o + _p - 1] += np.log(1.0 - _a['value'] / _pc[-1])
+        # Reverse cumulative sums within every security: the factor of a row
+        # is the product of factors of all later events of the same security.
+        _rp = np.append(np.cumsum(_lp[::-1])[::-1], 0.0)
+        _rq = np.append(np.cumsum(_lq[::-1])[::-1], 0.0)
+        _next = np.repeat(_ends, _counts)
+        _fp = np.exp(_rp[:-1] - _rp[_next])
+        _fq = np.exp(_rq[:-1] - _rq[_next])
+        _res = {}
+        for _k, _f, _o, _n in zip(_keys, _frames, _starts, _counts):
+            _adj = _f.copy()
+            for _c in cls.price_columns:
+                if _c in _adj:
+                    _adj[_c] = pd.to_numeric(_adj[_c], errors='coerce') * _fp[_o:_o + _n]
+            for _c in cls.quantity_columns:
+                if _c in _adj:
+                    _adj[_c] = pd.to_numeric(_adj[_c], errors='coerce') * _fq[_o:_o + _n]
+            _res[_k] = _adj
+        return _res
+
+    def adjust(self, quotes):
+        """Returns adjusted quotes for several securities. Raw quotes aren't
+        requested: pass quotes you have already loaded or cached. Corporate
+        actions are requested only for securities that aren't cached yet.
+
+        Adjusted series are recomputed only if the set of actions in effect
+        changes. If raw quotes just have new days at the end, the new rows are
+        appended to the cached adjusted series without recomputation.
+
+        Parameters
+        ----------
+        quotes: dict
+            Raw quotes by ticker as pandas dataframes indexed by 'TRADEDATE'
+            (the format of `MoexSecurity.getHistoryQuotesAsDataFrame`).
+
+        Returns
+        -------
+        dict
+            Adjusted quotes by ticker.
+        """
+        _res = {}
+        try:
+            self.loadActions(list(quotes.keys()))
+            _todo = {}
+            for _k, _raw in quotes.items():
+                if _raw is None:
+                    continue
+                if _k not in self.actions:
+                    print('MoexAdjuster::adjust(): no corporate actions, skipped', _k, file=sys.stderr)
+                    continue
+                _raw = _raw.sort_index()
+                _dates = np.array(_raw.index, dtype='datetime64[D]')
+                _fpr = self._fingerprint(self._effectiveActions(_dates, self.actions.get(_k, []), self.dividends))
+                _cached = self.adjusted.get(_k)
+                if _cached and _cached['fingerprint'] == _fpr and len(_raw) >= len(_cached['frame']) and _raw.index[:len(_cached['frame'])].equals(_cached['frame'].index):
+                    _new = _raw.iloc[len(_cached['frame']):]
+                    _adj = pd.concat([_cached['frame'], _new]) if len(_new) else _cached['frame']
+                    self.adjusted[_k] = {'fingerprint': _fpr, 'frame': _adj}
+                    _res[_k] = _adj
+                else:
+                    _todo[_k] = (_raw, _fpr)
+            if _todo:
+                _adjs = self.applyActions({_k: _v[0] for _k, _v in _todo.items()}, self.actions, dividends=self.dividends)
+                for _k, _adj in _adjs.items():
+                    self.adjusted[_k] = {'fingerprint': _todo[_k][1], 'frame': _adj}
+                    _res[_k] = _adj
+        except Exception as e:
+            print('MoexAdjuster::adjust(): ', e, file=sys.stderr)
+        return _res
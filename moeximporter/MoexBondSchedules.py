@@ -0,0 +1,203 @@
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import pandas as pd
+from .MoexImporter import MoexImporter
+
+class MoexBondSchedules:
+    """Class MoexBondSchedules implements bulk loading of coupon and
+    amortization schedules for bonds.
+
+    Schedules are requested in parallel and cached by ticker. The cached
+    schedule is valid until the maturity date of the bond changes, so
+    passing actual maturity dates (e.g. 'MATDATE' of the board snapshot)
+    refreshes only bonds with changed redemption terms.
+
+    Instance of MoexImporter should be created before.
+    """
+    coupon_columns = ['secid', 'coupondate', 'recorddate', 'startdate', 'initialfacevalue', 'facevalue', 'faceunit', 'value', 'valueprc', 'value_rub']
+    """Columns of the coupons table.
+    """
+    amortization_columns = ['secid', 'amortdate', 'initialfacevalue', 'facevalue', 'faceunit', 'valueprc', 'value', 'value_rub']
+    """Columns of the amortizations table.
+    """
+
+    def __init__(self, mi, cache_dir = None, workers = 8):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        cache_dir: str, optional
+            Directory to keep schedules between sessions. Schedules are
+            cached only in memory if the parameter is ommited.
+        workers: int, optional
+            Number of parallel requests.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.cache_dir = cache_dir
+        """Directory of the persistent cache.
+        """
+        self.workers = workers
+        """Number of parallel requests.
+        """
+        self.cache = {}
+        """Cached schedules by ticker. Values keep the maturity date, coupons
+        and amortizations.
+        """
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        if not isinstance(mi, MoexImporter):
+            print('MoexBondSchedules::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    def _cached(self, seccode):
+        """Internal method returns the cached schedule from memory or disk.
+        """
+        with self._lock:
+            _res = self.cache.get(seccode)
+        if _res is None and self.cache_dir:
+            _fn = os.path.join(self.cache_dir, seccode + '.json')
+            if os.path.exists(_fn):
+                with open(_fn, 'r', encoding='utf-8') as _f:
+                    _res = json.load(_f)
+                with self._lock:
+                    self.cache[seccode] = _res
+        return _res
+
+    def _store(self, seccode, schedule):
+        """Internal method saves the schedule to memory and disk.
+        """
+        with self._lock:
+            self.cache[seccode] = schedule
+        if self.cache_dir:
+            _fn = os.path.join(self.cache_dir, seccode + '.json')
+            with open(_fn + '.tmp', 'w', encoding='utf-8') as _f:
+                json.dump(schedule, _f)
+            os.replace(_fn + '.tmp', _fn)
+
+    def _fetch(self, seccode, matdate = None):
+        """Internal method requests all pages of the schedule for the bond.
+        The maturity date the schedule was requested for is kept with it; the
+        date of the last amortization is used if it isn't passed.
+        """
+        _res = {
+            'matdate': matdate,
+            'coupons': [],
+            'amortizations': [],
+        }
+        _st = 0
+        _isNext = True
+        while _isNext:
+            _isNext = False
+            _tmp = self.mi.getBondization(seccode, start=_st)
+            if _tmp is None:
+                raise RuntimeError(f'request failed for {seccode:s} at {_st:d}')
+            for _ti in _tmp:
+                for _bk in ['coupons', 'amortizations']:
+                    if _bk in _ti and _ti[_bk]:
+                        _res[_bk] += _ti[_bk]
+                        if len(_ti[_bk]) == self.mi.limit:
+                            _isNext = True
+            _st += self.mi.limit
+        if _res['matdate'] is None and _res['amortizations']:
+            _res['matdate'] = max(_a['amortdate'] for _a in _res['amortizations'] if _a.get('amortdate'))
+        return _res
+
+    @staticmethod
+    def _matdate(matdates, seccode):
+        """Internal method returns the maturity date as ISO string or `None`.
+        """
+        _res = None
+        if matdates is not None:
+            _md = matdates.get(seccode)
+            if _md is not None and not pd.isna(_md):
+                _res = _md if isinstance(_md, str) else f'{_md:%Y-%m-%d}'
+        return _res
+
+    def load(self, seccodes, matdates = None, refresh = False):
+        """Loads schedules for bonds and returns flat tables with coupons
+        and amortizations of all bonds.
+
+        Parameters
+        ----------
+        seccodes: array_like
+            List of bond tickers.
+        matdates: dict or pd.Series, optional
+            Actual maturity dates by ticker. The cached schedule is requested
+            again if its maturity date differs. Cached schedules are used
+            as is if the parameter is ommited.
+        refresh: boolean, optional
+            If `True`, all schedules are requested again.
+
+        Returns
+        -------
+        tuple
+            Pair of pandas dataframes (coupons, amortizations) with columns
+            `coupon_columns` and `amortization_columns`. Dates are datetime64,
+            values are float64, rows are sorted by ticker and date.
+        """
+        _res = None
+        try:
+            _todo = []
+            for _sc in seccodes:
+                _sch = None if refresh else self._cached(_sc)
+                _md = self._matdate(matdates, _sc)
+                if _sch is None or (_md is not None and _sch['matdate'] != _md):
+                    _todo.append(_sc)
+            if _todo:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                    _futures = {_pool.submit(self._fetch, _sc, self._matdate(matdates, _sc)): _sc for _sc in _todo}
+                    for _f in concurrent.futures.as_completed(_futures):
+                        try:
+                            self._store(_futures[_f], _f.result())
+                        except Exception as e:
+                            print('MoexBondSchedules::load(): ', _futures[_f], e, file=sys.stderr)
+            _res = self.getTables(seccodes)
+        except Exception as e:
+            print('MoexBondSchedules::load(): ', e, file=sys.stderr)
+        return _res
+
+    def getTables(self, seccodes):
+        """Returns flat tables from cached schedules without requests.
+
+        Parameters
+        ----------
+        seccodes: array_like
+            List of bond tickers.
+
+        Returns
+        -------
+        tuple
+            Pair of pandas dataframes (coupons, amortizations) as in `load`.
+        """
+        _cp = []
+        _am = []
+        for _sc in seccodes:
+            _sch = self._cached(_sc)
+            if _sch:
+                _cp += [dict(_r, secid=_sc) for _r in _sch['coupons']]
+                _am += [dict(_r, secid=_sc) for _r in _sch['amortizations']]
+        return (
+            self._table(_cp, self.coupon_columns, ['coupondate', 'recorddate', 'startdate'], 'coupondate'),
+            self._table(_am, self.amortization_columns, ['amortdate'], 'amortdate'),
+        )
+
+    @staticmethod
+    def _table(rows, columns, dates, sortby):
+        """Internal method builds the typed table from rows.
+        """
+        _res = pd.DataFrame.from_dict(data=rows).reindex(columns=columns)
+        for _c in columns:
+            if _c in dates:
+                _res[_c] = pd.to_datetime(_res[_c], errors='coerce')
+            elif _c not in ['secid', 'faceunit']:
+                _res[_c] = pd.to_numeric(_res[_c], errors='coerce').astype('float64')
+        _res.sort_values(['secid', sortby], inplace=True, kind='stable')
+        _res.reset_index(drop=True, inplace=True)
+        return _res
@@ -0,0 +1,369 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+import pandas as pd
+from datetime import date, timedelta
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexSessions import MoexSessions
+from .MoexCandlePeriods import MoexCandlePeriods
+from ._MoexRateLimiter import _MoexRateLimiter
+from ._MoexSharedCache import _MoexSharedCache
+
+_worker_importers = {}
+"""MoexImporter objects of the process by run ids. Workers of one run share
+the object, every run gets its own one with its header and rate budget.
+"""
+_worker_lock = threading.Lock()
+
+_chunk_days = {
+    MoexCandlePeriods.Period1Min: 7,
+    MoexCandlePeriods.Period10Min: 60,
+    MoexCandlePeriods.Period1Hour: 365,
+}
+"""Default chunk lengths in days for intraday candles.
+"""
+
+class MoexBulkLoader:
+    """Class MoexBulkLoader implements resumable bulk downloads of quotes
+    described by a job spec.
+
+    Every job is split into date chunks. After each chunk the rows are
+    appended to the output file and a checkpoint is saved, so a restarted
+    download continues from the last completed chunk. Jobs are executed on
+    a thread or process pool with the shared rate limit.
+
+    Job spec is a dict (or a path to a JSON file) like:
+
+        {
+            "output": "quotes",
+            "workers": 4,
+            "rate": 5,
+            "jobs": [
+                {"seccodes": ["GAZP", "SBER"], "dtfrom": "2020-01-01", "dttill": "2023-12-31"},
+                {"seccode": "SU26238RMFS4", "board": "TQOB", "type": "history",
+                 "session": "TotalSessions", "dtfrom": "2022-01-01", "dttill": "2023-12-31"},
+                {"seccode": "GAZP", "type": "candles", "interval": "Period1Hour",
+                 "dtfrom": "2023-01-01", "dttill": "2023-12-31", "chunk_days": 90}
+            ]
+        }
+
+    Job keys: `seccode` or `seccodes`, `board` (primary board by default),
+    `type` (`history` or `candles`, default `history`), `session` (name of
+    MoexSessions, default `MainSession`), `interval` (name of MoexCandlePeriods,
+    default `Period1Day`), `dtfrom`, `dttill`, `chunk_days`.
+    Output of every job is written to a csv file in the `output` directory.
+    """
+    def __init__(self, spec, workers = None, processes = False, rate = None, header = None):
+        """Class constructor parses the job spec.
+
+        Parameters
+        ----------
+        spec: dict or str
+            Job spec or a path to the JSON file with it.
+        workers: int, optional
+            Number of workers. Overrides `workers` from the spec. Default is 4.
+        processes: boolean, optional
+            If `True`, jobs are executed in a process pool instead of threads.
+        rate: float, optional
+            Total budget of requests per second for all workers. Overrides
+            `rate` from the spec. Default is 5.
+        header: dict, optional
+            HTTP-header for MoexImporter objects of workers.
+        """
+        if isinstance(spec, str):
+            with open(spec, 'r', encoding='utf-8') as _f:
+                spec = json.load(_f)
+        self.output = spec.get('output', '.')
+        """Output directory.
+        """
+        self.workers = workers if workers else spec.get('workers', 4)
+        """Number of workers.
+        """
+        self.processes = processes
+        """Use processes instead of threads.
+        """
+        self.rate = rate if rate else spec.get('rate', 5)
+        """Total budget of requests per second.
+        """
+        self.header = header
+        """HTTP-header for requests.
+        """
+        self._run = uuid.uuid4().hex
+        self.jobs = []
+        """Normalized jobs.
+        """
+        for _js in spec.get('jobs', []):
+            _seccodes = _js['seccodes'] if 'seccodes' in _js else [_js['seccode']]
+            for _sc in _seccodes:
+                self.jobs.append(self._normalizeJob(_js, _sc))
+
+    @staticmethod
+    def _normalizeJob(js, seccode):
+        """Internal method to build the job from the spec entry.
+        """
+        _job = {
+            'seccode': seccode,
+            'board': js.get('board'),
+            'type': js.get('type', 'history'),
+            'dtfrom': date.fromisoformat(js['dtfrom']) if isinstance(js['dtfrom'], str) else js['dtfrom'],
+            'dttill': date.fromisoformat(js['dttill']) if isinstance(js['dttill'], str) else js['dttill'],
+        }
+        if _job['type'] == 'candles':
+            _job['interval'] = MoexCandlePeriods[js.get('interval', 'Period1Day')]
+            _job['chunk_days'] = js.get('chunk_days', _chunk_days.get(_job['interval'], 3650))
+            _mode = _job['interval'].name
+        elif _job['type'] == 'history':
+            _job['session'] = MoexSessions[js.get('session', 'MainSession')]
+            _job['chunk_days'] = js.get('chunk_days', 3650)
+            _mode = _job['session'].name
+        else:
+            raise ValueError(f'unknown job type {_job["type"]}')
+        _job['id'] = re.sub(r'[^\w.-]', '_', f'{_job["type"]}_{seccode}_{_job["board"] or "main"}_{_mode}_{_job["dtfrom"]:%Y%m%d}_{_job["dttill"]:%Y%m%d}')
+        return _job
+
+    @staticmethod
+    def _jobChunks(job):
+        """Internal method to split the job range into chunks.
+        """
+        _res = []
+        _dtf = job['dtfrom']
+        while _dtf <= job['dttill']:
+            _dtt = min(job['dttill'], _dtf + timedelta(days=job['chunk_days'] - 1))
+            _res.append((_dtf, _dtt))
+            _dtf = _dtt + timedelta(days=1)
+        return _res
+
+    @staticmethod
+    def _checkpointPath(output, job):
+        """Internal method to get the path of the job checkpoint.
+        """
+        return os.path.join(output, '.checkpoints', job['id'] + '.json')
+
+    @staticmethod
+    def _readCheckpoint(output, job):
+        """Internal method to read the job checkpoint.
+        """
+        _res = None
+        _path = MoexBulkLoader._checkpointPath(output, job)
+        if os.path.exists(_path):
+            with open(_path, 'r', encoding='utf-8') as _f:
+                _res = json.load(_f)
+        return _res
+
+    @staticmethod
+    def _writeCheckpoint(output, job, checkpoint):
+        """Internal method to write the job checkpoint atomically.
+        """
+        _path = MoexBulkLoader._checkpointPath(output, job)
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        with open(_path + '.tmp', 'w', encoding='utf-8') as _f:
+            json.dump(checkpoint, _f)
+        os.replace(_path + '.tmp', _path)
+
+    def pendingChunks(self, job):
+        """Returns chunks of the job that aren't completed yet.
+
+        Parameters
+        ----------
+        job: dict
+            Normalized job from the `jobs` attribute.
+
+        Returns
+        -------
+        array_like
+            List of (dtfrom, dttill) tuples.
+        """
+        _ckpt = self._readCheckpoint(self.output, job)
+        _chunks = self._jobChunks(job)
+        if _ckpt:
+            _done = date.fromisoformat(_ckpt['done_till'])
+            _chunks = [_ch for _ch in _chunks if _ch[1] > _done]
+        return _chunks
+
+    def run(self, progress = True):
+        """Executes all pending jobs.
+
+        Parameters
+        ----------
+        progress: boolean, optional
+            If `True`, throughput and ETA are printed to stderr.
+
+        Returns
+        -------
+        dict
+            Summary with the number of completed, failed and skipped jobs,
+            rows and errors by job id.
+        """
+        os.makedirs(self.output, exist_ok=True)
+        try:
+            return self._runJobs(self.jobs, progress)
+        finally:
+            _releaseImporter(self._run)
+
+    def _options(self):
+        """Internal method returns options passed to workers.
+        """
+        return {
+            'run': self._run,
+            'output': self.output,
+            'header': self.header,
+            'rate': self.rate / self.workers if self.processes else self.rate,
+        }
+
+    def _runJobs(self, jobs, progress, target = None):
+        """Internal method executes jobs on the pool with the worker function
+        `target` (`_loadJob` by default) and collects progress.
+        """
+        _total = 0
+        _done = 0
+        for _job in jobs:
+            _chunks = len(self._jobChunks(_job))
+            _total += _chunks
+            _done += _chunks - len(self.pendingChunks(_job))
+        _res = {
+            'jobs': len(jobs),
+            'completed': 0,
+            'failed': 0,
+            'skipped': 0,
+            'rows': 0,
+            'errors': {},
+        }
+        _options = self._options()
+        if self.processes:
+            _manager = multiprocessing.Manager()
+            _queue = _manager.Queue()
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            _manager = None
+            _queue = queue.Queue()
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        _t0 = time.monotonic()
+        _chunks0 = _done
+        _tp = 0
+        try:
+            _futures = {_pool.submit(target or _loadJob, _job, _options, _queue): _job['id'] for _job in jobs}
+            _reported = set()
+            while len(_reported) < len(_futures):
+                try:
+                    _kind, _jid, _val = _queue.get(timeout=1)
+                    if _kind == 'chunk':
+                        _done += 1
+                        _res['rows'] += _val
+                    elif _kind == 'done':
+                        _reported.add(_jid)
+                        _res['completed'] += 1
+                    elif _kind == 'skipped':
+                        _reported.add(_jid)
+                        _res['skipped'] += 1
+                    elif _kind == 'error':
+                        _reported.add(_jid)
+                        _res['failed'] += 1
+                        _res['errors'][_jid] = _val
+                except queue.Empty:
+                    if all(_f.done() for _f in _futures):
+                        break
+            # workers that died (e.g. a broken process pool) never report their jobs
+            for _f, _jid in _futures.items():
+                if _jid not in _reported:
+                    _e = _f.exception() if _f.done() and not _f.cancelled() else None
+                    _res['failed'] += 1
+                    _res['errors'][_jid] = str(_e) if _e is not None else 'worker stopped without reporting the job'
+                if progress and time.monotonic() - _tp >= 1:
+                    _tp = time.monotonic()
+                    self._printProgress(_done, _total, _done - _chunks0, _res['rows'], _tp - _t0)
+            if progress:
+                self._printProgress(_done, _total, _done - _chunks0, _res['rows'], time.monotonic() - _t0)
+                print('', file=sys.stderr)
+        finally:
+            _pool.shutdown(wait=True)
+            if _manager:
+                _manager.shutdown()
+        return _res
+
+    @staticmethod
+    def _printProgress(done, total, chunks, rows, elapsed):
+        """Internal method to print progress line to stderr.
+        """
+        _rate = chunks / elapsed if elapsed > 0 else 0
+        _eta = f'{(total - done) / _rate:.0f}s' if _rate > 0 else '-'
+        print(
+            f'\rchunks {done:d}/{total:d}, rows {rows:d}, {rows / elapsed if elapsed > 0 else 0:.0f} rows/s, {_rate:.2f} chunks/s, ETA {_eta:s}   ',
+            end='', file=sys.stderr, flush=True
+        )
+
+def _workerImporter(options):
+    """Internal function returns MoexImporter object of the run in the worker
+    process.
+    """
+    with _worker_lock:
+        _res = _worker_importers.get(options['run'])
+        if _res is None:
+            _res = MoexImporter(header=options['header']) if options['header'] else MoexImporter()
+            _res.rate_limiter = _MoexRateLimiter(options['rate'])
+            if options.get('cache'):
+                _res.shared_cache = _MoexSharedCache(options['cache'])
+            _worker_importers[options['run']] = _res
+    return _res
+
+def _releaseImporter(run):
+    """Internal function drops MoexImporter object of the finished run.
+    """
+    with _worker_lock:
+        _worker_importers.pop(run, None)
+
+def _loadJob(job, options, progress, fence = None):
+    """Internal function executes the job in a worker and reports progress
+    to the queue as tuples (kind, job id, value). If `fence` is passed,
+    it's called before every chunk is written and the job is skipped when
+    it returns `False`.
+    """
+    try:
+        _output = options['output']
+        _path = os.path.join(_output, job['id'] + '.csv')
+        _ckpt = MoexBulkLoader._readCheckpoint(_output, job)
+        if _ckpt is None:
+            _ckpt = {'done_till': None, 'size': 0, 'rows': 0, 'columns': None}
+        _chunks = MoexBulkLoader._jobChunks(job)
+        if _ckpt['done_till']:
+            _dt = date.fromisoformat(_ckpt['done_till'])
+            _chunks = [_ch for _ch in _chunks if _ch[1] > _dt]
+        if _chunks:
+            with open(_path, 'ab') as _f:
+                _f.truncate(_ckpt['size'])
+            _mi = _workerImporter(options)
+            _sec = MoexSecurity(job['seccode'], _mi)
+            if not _sec.boards:
+                raise RuntimeError(f'no data for security {job["seccode"]}')
+            for _dtf, _dtt in _chunks:
+                if job['type'] == 'candles':
+                    _tmp = _sec.getCandleQuotesAsArray(_dtf, _dtt, board=job['board'], interval=job['interval'])
+                else:
+                    _tmp = _sec.getHistoryQuotesAsArray(_dtf, _dtt, board=job['board'], ts=job['session'])
+                if _tmp is None:
+                    raise RuntimeError(f'chunk {_dtf.isoformat()}..{_dtt.isoformat()} failed')
+                if fence is not None and not fence():
+                    progress.put(('skipped', job['id'], None))
+                    return
+                if _tmp:
+                    _df = pd.DataFrame.from_dict(data=_tmp)
+                    if _ckpt['columns'] is None:
+                        _ckpt['columns'] = list(_df.columns)
+                    _df = _df.reindex(columns=_ckpt['columns'])
+                    _df.to_csv(_path, mode='a', header=(_ckpt['size'] == 0), index=False)
+                _ckpt['size'] = os.path.getsize(_path)
+                _ckpt['rows'] += len(_tmp)
+                _ckpt['done_till'] = _dtt.isoformat()
+                MoexBulkLoader._writeCheckpoint(_output, job, _ckpt)
+                progress.put(('chunk', job['id'], len(_tmp)))
+        progress.put(('done', job['id'], _ckpt['rows']))
+    except Exception as e:
+        print('MoexBulkLoader::_loadJob(): ', job['id'], e, file=sys.stderr)
+        progress.put(('error', job['id'], str(e)))
@@ -0,0 +1,317 @@
+import sys
+import threading
+from datetime import timedelta
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexSessions import MoexSessions
+from ._MoexClock import _MoexClock
+
+class MoexCalendar:
+    """Class MoexCalendar implements the cache of trading days and the
+    negative cache of empty replies shared by all securities of
+    MoexImporter object.
+
+    Trading days of a board are learned from the history of its reference
+    security: the calendar of the board is complete for every range of
+    the reference history that was loaded, either by `learn` or by any
+    request of the reference security. Requests of quotes and candles are
+    trimmed to the first and the last trading day of the range and aren't
+    sent at all if there are no trading days.
+
+    Past ranges that returned no data for the (ticker, board, session or
+    interval) are remembered and never requested again.
+
+    Assign the object to the `calendar` attribute of MoexImporter:
+
+        mi.calendar = MoexCalendar(mi)
+    """
+    market_references = {
+        ('stock', 'shares'): ('IMOEX', 'SNDX'),
+        ('stock', 'bonds'): ('RGBI', 'SNDX'),
+    }
+    """Default reference (ticker, board) by (engine, market). The share
+    index and the government bond index are calculated on every trading
+    day of their markets.
+    """
+
+    def __init__(self, mi, references = None):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        references: dict, optional
+            Reference (ticker, board) by board. Boards without the reference
+            use `market_references`, boards of other markets aren't trimmed.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.references = dict(references) if references else {}
+        """Reference (ticker, board) by board.
+        """
+        self.days = {}
+        """Trading days by reference.
+        """
+        self.known = {}
+        """Sorted date ranges with the complete calendar by reference.
+        """
+        self.empty = {}
+        """Sorted date ranges without data by (ticker, board, kind).
+        """
+        self._lock = threading.Lock()
+        if not isinstance(mi, MoexImporter):
+            print('MoexCalendar::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    def reference(self, board, engine = None, market = None):
+        """Returns the reference (ticker, board) for the board or `None`.
+
+        Parameters
+        ----------
+        board: str
+            Trading board.
+        engine: str, optional
+            Engine of the board.
+        market: str, optional
+            Market of the board.
+        """
+        return self.references.get(board, self.market_references.get((engine, market)))
+
+    @staticmethod
+    def _addRange(ranges, dtfrom, dttill):
+        """Internal method returns sorted ranges with the range added,
+        overlapping and adjacent ranges are merged.
+        """
+        _res = []
+        for _rf, _rt in sorted(ranges + [(dtfrom, dttill)]):
+            if _res and _rf <= _res[-1][1] + timedelta(days=1):
+                _res[-1] = (_res[-1][0], max(_res[-1][1], _rt))
+            else:
+                _res.append((_rf, _rt))
+        return _res
+
+    @staticmethod
+    def _subtractRanges(dtfrom, dttill, ranges):
+        """Internal method returns parts of the range that aren't covered by
+        sorted ranges.
+        """
+        _res = []
+        _cur = dtfrom
+        for _rf, _rt in ranges:
+            if _rt < _cur or _rf > dttill:
+                continue
+            if _rf > _cur:
+                _res.append((_cur, _rf - timedelta(days=1)))
+            _cur = max(_cur, _rt + timedelta(days=1))
+            if _cur > dttill:
+                break
+        if _cur <= dttill:
+            _res.append((_cur, dttill))
+        return _res
+
+    def addDays(self, reference, days, dtfrom, dttill):
+        """Stores trading days of the reference for the range. The calendar
+        of the range is considered complete. Days from today on are ignored.
+
+        Parameters
+        ----------
+        reference: tuple
+            Reference (ticker, board).
+        days: array_like
+            Trading days of the range.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        """
+        dttill = min(dttill, _MoexClock.today() - timedelta(days=1))
+        if dtfrom <= dttill:
+            with self._lock:
+                self.days.setdefault(reference, set()).update(_d for _d in days if dtfrom <= _d <= dttill)
+                self.known[reference] = self._addRange(self.known.get(reference, []), dtfrom, dttill)
+
+    def learn(self, board, dtfrom, dttill, engine = 'stock', market = 'shares'):
+        """Requests the history of the reference security of the board and
+        stores trading days for the range.
+
+        Parameters
+        ----------
+        board: str
+            Trading board.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        engine: str, optional
+            Engine of the board. Default is 'stock'.
+        market: str, optional
+            Market of the board. Default is 'shares'.
+
+        Returns
+        -------
+        int
+            Number of trading days in the range or `None` on failure.
+        """
+        _res = None
+        try:
+            _ref = self.reference(board, engine, market)
+            if _ref is None:
+                raise ValueError(f'no reference for board {board}')
+            _sec = MoexSecurity(_ref[0], self.mi, cache_rows=0)
+            _rdf = max(dtfrom, _sec.boards[_ref[1]]['dtfrom'])
+            _rdt = min(dttill, _sec.boards[_ref[1]]['dttill'], _MoexClock.today() - timedelta(days=1))
+            _rows = []
+            if _rdf <= _rdt:
+                _sec._loadHistory(_ref[1], _rdf, _rdt, MoexSessions.TotalSessions, _rows)
+                self.addDays(_ref, [_r['TRADEDATE'] for _r in _rows], _rdf, _rdt)
+            _res = len(self._knownDays(_ref, dtfrom, dttill))
+        except Exception as e:
+            print('MoexCalendar::learn(): ', e, file=sys.stderr)
+        return _res
+
+    def learnHistory(self, seccode, board, dtfrom, dttill, rows, ts = MoexSessions.TotalSessions):
+        """Stores trading days if the loaded history belongs to a reference
+        security. Called after every history request of MoexSecurity.
+        Only `TotalSessions` history is used, because a separate session
+        may have no rows for a trading day.
+        """
+        _ref = (seccode, board)
+        if ts != MoexSessions.TotalSessions:
+            return
+        if _ref in self.references.values() or _ref in self.market_references.values():
+            self.addDays(_ref, [_r['TRADEDATE'] for _r in rows], dtfrom, dttill)
+
+    def _knownDays(self, reference, dtfrom, dttill):
+        """Internal method returns stored trading days of the reference for
+        the range.
+        """
+        with self._lock:
+            return sorted(_d for _d in self.days.get(reference, ()) if dtfrom <= _d <= dttill)
+
+    def tradingDays(self, board, dtfrom, dttill, engine = None, market = None):
+        """Returns trading days of the board for the range. Past parts of the
+        range that aren't covered by the calendar are learned first. Days
+        from today on aren't known and aren't returned.
+
+        Parameters
+        ----------
+        board: str
+            Trading board.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        engine: str, optional
+            Engine of the board.
+        market: str, optional
+            Market of the board.
+
+        Returns
+        -------
+        array_like
+            Sorted list of dates or `None` if the board has no reference
+            or its history failed to load.
+        """
+        _ref = self.reference(board, engine, market)
+        if _ref is None:
+            return None
+        _last = min(dttill, _MoexClock.today() - timedelta(days=1))
+        if dtfrom <= _last:
+            with self._lock:
+                _open = self._subtractRanges(dtfrom, _last, self.known.get(_ref, []))
+            if _open and self.learn(board, _open[0][0], _open[-1][1], engine, market) is None:
+                return None
+        return self._knownDays(_ref, dtfrom, _last)
+
+    def trim(self, board, dtfrom, dttill, engine = None, market = None):
+        """Trims the range to the first and the last day that is either
+        a trading day or isn't covered by the calendar.
+
+        Parameters
+        ----------
+        board: str
+            Trading board.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        engine: str, optional
+            Engine of the board.
+        market: str, optional
+            Market of the board.
+
+        Returns
+        -------
+        tuple
+            Trimmed range (dtfrom, dttill) or `None` if there are no trading
+            days in the range.
+        """
+        _ref = self.reference(board, engine, market)
+        with self._lock:
+            _known = list(self.known.get(_ref, []))
+            _days = self.days.get(_ref, set())
+            _open = self._subtractRanges(dtfrom, dttill, _known)
+            _trading = [_d for _d in _days if dtfrom <= _d <= dttill]
+        _bounds = [_r[0] for _r in _open] + [_r[1] for _r in _open] + _trading
+        return (min(_bounds), max(_bounds)) if _bounds else None
+
+    def markEmpty(self, key, dtfrom, dttill):
+        """Remembers that the range has no data for the key. Ranges that end
+        today or later aren't remembered.
+
+        Parameters
+        ----------
+        key: tuple
+            Key (ticker, board, kind).
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        """
+        if dttill < _MoexClock.today():
+            with self._lock:
+                self.empty[key] = self._addRange(self.empty.get(key, []), dtfrom, dttill)
+
+    def pending(self, key, board, dtfrom, dttill, engine = None, market = None):
+        """Returns parts of the range that should be requested: the range is
+        trimmed by the calendar and ranges known to be empty are removed.
+
+        Parameters
+        ----------
+        key: tuple
+            Key (ticker, board, kind).
+        board: str
+            Trading board.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        engine: str, optional
+            Engine of the board.
+        market: str, optional
+            Market of the board.
+
+        Returns
+        -------
+        array_like
+            List of (dtfrom, dttill) tuples.
+        """
+        _res = []
+        _tr = self.trim(board, dtfrom, dttill, engine, market)
+        if _tr:
+            with self._lock:
+                _empty = list(self.empty.get(key, []))
+            for _gf, _gt in self._subtractRanges(_tr[0], _tr[1], _empty):
+                _tg = self.trim(board, _gf, _gt, engine, market)
+                if _tg:
+                    _res.append(_tg)
+        return _res
+
+    def clear(self):
+        """Removes all learned days and empty ranges.
+        """
+        with self._lock:
+            self.days.clear()
+            self.known.clear()
+            self.empty.clear()
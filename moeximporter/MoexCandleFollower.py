@@ -0,0 +1,282 @@
+import asyncio
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexCandlePeriods import MoexCandlePeriods
+from .MoexPartialResultError import MoexPartialResultError
+from ._MoexRateLimiter import _MoexRateLimiter
+
+class MoexCandleFollower:
+    """Class MoexCandleFollower implements the tail-follow mode for
+    intraday candles.
+
+    The object keeps the begin time of the last seen candle for every
+    (ticker, board, interval) and requests only candles starting from
+    this time. Only new candles and the changed still-forming candle
+    are emitted, so the traffic per poll doesn't depend on the length
+    of the history.
+
+    Instance of MoexImporter should be created before.
+    """
+    def __init__(self, mi, interval = MoexCandlePeriods.Period1Min, rate = 5.0):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        interval: MoexCandlePeriods, optional
+            Default candle period for followed securities. Default is 1 minute.
+        rate: float, optional
+            Global budget of requests per second for all followed securities.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.interval = interval
+        """Default candle period.
+        """
+        self.limiter = _MoexRateLimiter(rate)
+        """Global rate limiter for polls.
+        """
+        self.targets = {}
+        """Followed securities. Keys are tuples (ticker, board, interval),
+        values keep engine, market, the last seen begin time and the last
+        seen candle.
+        """
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if not isinstance(mi, MoexImporter):
+            print('MoexCandleFollower::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    def addSecurity(self, sec, board = None, interval = None, dtfrom = None):
+        """Adds the security to the list of followed securities.
+
+        Parameters
+        ----------
+        sec: MoexSecurity
+            The security to follow.
+        board: str, optional
+            Follow candles for the specific board. The primary board
+            is used if the parameter is ommited.
+        interval: MoexCandlePeriods, optional
+            Candle period. The default period of the object is used if
+            the parameter is ommited.
+        dtfrom: date or datetime, optional
+            Start following from this time. The current day is used
+            if the parameter is ommited.
+
+        Returns
+        -------
+        tuple
+            Key (ticker, board, interval) of the followed security.
+        """
+        _res = None
+        try:
+            if isinstance(sec, MoexSecurity):
+                _tb = board if board else sec.mainboard
+                _iv = interval if interval else self.interval
+                _dtf = dtfrom if dtfrom else datetime.now().date()
+                if not isinstance(_dtf, datetime):
+                    _dtf = datetime(_dtf.year, _dtf.month, _dtf.day)
+                _res = (sec.seccode, _tb, _iv)
+                with self._lock:
+                    self.targets[_res] = {
+                        'engine': sec.boards[_tb]['engine'],
+                        'market': sec.boards[_tb]['market'],
+                        'begin': _dtf,
+                        'last': None,
+                    }
+            else:
+                print('MoexCandleFollower::addSecurity(): sec should be MoexSecurity', file=sys.stderr)
+        except Exception as e:
+            print('MoexCandleFollower::addSecurity(): ', e, file=sys.stderr)
+        return _res
+
+    def removeSecurity(self, key):
+        """Removes the security from the list of followed securities.
+
+        Parameters
+        ----------
+        key: tuple
+            Key (ticker, board, interval) returned by `addSecurity`.
+        """
+        with self._lock:
+            self.targets.pop(key, None)
+
+    def poll(self, key):
+        """Requests candles for the followed security starting from
+        the last seen candle.
+
+        Parameters
+        ----------
+        key: tuple
+            Key (ticker, board, interval) returned by `addSecurity`.
+
+        Returns
+        -------
+        array_like
+            New candles and the changed last candle as an array of dicts
+            in the format of `MoexSecurity.getCandleQuotesAsArray`. If a
+            request fails, MoexPartialResultError is raised with candles
+            received before the failure; they are already counted as seen,
+            `resume()` polls again.
+        """
+        _res = []
+        _pages = []
+        try:
+            _tg = self.targets[key]
+            _dtf = _tg['begin']
+            _st = 0
+            _isNext = True
+            while _isNext:
+                _isNext = False
+                _pages.append({'start': _st, 'status': 'failed', 'rows': 0, 'attempts': 1})
+                self.limiter.acquire()
+                _tmp = self.mi.getCandles(
+                    engine = _tg['engine'],
+                    market = _tg['market'],
+                    board = key[1],
+                    seccode = key[0],
+                    dtfrom = _dtf,
+                    dttill = (datetime.now() + timedelta(days=1)).date(),
+                    start = _st,
+                    candleperiod = key[2],
+                )
+                if _tmp is None:
+                    raise MoexPartialResultError(f'{key[0]:s}: page {_st:d} of candles failed', _res, _pages, lambda: self.poll(key))
+                for _ti in _tmp:
+                    if 'candles' in _ti:
+                        _thq = MoexSecurity._parseCandles(_ti['candles'])
+                        _st += self.mi.limit
+                        for _cd in _thq:
+                            if _cd['begin'] > _tg['begin'] or (_cd['begin'] == _tg['begin'] and _cd != _tg['last']):
+                                _res.append(_cd)
+                                _tg['begin'] = _cd['begin']
+                                _tg['last'] = _cd
+                        _pages[-1]['status'] = 'ok'
+                        _pages[-1]['rows'] = len(_thq)
+                        if len(_thq) == self.mi.limit:
+                            _isNext = True
+        except MoexPartialResultError:
+            raise
+        except Exception as e:
+            print('MoexCandleFollower::poll(): ', e, file=sys.stderr)
+        return _res
+
+    def _pollSafe(self, key):
+        """Internal method polls the security for cycles. Candles received
+        before a failed request are returned, the failure is reported and
+        the next cycle continues from the last seen candle.
+        """
+        try:
+            return self.poll(key)
+        except MoexPartialResultError as e:
+            print('MoexCandleFollower::poll(): ', e, file=sys.stderr)
+            return e.rows
+
+    def pollAll(self, period = 0):
+        """Polls all followed securities once. Polls are spread evenly over
+        `period` seconds and never exceed the global rate budget.
+
+        Parameters
+        ----------
+        period: float, optional
+            Time in seconds to spread polls over. Polls are sent as fast
+            as the rate budget allows if the parameter is ommited.
+
+        Returns
+        -------
+        generator
+            Pairs (key, candle) for new and changed candles.
+        """
+        with self._lock:
+            _keys = list(self.targets.keys())
+        _t0 = time.monotonic()
+        _step = period / len(_keys) if _keys else 0
+        for _i, _key in enumerate(_keys):
+            if self._stop.is_set():
+                break
+            _wait = _t0 + _i * _step - time.monotonic()
+            if _wait > 0:
+                self._stop.wait(_wait)
+            if _key in self.targets:
+                for _cd in self._pollSafe(_key):
+                    yield _key, _cd
+
+    def run(self, callback, period = 60, cycles = None):
+        """Polls followed securities in cycles and passes new and changed
+        candles to the callback. Blocks until `stop` is called or the
+        number of cycles is reached.
+
+        Parameters
+        ----------
+        callback: callable
+            Function called as `callback(key, candle)` for every new or
+            changed candle.
+        period: float, optional
+            Duration of one cycle in seconds. Default is 60 seconds.
+        cycles: int, optional
+            Number of cycles to run. Runs until `stop` if the parameter is
+            ommited.
+        """
+        self._stop.clear()
+        _cycle = 0
+        while not self._stop.is_set() and (cycles is None or _cycle < cycles):
+            _t0 = time.monotonic()
+            for _key, _cd in self.pollAll(period):
+                try:
+                    callback(_key, _cd)
+                except Exception as e:
+                    print('MoexCandleFollower::run(): ', e, file=sys.stderr)
+            _cycle += 1
+            _wait = _t0 + period - time.monotonic()
+            if _wait > 0 and (cycles is None or _cycle < cycles):
+                self._stop.wait(_wait)
+
+    async def stream(self, period = 60, cycles = None):
+        """Asynchronous version of `run`. Polls are executed in the default
+        executor of the running loop.
+
+        Parameters
+        ----------
+        period: float, optional
+            Duration of one cycle in seconds. Default is 60 seconds.
+        cycles: int, optional
+            Number of cycles to run. Runs until `stop` if the parameter is
+            ommited.
+
+        Returns
+        -------
+        async_generator
+            Pairs (key, candle) for new and changed candles.
+        """
+        _loop = asyncio.get_running_loop()
+        self._stop.clear()
+        _cycle = 0
+        while not self._stop.is_set() and (cycles is None or _cycle < cycles):
+            _t0 = _loop.time()
+            with self._lock:
+                _keys = list(self.targets.keys())
+            _step = period / len(_keys) if _keys else 0
+            for _i, _key in enumerate(_keys):
+                if self._stop.is_set():
+                    break
+                _wait = _t0 + _i * _step - _loop.time()
+                if _wait > 0:
+                    await asyncio.sleep(_wait)
+                if _key in self.targets:
+                    for _cd in await _loop.run_in_executor(None, self._pollSafe, _key):
+                        yield _key, _cd
+            _cycle += 1
+            _wait = _t0 + period - _loop.time()
+            if _wait > 0 and (cycles is None or _cycle < cycles):
+                await asyncio.sleep(_wait)
+
+    def stop(self):
+        """Stops `run` or `stream` after the current poll.
+        """
+        self._stop.set()
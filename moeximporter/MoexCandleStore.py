@@ -0,0 +1,321 @@
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from .MoexSecurity import MoexSecurity
+from .MoexCandlePeriods import MoexCandlePeriods
+from .MoexPartialResultError import MoexPartialResultError
+
+class MoexCandleStore:
+    """Class MoexCandleStore implements a storage for candles in fixed-width
+    binary columns that are read through `numpy.memmap`.
+
+    Every (board, ticker, interval) is stored in a separate directory with
+    one file per column:
+    'begin' - int64, seconds since epoch of the candle begin time,
+    'open', 'high', 'low', 'close', 'value' - float64,
+    'quantity' - int64.
+    Missing float values are stored as NaN, missing quantity as 0.
+    The file 'index' keeps begin time of every `index_step`-th row and is used
+    to narrow the binary search. Rows are sorted by begin time and only
+    appended, so range queries are zero-copy slices of memory-mapped files.
+    """
+    columns = [
+        ('begin', '<i8'),
+        ('open', '<f8'),
+        ('high', '<f8'),
+        ('low', '<f8'),
+        ('close', '<f8'),
+        ('value', '<f8'),
+        ('quantity', '<i8'),
+    ]
+    """Stored columns and their binary types.
+    """
+    index_step = 1024
+    """Number of rows per time index entry.
+    """
+
+    def __init__(self, path):
+        """Class constructor.
+
+        Parameters
+        ----------
+        path: str
+            Root directory of the storage. It is created if doesn't exist.
+        """
+        self.path = path
+        """Root directory of the storage.
+        """
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _dir(self, seccode, board, interval):
+        """Internal method returns the directory for the instrument.
+        """
+        return os.path.join(self.path, board, seccode, MoexCandlePeriods(interval).name)
+
+    def _rows(self, _dir):
+        """Internal method returns the number of complete rows. Columns that
+        are longer after an interrupted append are truncated.
+        """
+        _res = None
+        for _cn, _ct in self.columns:
+            _fn = os.path.join(_dir, _cn)
+            _n = os.path.getsize(_fn) // np.dtype(_ct).itemsize if os.path.exists(_fn) else 0
+            _res = _n if _res is None else min(_res, _n)
+        for _cn, _ct in self.columns:
+            _fn = os.path.join(_dir, _cn)
+            if os.path.exists(_fn) and os.path.getsize(_fn) > _res * np.dtype(_ct).itemsize:
+                with open(_fn, 'r+b') as _f:
+                    _f.truncate(_res * np.dtype(_ct).itemsize)
+        return _res
+
+    def _column(self, _dir, name, rows, mode = 'r'):
+        """Internal method returns the memory-mapped column.
+        """
+        _ct = dict(self.columns)[name]
+        return np.memmap(os.path.join(_dir, name), dtype=_ct, mode=mode, shape=(rows,))
+
+    def lastBegin(self, seccode, board, interval):
+        """Returns begin time of the last stored candle.
+
+        Parameters
+        ----------
+        seccode: str
+            Security ticker.
+        board: str
+            Trading board.
+        interval: MoexCandlePeriods
+            Candle period.
+
+        Returns
+        -------
+        datetime
+            Begin time of the last candle or `None` if there are no candles.
+        """
+        _res = None
+        try:
+            _dir = self._dir(seccode, board, interval)
+            _n = self._rows(_dir)
+            if _n:
+                _res = self._column(_dir, 'begin', _n)[-1].astype('datetime64[s]').item()
+        except Exception as e:
+            print('MoexCandleStore::lastBegin(): ', e, file=sys.stderr)
+        return _res
+
+    def append(self, seccode, board, interval, candles):
+        """Appends candles to the storage. Candles before the last stored one
+        are ignored, the candle with the same begin time as the last stored one
+        replaces it (the last candle may be still forming).
+
+        Parameters
+        ----------
+        seccode: str
+            Security ticker.
+        board: str
+            Trading board.
+        interval: MoexCandlePeriods
+            Candle period.
+        candles: array_like
+            Candles as an array of dicts in the format of
+            `MoexSecurity.getCandleQuotesAsArray`.
+
+        Returns
+        -------
+        int
+            Number of rows appended.
+        """
+        _res = 0
+        try:
+            if candles:
+                _new = {
+                    _cn: np.array([_c[_cn] for _c in candles], dtype='datetime64[s]').astype(_ct) if _cn == 'begin'
+                    else np.array([_c[_cn] if _c[_cn] is not None and _c[_cn] == _c[_cn] else 0 for _c in candles], dtype=_ct) if np.dtype(_ct).kind == 'i'
+                    else np.array([_c[_cn] if _c[_cn] is not None else np.nan for _c in candles], dtype=_ct)
+                    for _cn, _ct in self.columns
+                }
+                _order = np.argsort(_new['begin'], kind='stable')
+                _new = {_cn: _new[_cn][_order] for _cn in _new}
+                _dir = self._dir(seccode, board, interval)
+                with self._lock:
+                    os.makedirs(_dir, exist_ok=True)
+                    _n = self._rows(_dir)
+                    if _n:
+                        _last = self._column(_dir, 'begin', _n)[-1]
+                        _pos = np.searchsorted(_new['begin'], _last, side='left')
+                        if _pos < len(_new['begin']) and _new['begin'][_pos] == _last:
+                            for _cn, _ct in self.columns:
+                                _col = self._column(_dir, _cn, _n, mode='r+')
+                                _col[-1] = _new[_cn][_pos]
+                                _col.flush()
+                                del _col
+                            _pos += 1
+                        _new = {_cn: _new[_cn][_pos:] for _cn in _new}
+                    _keep = np.ones(len(_new['begin']), dtype=bool)
+                    _keep[1:] = _new['begin'][1:] != _new['begin'][:-1]
+                    _new = {_cn: _new[_cn][_keep] for _cn in _new}
+                    if len(_new['begin']):
+                        for _cn, _ct in self.columns:
+                            with open(os.path.join(_dir, _cn), 'ab') as _f:
+                                _f.write(_new[_cn].tobytes())
+                        _res = len(_new['begin'])
+                        self._updateIndex(_dir, _n + _res)
+        except Exception as e:
+            print('MoexCandleStore::append(): ', e, file=sys.stderr)
+        return _res
+
+    def _updateIndex(self, _dir, rows):
+        """Internal method appends new entries to the time index.
+        """
+        _fn = os.path.join(_dir, 'index')
+        _ni = os.path.getsize(_fn) // 8 if os.path.exists(_fn) else 0
+        _begin = self._column(_dir, 'begin', rows)
+        _idx = np.asarray(_begin[_ni * self.index_step::self.index_step])
+        if len(_idx):
+            with open(_fn, 'ab') as _f:
+                _f.write(_idx.astype('<i8').tobytes())
+
+    def _bounds(self, _dir, rows, dtfrom, dttill):
+        """Internal method finds rows for the time range with the time index.
+        """
+        _begin = self._column(_dir, 'begin', rows)
+        _fn = os.path.join(_dir, 'index')
+        _ni = os.path.getsize(_fn) // 8 if os.path.exists(_fn) else 0
+        _index = np.memmap(_fn, dtype='<i8', mode='r', shape=(_ni,)) if _ni else np.empty(0, dtype='<i8')
+
+        def _find(_t, _side):
+            _b = int(np.searchsorted(_index, _t, side=_side))
+            _lo = max(0, (_b - 1) * self.index_step)
+            _hi = min(rows, _b * self.index_step) if _b < _ni else rows
+            return _lo + int(np.searchsorted(_begin[_lo:_hi], _t, side=_side))
+
+        _lo = 0
+        _hi = rows
+        if dtfrom is not None:
+            _lo = _find(self._timestamp(dtfrom, False), 'left')
+        if dttill is not None:
+            _hi = _find(self._timestamp(dttill, True), 'right')
+        return _lo, max(_lo, _hi)
+
+    @staticmethod
+    def _timestamp(dt, till):
+        """Internal method converts date or datetime to seconds since epoch.
+        The end of the day is used for the right bound set by date.
+        """
+        if isinstance(dt, datetime):
+            return np.datetime64(dt, 's').astype('<i8')
+        _res = np.datetime64(dt, 's').astype('<i8')
+        if till and isinstance(dt, date):
+            _res += 86399
+        return _res
+
+    def query(self, seccode, board, interval, dtfrom = None, dttill = None):
+        """Returns candles for the time range as memory-mapped arrays without
+        copying and parsing.
+
+        Parameters
+        ----------
+        seccode: str
+            Security ticker.
+        board: str
+            Trading board.
+        interval: MoexCandlePeriods
+            Candle period.
+        dtfrom: date or datetime, optional
+            The left bound of the range. All candles from the beginning are
+            returned if the parameter is ommited.
+        dttill: date or datetime, optional
+            The right bound of the range. All candles till the end are returned
+            if the parameter is ommited.
+
+        Returns
+        -------
+        dict
+            Arrays by column names. 'begin' is a datetime64[s] array.
+        """
+        _res = None
+        try:
+            _dir = self._dir(seccode, board, interval)
+            _n = self._rows(_dir) if os.path.isdir(_dir) else 0
+            if _n:
+                _lo, _hi = self._bounds(_dir, _n, dtfrom, dttill)
+                _res = {
+                    _cn: self._column(_dir, _cn, _n)[_lo:_hi]
+                    for _cn, _ct in self.columns
+                }
+                _res['begin'] = _res['begin'].view('datetime64[s]')
+            else:
+                _res = {
+                    _cn: np.empty(0, dtype='datetime64[s]' if _cn == 'begin' else _ct)
+                    for _cn, _ct in self.columns
+                }
+        except Exception as e:
+            print('MoexCandleStore::query(): ', e, file=sys.stderr)
+        return _res
+
+    def queryAsDataFrame(self, seccode, board, interval, dtfrom = None, dttill = None):
+        """Returns candles for the time range as a pandas dataframe indexed by
+        'begin'. Arguments are the same as for `query`.
+
+        Returns
+        -------
+        pd.DataFrame
+            Candles as pandas dataframe.
+        """
+        _res = None
+        try:
+            _tmp = self.query(seccode, board, interval, dtfrom, dttill)
+            _res = pd.DataFrame(
+                {_cn: _tmp[_cn] for _cn, _ct in self.columns if _cn != 'begin'},
+                index=pd.Index(_tmp['begin'], name='begin'),
+            )
+        except Exception as e:
+            print('MoexCandleStore::queryAsDataFrame(): ', e, file=sys.stderr)
+        return _res
+
+    def update(self, sec, dtfrom, dttill, board = None, interval = MoexCandlePeriods.Period1Min):
+        """Requests candles for the security that are newer than the last stored
+        one and appends them to the storage.
+
+        Parameters
+        ----------
+        sec: MoexSecurity
+            The security to update.
+        dtfrom: date
+            The left bound of the range if there are no stored candles.
+        dttill: date
+            The right bound of the range.
+        board: str, optional
+            Trading board. The primary board is used if the parameter is ommited.
+        interval: MoexCandlePeriods, optional
+            Candle period. Default is 1 minute.
+
+        Returns
+        -------
+        int
+            Number of rows appended. If a page of candles fails,
+            MoexPartialResultError is raised and nothing is appended;
+            `resume()` of the exception repeats the update from the failed
+            page.
+        """
+        _res = 0
+        try:
+            if isinstance(sec, MoexSecurity):
+                _tb = board if board else sec.mainboard
+                _last = self.lastBegin(sec.seccode, _tb, interval)
+                _dtf = max(dtfrom, _last.date()) if _last else dtfrom
+                if _dtf <= dttill:
+                    _tmp = sec.getCandleQuotesAsArray(dtfrom=_dtf, dttill=dttill, board=_tb, interval=interval)
+                    if _tmp is None:
+                        raise RuntimeError(f'request failed for {sec.seccode:s}')
+                    _res = self.append(sec.seccode, _tb, interval, _tmp)
+            else:
+                print('MoexCandleStore::update(): sec should be MoexSecurity', file=sys.stderr)
+        except MoexPartialResultError as e:
+            e._resume = lambda: self.update(sec, dtfrom, dttill, board=board, interval=interval)
+            raise
+        except Exception as e:
+            print('MoexCandleStore::update(): ', e, file=sys.stderr)
+        return _res
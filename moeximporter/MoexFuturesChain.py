@@ -0,0 +1,348 @@
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexSessions import MoexSessions
+
+class MoexFuturesChain:
+    """Class MoexFuturesChain implements loading of the whole chain of
+    futures contracts for an underlying asset and stitching of contracts
+    into a continuous series.
+
+    Every contract is used during its active window: from the roll date
+    of the previous contract till its own roll date. The roll date is
+    `roll_days` business days before the last trade date. Histories are
+    requested in parallel for active windows only. Histories of expired
+    contracts never change, so they are cached permanently.
+
+    Instance of MoexImporter should be created before.
+    """
+    price_columns = ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'WAPRICE', 'SETTLEPRICE']
+    """Price columns to adjust.
+    """
+
+    def __init__(self, mi, cache_dir = None, workers = 8, board = 'RFUD', retries = 3):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        cache_dir: str, optional
+            Directory to keep histories of expired contracts between sessions.
+            Histories are cached only in memory if the parameter is ommited.
+        workers: int, optional
+            Number of parallel requests.
+        board: str, optional
+            Trading board of futures. Default is 'RFUD'.
+        retries: int, optional
+            Number of repeated requests of a failed page.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.cache_dir = cache_dir
+        """Directory of the persistent cache.
+        """
+        self.workers = workers
+        """Number of parallel requests.
+        """
+        self.board = board
+        """Trading board of futures.
+        """
+        self.retries = retries
+        """Number of repeated requests of a failed page.
+        """
+        self.retry_delay = 1.0
+        """Delay before the first repeated request in seconds. It's doubled
+        for every next attempt.
+        """
+        self.cache = {}
+        """Cached histories of expired contracts by ticker. Values keep the
+        window and rows.
+        """
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        if not isinstance(mi, MoexImporter):
+            print('MoexFuturesChain::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    def contracts(self, asset, roll_days = 0):
+        """Returns contracts of the underlying asset with their active windows.
+
+        Parameters
+        ----------
+        asset: str
+            Code of the underlying asset, e.g. 'Si' or 'RI'.
+        roll_days: int, optional
+            Number of business days before the last trade date to roll to
+            the next contract.
+
+        Returns
+        -------
+        pd.DataFrame
+            Contracts sorted by the last trade date with columns:
+            'SECID' - ticker of the contract,
+            'LASTTRADEDATE' - last trade date,
+            'DTFROM' - the first day of the active window,
+            'DTTILL' - roll date, the last day of the active window.
+        """
+        _res = None
+        try:
+            _tmp = self.mi.getFuturesSeries(asset, expired=True)
+            _rows = []
+            for _r in _tmp:
+                _r = {_k.lower(): _v for _k, _v in _r.items()}
+                _ltd = _r.get('lasttradedate') or _r.get('expirationdate')
+                if _r.get('secid') and _ltd:
+                    _rows.append((_r['secid'], datetime.strptime(_ltd[:10], '%Y-%m-%d').date()))
+            _rows.sort(key=lambda _r: (_r[1], _r[0]))
+            _ltd = np.array([_r[1] for _r in _rows], dtype='datetime64[D]')
+            _roll = np.busday_offset(_ltd, -roll_days, roll='backward') if roll_days else _ltd
+            _from = np.empty_like(_roll)
+            if len(_roll):
+                _from[0] = _ltd[0] - np.timedelta64(366, 'D')
+                _from[1:] = _roll[:-1]
+            _res = pd.DataFrame({
+                'SECID': [_r[0] for _r in _rows],
+                'LASTTRADEDATE': _ltd,
+                'DTFROM': _from,
+                'DTTILL': _roll,
+            })
+        except Exception as e:
+            print('MoexFuturesChain::contracts(): ', e, file=sys.stderr)
+        return _res
+
+    def _cached(self, secid, dtfrom, dttill):
+        """Internal method returns cached rows of the expired contract if they
+        cover the window.
+        """
+        with self._lock:
+            _res = self.cache.get(secid)
+        if _res is None and self.cache_dir:
+            _fn = os.path.join(self.cache_dir, secid + '.json')
+            if os.path.exists(_fn):
+                with open(_fn, 'r', encoding='utf-8') as _f:
+                    _res = json.load(_f)
+                for _r in _res['rows']:
+                    _r['TRADEDATE'] = date.fromisoformat(_r['TRADEDATE'])
+                with self._lock:
+                    self.cache[secid] = _res
+        if _res is not None and (_res['dtfrom'] > dtfrom.isoformat() or _res['dttill'] < dttill.isoformat()):
+            _res = None
+        return _res
+
+    def _store(self, secid, dtfrom, dttill, rows):
+        """Internal method saves history of the expired contract to memory and disk.
+        """
+        _entry = {'dtfrom': dtfrom.isoformat(), 'dttill': dttill.isoformat(), 'rows': rows}
+        with self._lock:
+            self.cache[secid] = _entry
+        if self.cache_dir:
+            _fn = os.path.join(self.cache_dir, secid + '.json')
+            with open(_fn + '.tmp', 'w', encoding='utf-8') as _f:
+                json.dump(dict(_entry, rows=[dict(_r, TRADEDATE=_r['TRADEDATE'].isoformat()) for _r in rows]), _f)
+            os.replace(_fn + '.tmp', _fn)
+
+    def _fetch(self, secid, dtfrom, dttill):
+        """Internal method requests all pages of history of the contract by
+        `MoexSecurity._loadPages`. If a page still fails after retries,
+        MoexPartialResultError of the contract is raised, so truncated
+        history is never cached.
+        """
+        _sec = MoexSecurity(secid, self.mi, cache_rows=0, retries=self.retries)
+        _sec.retry_delay = self.retry_delay
+        return _sec._loadPages(
+            ('history', self.board, MoexSessions.MainSession, dtfrom, dttill),
+            lambda _st: self.mi.getHistoryQuotes(
+                engine = 'futures',
+                market = 'forts',
+                board = self.board,
+                seccode = secid,
+                dtfrom = dtfrom,
+                dttill = dttill,
+                tsession = MoexSessions.MainSession,
+                start = _st,
+            ),
+            'history',
+            lambda _h: MoexSecurity._parseHistory(_h, keys=('SETTLEPRICE', 'OPENPOSITION')),
+            [],
+        )
+
+    def _contractHistory(self, secid, dtfrom, dttill, expired):
+        """Internal method returns history of the contract for the window.
+        Expired contracts are taken from the cache when possible.
+        """
+        if expired:
+            _tmp = self._cached(secid, dtfrom, dttill)
+            if _tmp is None:
+                _rows = self._fetch(secid, dtfrom, dttill)
+                self._store(secid, dtfrom, dttill, _rows)
+            else:
+                _rows = _tmp['rows']
+        else:
+            _rows = self._fetch(secid, dtfrom, dttill)
+        return [_r for _r in _rows if dtfrom <= _r['TRADEDATE'] <= dttill]
+
+    def load(self, asset, dtfrom, dttill, roll_days = 0):
+        """Loads histories of contracts of the underlying asset that were
+        active in the range.
+
+        Parameters
+        ----------
+        asset: str
+            Code of the underlying asset, e.g. 'Si' or 'RI'.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        roll_days: int, optional
+            Number of business days before the last trade date to roll to
+            the next contract.
+
+        Returns
+        -------
+        pd.DataFrame
+            History quotes of contracts within their active windows indexed by
+            ('SECID', 'TRADEDATE'). Contracts are ordered by the last trade date,
+            the roll date is included into windows of both contracts.
+            Contracts that failed to load are listed with error messages in
+            `attrs['errors']`, all contracts of the range in the chain order
+            in `attrs['contracts']`.
+        """
+        _res = None
+        try:
+            _chain = self.contracts(asset, roll_days=roll_days)
+            _today = date.today()
+            _chain = _chain[(_chain['DTTILL'] >= np.datetime64(dtfrom, 'D')) & (_chain['DTFROM'] <= np.datetime64(dttill, 'D'))]
+            _hist = {}
+            _errors = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _futures = {}
+                for _c in _chain.itertuples():
+                    _expired = _c.LASTTRADEDATE.date() < _today
+                    _wf = _c.DTFROM.date()
+                    _wt = _c.DTTILL.date() if _expired else min(_c.DTTILL.date(), _today)
+                    _futures[_pool.submit(self._contractHistory, _c.SECID, _wf, _wt, _expired)] = _c.SECID
+                for _f in concurrent.futures.as_completed(_futures):
+                    try:
+                        _hist[_futures[_f]] = _f.result()
+                    except Exception as e:
+                        _errors[_futures[_f]] = str(e)
+                        print('MoexFuturesChain::load(): ', _futures[_f], e, file=sys.stderr)
+            _frames = [
+                pd.DataFrame.from_dict(data=_hist[_sc]).assign(SECID=_sc)
+                for _sc in _chain['SECID'] if _sc in _hist and _hist[_sc]
+            ]
+            if _frames:
+                _res = pd.concat(_frames, ignore_index=True)
+                _res = _res[(_res['TRADEDATE'] >= dtfrom) & (_res['TRADEDATE'] <= dttill)]
+                _res.set_index(['SECID', 'TRADEDATE'], inplace=True)
+            else:
+                _res = pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['SECID', 'TRADEDATE']))
+            _res.attrs['errors'] = _errors
+            _res.attrs['contracts'] = list(_chain['SECID'])
+        except Exception as e:
+            print('MoexFuturesChain::load(): ', e, file=sys.stderr)
+        return _res
+
+    def continuous(self, asset, dtfrom, dttill, method = 'back', roll_days = 0, field = 'SETTLEPRICE'):
+        """Returns the continuous series of the underlying asset stitched from
+        consecutive contracts.
+
+        Parameters
+        ----------
+        asset: str
+            Code of the underlying asset, e.g. 'Si' or 'RI'.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        method: str, optional
+            'back' - prices of older contracts are shifted by the price gaps
+            at roll dates, 'ratio' - prices are multiplied by the ratios at
+            roll dates, 'none' - contracts are joined without adjustment.
+        roll_days: int, optional
+            Number of business days before the last trade date to roll to
+            the next contract.
+        field: str, optional
+            Price used to measure the gap at roll dates.
+
+        Returns
+        -------
+        pd.DataFrame
+            Series indexed by 'TRADEDATE' with adjusted prices, other columns
+            of history quotes and 'SECID' of the contract used on the date.
+            The contract is switched on the roll date. Contracts that failed
+            to load are listed in `attrs['errors']`; the gap over such a hole
+            is unknown and isn't adjusted, contracts are joined there as is.
+        """
+        _res = None
+        try:
+            _hist = self.load(asset, dtfrom, dttill, roll_days=roll_days)
+            _res = self.stitch(_hist, method=method, field=field)
+        except Exception as e:
+            print('MoexFuturesChain::continuous(): ', e, file=sys.stderr)
+        return _res
+
+    @classmethod
+    def stitch(cls, history, method = 'back', field = 'SETTLEPRICE'):
+        """Builds the continuous series from histories of contracts returned
+        by `load`. Arguments are the same as for `continuous`.
+
+        Returns
+        -------
+        pd.DataFrame
+            Continuous series as in `continuous`.
+        """
+        _df = history.reset_index()
+        _order = pd.unique(_df['SECID'])
+        _n = pd.Categorical(_df['SECID'], categories=_order).codes
+        _dates = _df['TRADEDATE'].to_numpy(dtype='datetime64[D]')
+        _price = pd.to_numeric(_df[field], errors='coerce').to_numpy(dtype='float64')
+        _last = pd.Series(_dates).groupby(_n).transform('max').to_numpy(dtype='datetime64[D]')
+        _k = len(_order)
+        # the last and the first valid prices of every contract, windows of
+        # consecutive contracts overlap on the roll date
+        _vs = np.lexsort((_dates, _n))
+        _vs = _vs[~np.isnan(_price[_vs])]
+        _lp = np.full(_k, np.nan)
+        _fp = np.full(_k, np.nan)
+        _lp[_n[_vs]] = _price[_vs]
+        _fp[_n[_vs[::-1]]] = _price[_vs[::-1]]
+        _old = _lp[:-1]
+        _new = _fp[1:]
+        _ok = ~np.isnan(_old) & ~np.isnan(_new) & (_old != 0)
+        _gap = np.zeros(_k)
+        _ratio = np.ones(_k)
+        # no gap is measured across a contract that is missing in the history
+        _chain = {_sc: _i for _i, _sc in enumerate(history.attrs.get('contracts', _order))}
+        _pos = np.array([_chain[_sc] for _sc in _order])
+        _ok &= _pos[1:] - _pos[:-1] == 1
+        _gap[:-1] = np.where(_ok, _new - _old, 0.0)
+        _ratio[:-1] = np.where(_ok, _new / np.where(_ok, _old, 1.0), 1.0)
+        # the contract is replaced by the next one on its last day (roll date)
+        _use = (_dates < _last) | (_n == _k - 1)
+        _out = _df[_use].copy()
+        _on = _n[_use]
+        _cols = [_c for _c in cls.price_columns if _c in _out.columns]
+        if method == 'back':
+            _adj = np.cumsum(_gap[::-1])[::-1]
+            for _c in _cols:
+                _out[_c] = pd.to_numeric(_out[_c], errors='coerce').to_numpy(dtype='float64') + _adj[_on]
+        elif method == 'ratio':
+            _adj = np.cumprod(_ratio[::-1])[::-1]
+            for _c in _cols:
+                _out[_c] = pd.to_numeric(_out[_c], errors='coerce').to_numpy(dtype='float64') * _adj[_on]
+        elif method != 'none':
+            raise ValueError(f'unknown method {method}')
+        _out.sort_values(['TRADEDATE'], inplace=True, kind='stable')
+        _out.set_index('TRADEDATE', inplace=True)
+        _out.attrs = {'errors': dict(history.attrs.get('errors', {}))}
+        return _out
@@ -1,11 +1,20 @@
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
 import json
-import ssl
 import sys
+import pandas as pd
+from datetime import date
 
 from ._MoexRequests import _MoexRequests
+from ._MoexHttp import _MoexTimeoutHandler
 
 class MoexImporter:
     """Class MoexImporter implements https-queries to MOEX ISS API.
@@ -21,7 +30,9 @@ class MoexImporter:
             header = {
                 'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0) Gecko/20100101 Firefox/42.0',
             },
-            loadinfo = False
+            loadinfo = False,
+            snapshot = None,
+            snapshot_ttl = 86400,
         ):
         """Class constructor initializes base variables and load information about
         engines and markets if flag `_loadinfo` is `True`
@@ -33,6 +44,12 @@ class MoexImporter:
         loadinfo: boolean, optional
             If `True`, engines and markets lists are requested from MOEX ISS. You may get
             this information later with methods getEngines and getMarkets.
+        snapshot: str, optional
+            Path to the snapshot of reference data. If the snapshot exists, engines,
+            markets and security descriptions are loaded from it instead of MOEX ISS.
+            Otherwise, if `loadinfo` is `True`, the loaded information is saved to it.
+        snapshot_ttl: int, optional
+            Age of the snapshot in seconds after which it's refreshed in the background.
         
         """
 
@@ -55,6 +72,7 @@ class MoexImporter:
             _MoexRequests.GetEngines: {
                 'postfix': '/engines.json',
                 'postfix_params': [],
+                'revalidate': True,
                 'params': {},
             },
             _MoexRequests.GetMarkets: {
@@ -62,11 +80,13 @@ class MoexImporter:
                 'postfix_params': [
                     '__ENGINE__',
                 ],
+                'revalidate': True,
                 'params': {},
             },
             _MoexRequests.GetSecuritiesAll: {
                 'postfix': '/securities.json',
                 'postfix_params': [],
+                'revalidate': True,
                 'params': {
                     'start': 'd',
                     'is_trading': 's',
@@ -75,6 +95,7 @@ class MoexImporter:
             _MoexRequests.GetSecuritiesForEngine: {
                 'postfix': '/securities.json',
                 'postfix_params': [],
+                'revalidate': True,
                 'params': {
                     'start': 'd',
                     'is_trading': 's',
@@ -84,6 +105,7 @@ class MoexImporter:
             _MoexRequests.GetSecuritiesForMarket: {
                 'postfix': '/securities.json',
                 'postfix_params': [],
+                'revalidate': True,
                 'params': {
                     'start': 'd',
                     'is_trading': 's',
@@ -94,6 +116,7 @@ class MoexImporter:
             _MoexRequests.GetSecuritiesSearch: {
                 'postfix': '/securities.json',
                 'postfix_params': [],
+                'revalidate': True,
                 'params': {
                     'start': 'd',
                     'is_trading': 's',
@@ -105,8 +128,55 @@ class MoexImporter:
                 'postfix_params': [
                     '__SECCODE__',
                 ],
+                'revalidate': True,
                 'params': {},
             },
+            _MoexRequests.GetBondization: {
+                'postfix': '/securities/__SECCODE__/bondization.json',
+                'postfix_params': [
+                    '__SECCODE__',
+                ],
+                'params': {
+                    'iss.only': 's',
+                    'start': 'd',
+                    'limit': 'd',
+                },
+            },
+            _MoexRequests.GetDividends: {
+                'postfix': '/securities/__SECCODE__/dividends.json',
+                'postfix_params': [
+                    '__SECCODE__',
+                ],
+                'params': {},
+            },
+            _MoexRequests.GetSplits: {
+                'postfix': '/statistics/engines/stock/splits/__SECCODE__.json',
+                'postfix_params': [
+                    '__SECCODE__',
+                ],
+                'params': {},
+            },
+            _MoexRequests.GetFuturesSeries: {
+                'postfix': '/statistics/engines/futures/markets/forts/series.json',
+                'postfix_params': [],
+                'params': {
+                    'asset_code': 's',
+                    'show_expired': 'd',
+                },
+            },
+            _MoexRequests.GetBoardSecurities: {
+                'postfix': '/engines/__ENGINE__/markets/__MARKET__/boards/__BOARD__/securities.json',
+                'postfix_params': [
+                    '__ENGINE__',
+                    '__MARKET__',
+                    '__BOARD__',
+                ],
+                'params': {
+                    'iss.only': 's',
+                    'securities.columns': 's',
+                    'marketdata.columns': 's',
+                },
+            },
             _MoexRequests.GetHistoryQuotes: {
                 'postfix': '/history/engines/__ENGINE__/markets/__MARKET__/boards/__BOARD__/securities/__SECCODE__.json',
                 'postfix_params': [
@@ -123,6 +193,20 @@ class MoexImporter:
                     'limit': 'd',
                 },
             },
+            _MoexRequests.GetBoardHistoryQuotes: {
+                'postfix': '/history/engines/__ENGINE__/markets/__MARKET__/boards/__BOARD__/securities.json',
+                'postfix_params': [
+                    '__ENGINE__',
+                    '__MARKET__',
+                    '__BOARD__',
+                ],
+                'params': {
+                    'date': '%Y-%m-%d',
+                    'start': 'd',
+                    'tradingsession': 'd',
+                    'limit': 'd',
+                },
+            },
             _MoexRequests.GetCandleQuotes: {
                 'postfix': '/engines/__ENGINE__/markets/__MARKET__/boards/__BOARD__/securities/__SECCODE__/candles.json',
                 'postfix_params': [
@@ -132,29 +216,109 @@ class MoexImporter:
                     '__BOARD__',
                 ],
                 'params': {
-                    'from': '%Y-%m-%d',
+                    'from': '%Y-%m-%d %H:%M:%S',
                     'till': '%Y-%m-%d',
                     'interval': 'd',
                     'start': 'd',
                 },
             },
+            _MoexRequests.GetTrades: {
+                'postfix': '/engines/__ENGINE__/markets/__MARKET__/boards/__BOARD__/securities/__SECCODE__/trades.json',
+                'postfix_params': [
+                    '__ENGINE__',
+                    '__MARKET__',
+                    '__SECCODE__',
+                    '__BOARD__',
+                ],
+                'params': {
+                    'tradeno': 'd',
+                    'next_trade': 'd',
+                    'limit': 'd',
+                },
+            },
         }
         """Requests library.
         """
         self.method = 'GET'
         """Request method.
         """
+        self.board_snapshots = collections.OrderedDict()
+        """The last snapshots of boards by (engine, market, board). Used to return
+        changed rows only.
+        """
+        self.max_board_snapshots = 32
+        """Maximum number of boards in `board_snapshots`. Snapshots of the least
+        recently requested boards are evicted first.
+        """
+        self.revalidate = True
+        """If `True`, replies of rarely changed requests (engines, markets, securities
+        lists and descriptions) are cached with their validators and revalidated
+        with `If-None-Match`/`If-Modified-Since` headers.
+        """
+        self.response_cache = collections.OrderedDict()
+        """Cache of revalidated replies by url. Values keep validators, content hash
+        and decoded body. Cached bodies are shared between calls and shouldn't be modified.
+        """
+        self.max_response_cache = 1024
+        """Maximum number of replies in `response_cache`. The least recently used
+        replies are evicted first.
+        """
+        self._cache_lock = threading.Lock()
+        self.shared_cache = None
+        """Optional cache of raw replies shared by processes and hosts. It should
+        implement methods `get(url)` returning the raw reply or `None` and
+        `put(url, raw)`. Used for requests that aren't revalidated.
+        """
+        self.rate_limiter = None
+        """Optional rate limiter shared by all requests of the object. It should
+        implement method `acquire()` that blocks until the next request is allowed.
+        """
+        self.connect_timeout = 10.0
+        """Timeout to connect to MOEX ISS in seconds.
+        """
+        self.read_timeout = 30.0
+        """Timeout to wait for the reply data in seconds.
+        """
+        self.hedge = False
+        """If `True`, a duplicate request is sent when the reply is slower than
+        `hedge_quantile` of recent requests; the first reply is used.
+        """
+        self.hedge_quantile = 0.95
+        """Quantile of recent latencies that triggers the duplicate request.
+        """
+        self.hedge_min_samples = 20
+        """Number of measured requests required before hedging starts.
+        """
+        self.hedged = 0
+        """Number of duplicate requests sent.
+        """
+        self.latencies = collections.deque(maxlen=500)
+        """Latencies of recent successful requests in seconds.
+        """
+        self._latency_lock = threading.Lock()
+        self._hedge_pool = None
+        self._local = threading.local()
+        self.calendar = None
+        """Optional MoexCalendar object. If it's set, requests of quotes and
+        candles are trimmed by trading days and ranges known to be empty
+        aren't requested.
+        """
         self.engines = []
         """Engines.
         """
         self.markets = {}
         """Markets.
         """
-        if loadinfo:
-            self.engines = self.getEngines()
-            if self.engines:
-                for _en in self.engines:
-                    self.markets[_en['name']] = self.getMarkets(_en['name'])
+        self.securities = {}
+        """Security descriptions and boards by ticker loaded from the snapshot.
+        `getSecurity` returns them without requests.
+        """
+        self.snapshot_refresh = None
+        """Thread refreshing the stale snapshot or `None`.
+        """
+        if not (snapshot and self.loadSnapshot(snapshot, snapshot_ttl)) and loadinfo:
+            if self.loadInfo() and snapshot:
+                self.saveSnapshot(snapshot)
                        
     def _MoexRequest(self, _type, _pparams = None, _params = None):
         """Internal method for standartize https-queries to MOEX ISS.  
@@ -198,38 +362,356 @@ class MoexImporter:
             More information you can find on https://iss.moex.com/iss/reference/
         """
         _res = None
-        _values = self.base_values.copy()
+        self._local.status = None
         try:
-            _mr = self.requests_dictionary[_type]
-            _url = self.base_url + _mr['postfix']
-            _rpp = _mr['postfix_params']
-            if _pparams:
-                for _ppkey in _pparams:
-                    if _ppkey in _rpp:
-                        _url = _url.replace(_ppkey, _pparams[_ppkey]) 
-            _rp = _mr['params']
-            if _params:
-                for _pp in _params:
-                    if _pp in _rp:
-                        _values[_pp] = f'{_params[_pp]:{_rp[_pp]:s}}'
-            _data = urllib.parse.urlencode(_values)
-            _url += f'?{_data:s}'
-            _req = urllib.request.Request(_url, headers=self.base_header, method = self.method)
-            _resp = None
-            try:
-                _resp = urllib.request.urlopen(_req, context=ssl._create_unverified_context())
-            except urllib.error.HTTPError as e:
-                print('_MoexRequest(): HTTP Error ', e.code)
-            except urllib.error.URLError as e:
-                print('_MoexRequest(): Error ', e.reason)
+            _url = self._MoexUrl(_type, _pparams, _params)
+            _headers = dict(self.base_header)
+            _cached = None
+            if self.revalidate and self.requests_dictionary[_type].get('revalidate'):
+                with self._cache_lock:
+                    _cached = self.response_cache.get(_url)
+                    if _cached:
+                        self.response_cache.move_to_end(_url)
+                if _cached:
+                    if _cached['etag']:
+                        _headers['If-None-Match'] = _cached['etag']
+                    if _cached['last_modified']:
+                        _headers['If-Modified-Since'] = _cached['last_modified']
+            _shared = self.shared_cache if not self.requests_dictionary[_type].get('revalidate') else None
+            _raw = _shared.get(_url) if _shared is not None else None
+            if _raw is not None:
+                _res = json.loads(_raw)
             else:
-                _res = json.load(_resp)
-            if _resp:
-                _resp.close()
+                _req = urllib.request.Request(_url, headers=_headers, method = self.method)
+                try:
+                    _raw, _rh = self._MoexSend(_req)
+                except urllib.error.HTTPError as e:
+                    if e.code == 304 and _cached:
+                        _cached['changed'] = False
+                        _res = _cached['body']
+                    else:
+                        self._local.status = e.code
+                        print('_MoexRequest(): HTTP Error ', e.code)
+                except urllib.error.URLError as e:
+                    print('_MoexRequest(): Error ', e.reason)
+                else:
+                    if self.revalidate and self.requests_dictionary[_type].get('revalidate'):
+                        _res = self._revalidatedBody(_url, _raw, _rh, _cached)
+                    else:
+                        _res = json.loads(_raw)
+                        if _shared is not None:
+                            _shared.put(_url, _raw)
         except Exception as e:
             print('MoexImporter::_MoexRequest(): ', e, file=sys.stderr)
         return _res
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """Context manager limits the total time of all requests of the current
+        thread, e.g. all pages of `MoexSecurity.getHistoryQuotesAsArray`.
+        Requests after the deadline fail without sending. Nested deadlines
+        can't extend the outer one.
+
+        Parameters
+        ----------
+        seconds: float
+            Time for all requests inside the context.
+        """
+        _prev = getattr(self._local, 'deadline', None)
+        _dl = time.monotonic() + seconds
+        self._local.deadline = _dl if _prev is None else min(_prev, _dl)
+        try:
+            yield self
+        finally:
+            self._local.deadline = _prev
+
+    def remaining(self):
+        """Returns seconds left till the deadline of the current thread or
+        `None` if there is no deadline.
+        """
+        _dl = getattr(self._local, 'deadline', None)
+        return None if _dl is None else _dl - time.monotonic()
+
+    def lastStatus(self):
+        """Returns the HTTP status code of the last request of the current
+        thread if MOEX ISS replied with an error, otherwise `None` (success,
+        timeout or network error).
+        """
+        return getattr(self._local, 'status', None)
+
+    def _MoexSend(self, _req):
+        """Internal method sends the request with timeouts limited by the deadline.
+        If hedging is enabled and there is no reply in time, the duplicate
+        request is sent and the first successful reply is returned.
+
+        Returns
+        -------
+        tuple
+            Raw body and headers of the reply.
+        """
+        _left = self.remaining()
+        if _left is not None and _left <= 0:
+            raise TimeoutError('deadline exceeded')
+        _timeouts = (
+            self.connect_timeout if _left is None else min(self.connect_timeout, _left),
+            self.read_timeout if _left is None else min(self.read_timeout, _left),
+        )
+        _delay = self._hedgeDelay() if self.hedge else None
+        if _delay is None or (_left is not None and _delay >= _left):
+            return self._MoexFetch(_req, _timeouts)
+        if self._hedge_pool is None:
+            with self._latency_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=32)
+        _futures = [self._hedge_pool.submit(self._MoexFetch, _req, _timeouts)]
+        _done, _pending = concurrent.futures.wait(_futures, timeout=_delay)
+        if not _done:
+            _futures.append(self._hedge_pool.submit(self._MoexFetch, _req, _timeouts))
+            with self._latency_lock:
+                self.hedged += 1
+        _err = None
+        for _f in concurrent.futures.as_completed(_futures):
+            try:
+                return _f.result()
+            except urllib.error.HTTPError:
+                raise
+            except Exception as e:
+                _err = e
+        raise _err
+
+    def _MoexFetch(self, _req, _timeouts):
+        """Internal method sends the request and reads the reply. Latencies of
+        successful requests are recorded.
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        _t0 = time.monotonic()
+        _opener = urllib.request.build_opener(_MoexTimeoutHandler(_timeouts[1]))
+        _resp = _opener.open(_req, timeout=_timeouts[0])
+        try:
+            _res = (_resp.read(), _resp.headers)
+        finally:
+            _resp.close()
+        with self._latency_lock:
+            self.latencies.append(time.monotonic() - _t0)
+        return _res
+
+    def _hedgeDelay(self):
+        """Internal method returns the latency quantile that triggers the duplicate
+        request or `None` if there are not enough measurements.
+        """
+        with self._latency_lock:
+            _lat = sorted(self.latencies)
+        if len(_lat) < self.hedge_min_samples:
+            return None
+        return _lat[min(len(_lat) - 1, int(self.hedge_quantile * len(_lat)))]
+
+    def _MoexUrl(self, _type, _pparams = None, _params = None):
+        """Internal method to build the url of the request. Arguments are
+        the same as for `_MoexRequest`.
+
+        Returns
+        -------
+        str
+            Url of the request.
+        """
+        _values = self.base_values.copy()
+        _mr = self.requests_dictionary[_type]
+        _url = self.base_url + _mr['postfix']
+        _rpp = _mr['postfix_params']
+        if _pparams:
+            for _ppkey in _pparams:
+                if _ppkey in _rpp:
+                    _url = _url.replace(_ppkey, _pparams[_ppkey]) 
+        _rp = _mr['params']
+        if _params:
+            for _pp in _params:
+                if _pp in _rp:
+                    _values[_pp] = f'{_params[_pp]:{_rp[_pp]:s}}'
+        _data = urllib.parse.urlencode(_values)
+        _url += f'?{_data:s}'
+        return _url
+
+    def _revalidatedBody(self, _url, _raw, _headers, _cached):
+        """Internal method to store the reply with its validators in the
+        response cache. If the content hash of the reply is the same as the
+        cached one, the cached decoded body is returned and json isn't parsed
+        again.
+
+        Returns
+        -------
+        array_like
+            Decoded reply.
+        """
+        _hash = hashlib.sha256(_raw).hexdigest()
+        if _cached and _cached['hash'] == _hash:
+            _body = _cached['body']
+        else:
+            _body = json.loads(_raw)
+        with self._cache_lock:
+            self.response_cache[_url] = {
+                'etag': _headers.get('ETag'),
+                'last_modified': _headers.get('Last-Modified'),
+                'hash': _hash,
+                'changed': not (_cached and _cached['hash'] == _hash),
+                'body': _body,
+            }
+            self.response_cache.move_to_end(_url)
+            while len(self.response_cache) > self.max_response_cache:
+                self.response_cache.popitem(last=False)
+        return _body
+
+    def responseChanged(self, _type, _pparams = None, _params = None):
+        """Checks if the last reply for the request differs from the previous one.
+        Arguments are the same as for `_MoexRequest`. Works only for requests
+        that are revalidated (engines, markets, securities lists and descriptions).
+
+        You may use this method to skip rebuilding data derived from the reply
+        when nothing has changed.
+
+        Returns
+        -------
+        boolean
+            `True` if the reply has changed or wasn't requested yet, `False`
+            if the server returned 304 or the content hash is the same.
+        """
+        _res = True
+        try:
+            with self._cache_lock:
+                _cached = self.response_cache.get(self._MoexUrl(_type, _pparams, _params))
+            if _cached:
+                _res = _cached['changed']
+        except Exception as e:
+            print('MoexImporter::responseChanged(): ', e, file=sys.stderr)
+        return _res
     
+    snapshot_version = 1
+    """Version of the snapshot format.
+    """
+
+    def loadInfo(self, workers = 8):
+        """Requests engines and then markets of all engines in parallel.
+
+        Parameters
+        ----------
+        workers: int, optional
+            Number of parallel requests.
+
+        Returns
+        -------
+        boolean
+            `True` if engines and markets were loaded.
+        """
+        _res = False
+        try:
+            _engines = self.getEngines()
+            if _engines:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as _pool:
+                    _markets = dict(zip(
+                        [_en['name'] for _en in _engines],
+                        _pool.map(self.getMarkets, [_en['name'] for _en in _engines]),
+                    ))
+                self.engines = _engines
+                self.markets = _markets
+                _res = all(_m is not None for _m in _markets.values())
+        except Exception as e:
+            print('MoexImporter::loadInfo(): ', e, file=sys.stderr)
+        return _res
+
+    def saveSnapshot(self, path, seccodes = None):
+        """Saves engines, markets and security descriptions to the snapshot.
+
+        Parameters
+        ----------
+        path: str
+            Path to the snapshot file.
+        seccodes: array_like, optional
+            Tickers of securities to save descriptions and boards for. Missing
+            descriptions are requested. Descriptions that were loaded from
+            the snapshot before are kept.
+
+        Returns
+        -------
+        boolean
+            `True` if the snapshot was saved.
+        """
+        _res = False
+        try:
+            _secs = dict(self.securities)
+            for _sc in (seccodes or []):
+                if _sc not in _secs:
+                    _tmp = self.getSecurity(_sc)
+                    if _tmp is not None:
+                        _secs[_sc] = _tmp
+            _dir = os.path.dirname(os.path.abspath(path))
+            os.makedirs(_dir, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as _f:
+                json.dump({
+                    'version': self.snapshot_version,
+                    'base_url': self.base_url,
+                    'created': time.time(),
+                    'engines': self.engines,
+                    'markets': self.markets,
+                    'securities': _secs,
+                }, _f)
+            os.replace(path + '.tmp', path)
+            self.securities = _secs
+            _res = True
+        except Exception as e:
+            print('MoexImporter::saveSnapshot(): ', e, file=sys.stderr)
+        return _res
+
+    def loadSnapshot(self, path, ttl = 86400, refresh = True):
+        """Loads engines, markets and security descriptions from the snapshot.
+        The stale snapshot is used as is and refreshed in the background.
+
+        Parameters
+        ----------
+        path: str
+            Path to the snapshot file.
+        ttl: int, optional
+            Age of the snapshot in seconds after which it's stale.
+        refresh: boolean, optional
+            If `True`, the stale snapshot is refreshed in a background thread.
+
+        Returns
+        -------
+        boolean
+            `True` if the snapshot was loaded. The snapshot of other version
+            or for other MOEX ISS url is ignored.
+        """
+        _res = False
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as _f:
+                    _snap = json.load(_f)
+                if _snap.get('version') == self.snapshot_version and _snap.get('base_url') == self.base_url:
+                    self.engines = _snap['engines']
+                    self.markets = _snap['markets']
+                    self.securities = _snap['securities']
+                    _res = True
+                    if refresh and time.time() - _snap['created'] > ttl:
+                        self.snapshot_refresh = threading.Thread(target=self._refreshSnapshot, args=(path,), daemon=True)
+                        self.snapshot_refresh.start()
+        except Exception as e:
+            print('MoexImporter::loadSnapshot(): ', e, file=sys.stderr)
+        return _res
+
+    def _refreshSnapshot(self, path):
+        """Internal method requests reference data again and rewrites the snapshot.
+        """
+        _fresh = type(self)(header=self.base_header)
+        _fresh.rate_limiter = self.rate_limiter
+        if _fresh.loadInfo():
+            for _sc in list(self.securities):
+                _tmp = _fresh.getSecurity(_sc)
+                if _tmp is not None:
+                    _fresh.securities[_sc] = _tmp
+            if _fresh.saveSnapshot(path):
+                self.engines = _fresh.engines
+                self.markets = _fresh.markets
+                self.securities = _fresh.securities
+
     def getEngines(self):
         """Returns the list of engines.
 
@@ -291,18 +773,161 @@ class MoexImporter:
         Returns
         -------
         array_like
-            List of specific data for `seccode`.
+            List of specific data for `seccode`. For descriptions from the
+            snapshot, `history_till` of boards that are still traded is moved
+            to the current date, so ranges aren't clamped by the snapshot date.
+        """
+        _res = self.securities.get(seccode)
+        try:
+            if _res is not None:
+                _today = date.today().isoformat()
+                _res = [
+                    dict(_ti, boards=[
+                        dict(_bi, history_till=max(_bi['history_till'] or _today, _today)) if _bi.get('is_traded') == 1 else _bi
+                        for _bi in _ti['boards']
+                    ]) if isinstance(_ti, dict) and 'boards' in _ti else _ti
+                    for _ti in _res
+                ]
+            else:
+                _res = self._MoexRequest(
+                    _MoexRequests.GetSecurity,
+                    _pparams = {
+                        '__SECCODE__': seccode,
+                    }
+                )
+        except Exception as e:
+            print('MoexImporter::getSecurity(): ', e, file=sys.stderr)
+        return _res
+    
+    def getBondization(self, seccode, start = 0):
+        """Returns coupons and amortizations schedule for the bond.
+        
+        Parameters
+        ----------
+        seccode: str
+            Bond ticker.
+        start: int, optional
+            Specify cursor for query. MOEX ISS returns only
+            limited number of rows per request. You have to
+            shift the cursor to get the next portion.
+
+        Returns
+        -------
+        array_like
+            List of blocks with coupons and amortizations.
         """
         _res = None
         try:
             _res = self._MoexRequest(
-                _MoexRequests.GetSecurity,
+                _MoexRequests.GetBondization,
                 _pparams = {
                     '__SECCODE__': seccode,
+                },
+                _params = {
+                    'iss.only': 'coupons,amortizations',
+                    'start': start,
+                    'limit': self.limit,
                 }
             )
         except Exception as e:
-            print('MoexImporter::getSecurity(): ', e, file=sys.stderr)
+            print('MoexImporter::getBondization(): ', e, file=sys.stderr)
+        return _res
+    
+    def getDividends(self, seccode):
+        """Returns the list of dividends for the security.
+        
+        Parameters
+        ----------
+        seccode: str
+            Security ticker.
+
+        Returns
+        -------
+        array_like
+            List of dividends with registry close dates and values.
+        """
+        _res = None
+        try:
+            _tmp = self._MoexRequest(
+                _MoexRequests.GetDividends,
+                _pparams = {
+                    '__SECCODE__': seccode,
+                }
+            )
+            if isinstance(_tmp, list):
+                _res = []
+                for _ti in _tmp:
+                    if isinstance(_ti, dict):
+                        if 'dividends' in _ti.keys():
+                            _res = _ti['dividends']
+        except Exception as e:
+            print('MoexImporter::getDividends(): ', e, file=sys.stderr)
+        return _res
+    
+    def getSplits(self, seccode):
+        """Returns the list of splits and consolidations for the security.
+        
+        Parameters
+        ----------
+        seccode: str
+            Security ticker.
+
+        Returns
+        -------
+        array_like
+            List of splits with trade dates and numbers of shares
+            before and after the split.
+        """
+        _res = None
+        try:
+            _tmp = self._MoexRequest(
+                _MoexRequests.GetSplits,
+                _pparams = {
+                    '__SECCODE__': seccode,
+                }
+            )
+            if isinstance(_tmp, list):
+                _res = []
+                for _ti in _tmp:
+                    if isinstance(_ti, dict):
+                        if 'splits' in _ti.keys():
+                            _res = _ti['splits']
+        except Exception as e:
+            print('MoexImporter::getSplits(): ', e, file=sys.stderr)
+        return _res
+
+    def getFuturesSeries(self, asset, expired = True):
+        """Returns the list of futures contracts for the underlying asset.
+        
+        Parameters
+        ----------
+        asset: str
+            Code of the underlying asset, e.g. 'Si' or 'RI'.
+        expired: boolean, optional
+            If `True`, expired contracts are returned too.
+
+        Returns
+        -------
+        array_like
+            List of contracts with tickers and last trade dates.
+        """
+        _res = None
+        try:
+            _tmp = self._MoexRequest(
+                _MoexRequests.GetFuturesSeries,
+                _params = {
+                    'asset_code': asset,
+                    'show_expired': 1 if expired else 0,
+                }
+            )
+            if isinstance(_tmp, list):
+                _res = []
+                for _ti in _tmp:
+                    if isinstance(_ti, dict):
+                        if 'series' in _ti.keys():
+                            _res = _ti['series']
+        except Exception as e:
+            print('MoexImporter::getFuturesSeries(): ', e, file=sys.stderr)
         return _res
     
     def _getSecurities(self, is_trading='', engine=None, market=None, query = None):
@@ -626,6 +1251,51 @@ class MoexImporter:
             print('MoexImporter::getHistoryQuotes(): ', e, file=sys.stderr)
         return _res
     
+    def getBoardHistoryQuotes(self, engine, market, board, dt, tsession, start):
+        """Returns quotes for all securities of the board for the specific date.
+        
+        Parameters
+        ----------
+        engine: str
+            Specify engine for quotes.
+        market: str
+            Specify market for quotes.
+        board: str
+            Specify board for quotes.
+        dt: date
+            Trade date.
+        tsession: MoexSessions
+            Specify trading session for quotes.
+        start: int
+            Specify cursor for query. MOEX ISS returns only
+            limited number of quotes per request. You have to
+            shift the cursor to get the next portion.
+
+        Returns
+        -------
+        array_like
+            List of quotes.
+        """
+        _res = None
+        try:
+            _res = self._MoexRequest(
+                _MoexRequests.GetBoardHistoryQuotes,
+                _pparams = {
+                    '__ENGINE__': engine,
+                    '__MARKET__': market,
+                    '__BOARD__': board,
+                },
+                _params = {
+                    'date': dt,
+                    'tradingsession': tsession,
+                    'start': start,
+                    'limit': self.limit,
+                }
+            )
+        except Exception as e:
+            print('MoexImporter::getBoardHistoryQuotes(): ', e, file=sys.stderr)
+        return _res
+    
     def getCandles(self, engine, market, board, seccode, dtfrom, dttill, start, candleperiod):
         """Returns candles for the specific security.
         
@@ -639,8 +1309,9 @@ class MoexImporter:
             Specify board for quotes.
         seccode: str
             Security ticker.
-        dtfrom: date
-            Left bound of daterange for quotes.
+        dtfrom: date or datetime
+            Left bound of daterange for quotes. If datetime is passed,
+            candles are requested starting from this time.
         dttill: date
             Right bound of daterange for quotes.
         start: int
@@ -674,4 +1345,136 @@ class MoexImporter:
             )
         except Exception as e:
             print('MoexImporter::getCandles(): ', e, file=sys.stderr)
-        return _res
\ No newline at end of file
+        return _res
+
+    def getTrades(self, engine, market, board, seccode, tradeno = None, limit = 5000):
+        """Returns trades of the current session for the specific security.
+        
+        Parameters
+        ----------
+        engine: str
+            Specify engine for trades.
+        market: str
+            Specify market for trades.
+        board: str
+            Specify board for trades.
+        seccode: str
+            Security ticker.
+        tradeno: int, optional
+            Cursor for query. Only trades following the trade with
+            this number are returned. Trades from the beginning of the
+            session are returned if the parameter is ommited.
+        limit: int, optional
+            Maximum number of trades per request.
+
+        Returns
+        -------
+        array_like
+            List of trades.
+        """
+        _res = None
+        _params = {
+            'limit': limit,
+        }
+        if tradeno is not None:
+            _params['tradeno'] = tradeno
+            _params['next_trade'] = 1
+        try:
+            _res = self._MoexRequest(
+                _MoexRequests.GetTrades,
+                _pparams = {
+                    '__SECCODE__': seccode,
+                    '__ENGINE__': engine,
+                    '__MARKET__': market,
+                    '__BOARD__': board,
+                },
+                _params = _params
+            )
+        except Exception as e:
+            print('MoexImporter::getTrades(): ', e, file=sys.stderr)
+        return _res
+
+    def getBoardSnapshot(self, engine, market, board, columns = None, seccolumns = None, diff = False):
+        """Returns current market data for all securities of the board
+        in one request.
+        
+        Parameters
+        ----------
+        engine: str
+            Specify engine of the board.
+        market: str
+            Specify market of the board.
+        board: str
+            Board identifier, e.g. 'TQBR' or 'TQOB'.
+        columns: array_like, optional
+            Subset of market data columns to request. The smaller subset
+            shrinks the reply. If the parameter is ommited, the full block is
+            requested and columns 'LAST', 'BID', 'OFFER', 'VOLTODAY',
+            'VALTODAY', 'YIELD', 'UPDATETIME' are returned.
+        seccolumns: array_like, optional
+            Columns of the securities block to add to the snapshot,
+            e.g. ['SHORTNAME', 'MATDATE']. Default is ['SHORTNAME'].
+        diff: boolean, optional
+            If `True`, only rows that are new or changed since the previous
+            snapshot of the board are returned.
+
+        Returns
+        -------
+        pd.DataFrame
+            Snapshot indexed by 'SECID'. Columns with numbers in the reply are
+            float64, 'SYSTIME' is datetime, text, date and time columns are
+            kept as is.
+        """
+        _res = None
+        _seccols = ['SECID'] + [_c for _c in (seccolumns if seccolumns else ['SHORTNAME']) if _c != 'SECID']
+        _params = {
+            'iss.only': 'securities,marketdata',
+            'securities.columns': ','.join(_seccols),
+        }
+        if columns:
+            _mdcols = ['SECID'] + [_c for _c in columns if _c != 'SECID']
+            _params['marketdata.columns'] = ','.join(_mdcols)
+        else:
+            _mdcols = ['SECID', 'LAST', 'BID', 'OFFER', 'VOLTODAY', 'VALTODAY', 'YIELD', 'UPDATETIME']
+        try:
+            _tmp = self._MoexRequest(
+                _MoexRequests.GetBoardSecurities,
+                _pparams = {
+                    '__ENGINE__': engine,
+                    '__MARKET__': market,
+                    '__BOARD__': board,
+                },
+                _params = _params
+            )
+            _sec = None
+            _md = None
+            # ISS sends numbers as JSON numbers and text, dates and times as
+            # strings, so columns with strings in the reply aren't numeric.
+            _text = {'SECID'}
+            for _ti in _tmp:
+                if 'securities' in _ti:
+                    _sec = pd.DataFrame.from_dict(data=_ti['securities']).reindex(columns=_seccols)
+                    _text |= {_k for _r in _ti['securities'] for _k, _v in _r.items() if isinstance(_v, str)}
+                if 'marketdata' in _ti:
+                    _md = pd.DataFrame.from_dict(data=_ti['marketdata']).reindex(columns=_mdcols)
+                    _text |= {_k + '_MD' if _k in _seccols else _k for _r in _ti['marketdata'] for _k, _v in _r.items() if isinstance(_v, str)}
+            _res = _sec.merge(_md, on='SECID', how='left', suffixes=('', '_MD'))
+            for _c in _res.columns:
+                if _c == 'SYSTIME':
+                    _res[_c] = pd.to_datetime(_res[_c], errors='coerce')
+                elif _c not in _text:
+                    _res[_c] = pd.to_numeric(_res[_c], errors='coerce').astype('float64')
+            _res.set_index(['SECID',], inplace=True)
+            _key = (engine, market, board)
+            with self._cache_lock:
+                _prev = self.board_snapshots.pop(_key, None)
+                self.board_snapshots[_key] = _res
+                while len(self.board_snapshots) > self.max_board_snapshots:
+                    self.board_snapshots.popitem(last=False)
+            if diff and _prev is not None:
+                _old = _prev.reindex(index=_res.index, columns=_res.columns)
+                _changed = ~((_res == _old) | (_res.isna() & _old.isna())).all(axis=1)
+                _res = _res[_changed]
+        except Exception as e:
+            print('MoexImporter::getBoardSnapshot(): ', e, file=sys.stderr)
+        return _res
@@ -0,0 +1,229 @@
+import concurrent.futures
+import sys
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexCalendar import MoexCalendar
+from .MoexSessions import MoexSessions
+from ._MoexClock import _MoexClock
+
+class MoexPanel:
+    """Class MoexPanel implements building of wide panels of history quotes
+    (dates by tickers) for a universe of securities.
+
+    The panel is allocated once as a float64 matrix aligned to the trading
+    calendar. Pages of history are written into columns of their tickers
+    as soon as they arrive, so there are no per-ticker dataframes and no
+    long-format copies. Missing values are NaN.
+
+    Instance of MoexImporter should be created before.
+    """
+    def __init__(self, mi, workers = 8):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        workers: int, optional
+            Number of tickers loaded in parallel.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.workers = workers
+        """Number of parallel requests.
+        """
+        if not isinstance(mi, MoexImporter):
+            print('MoexPanel::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    @staticmethod
+    def calendar(dtfrom, dttill):
+        """Returns business days of the range. Exchange holidays are not
+        taken into account, see `tradingDays` for the exchange calendar.
+
+        Parameters
+        ----------
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+
+        Returns
+        -------
+        np.ndarray
+            Dates as datetime64[D] array.
+        """
+        _res = np.arange(np.datetime64(dtfrom, 'D'), np.datetime64(dttill, 'D') + 1, dtype='datetime64[D]')
+        return _res[np.is_busday(_res)]
+
+    def tradingDays(self, board, dtfrom, dttill, engine = 'stock', market = 'shares'):
+        """Returns trading days of the board from MoexCalendar. The calendar
+        of MoexImporter object is used if it's set. Days from today on and
+        boards without the reference security fall back to business days.
+
+        Parameters
+        ----------
+        board: str
+            Trading board.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        engine: str, optional
+            Engine of the board.
+        market: str, optional
+            Market of the board.
+
+        Returns
+        -------
+        np.ndarray
+            Dates as datetime64[D] array.
+        """
+        _cal = self.mi.calendar if self.mi.calendar is not None else MoexCalendar(self.mi)
+        _last = min(dttill, _MoexClock.today() - timedelta(days=1))
+        if _cal.reference(board, engine, market) is None or dtfrom > _last:
+            return self.calendar(dtfrom, dttill)
+        _days = _cal.tradingDays(board, dtfrom, _last, engine, market)
+        if _days is None:
+            print('MoexPanel::tradingDays(): business days are used for', board, file=sys.stderr)
+            return self.calendar(dtfrom, dttill)
+        _res = np.array(_days, dtype='datetime64[D]')
+        if _last < dttill:
+            _res = np.concatenate([_res, self.calendar(_last + timedelta(days=1), dttill)])
+        return _res
+
+    def build(self, universe, dtfrom, dttill, fields = ('CLOSE',), board = None, ts = MoexSessions.MainSession, calendar = None):
+        """Loads history quotes of the universe and returns them as a wide
+        panel.
+
+        Parameters
+        ----------
+        universe: array_like
+            List of tickers or MoexSecurity objects. Repeated tickers are
+            loaded once, the panel keeps the first occurrence.
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        fields: array_like, optional
+            Fields of history quotes, e.g. 'CLOSE', 'VALUE', 'YIELD'.
+        board: str, optional
+            Request quotes for the specific board. Primary boards are used
+            if the parameter is ommited.
+        ts: MoexSessions, optional
+            Request quotes for the specific session. The main session
+            is used if the parameter is ommited.
+        calendar: array_like, optional
+            Trading dates of the panel. Quotes for other dates are skipped.
+            Trading days of the board of the first security (`tradingDays`)
+            are used if the parameter is ommited.
+
+        Returns
+        -------
+        pd.DataFrame
+            Panel indexed by dates with columns (field, ticker). Use
+            `panel['CLOSE']` to get the matrix of one field. All fields
+            share one float64 block. Tickers that failed to load are listed
+            with error messages in `panel.attrs['errors']`; their columns
+            may be filled partially.
+        """
+        _res = None
+        try:
+            _unique = {}
+            for _s in universe:
+                _unique.setdefault(_s.seccode if isinstance(_s, MoexSecurity) else _s, _s)
+            _tickers = list(_unique)
+            universe = list(_unique.values())
+            _errors = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _secs = list(_pool.map(self._security, universe))
+                for _t, _s in zip(_tickers, _secs):
+                    if isinstance(_s, str):
+                        _errors[_t] = _s
+                if calendar is not None:
+                    _dates = np.unique(np.asarray(calendar, dtype='datetime64[D]'))
+                else:
+                    _first = next((_s for _s in _secs if not isinstance(_s, str) and (board or _s.mainboard) in _s.boards), None)
+                    if _first is None:
+                        _dates = self.calendar(dtfrom, dttill)
+                    else:
+                        _tb = board or _first.mainboard
+                        _dates = self.tradingDays(_tb, dtfrom, dttill, _first.boards[_tb]['engine'], _first.boards[_tb]['market'])
+                _fields = list(fields)
+                _data = np.full((len(_dates), len(_fields) * len(_tickers)), np.nan, dtype='float64')
+                _futures = {
+                    _pool.submit(self._fill, _data, _dates, _fields, _i, len(_tickers), _secs[_i], dtfrom, dttill, board, ts): _tickers[_i]
+                    for _i in range(len(_tickers)) if not isinstance(_secs[_i], str)
+                }
+                for _f in concurrent.futures.as_completed(_futures):
+                    try:
+                        _f.result()
+                    except Exception as e:
+                        print('MoexPanel::build(): ', _futures[_f], e, file=sys.stderr)
+                        _errors[_futures[_f]] = str(e)
+            _res = pd.DataFrame(
+                _data,
+                index=pd.DatetimeIndex(_dates, name='TRADEDATE'),
+                columns=pd.MultiIndex.from_product([_fields, _tickers]),
+                copy=False,
+            )
+            _res.attrs['errors'] = _errors
+        except Exception as e:
+            print('MoexPanel::build(): ', e, file=sys.stderr)
+        return _res
+
+    def _security(self, sec):
+        """Internal method returns MoexSecurity object for the ticker or the
+        error message.
+        """
+        if isinstance(sec, MoexSecurity):
+            return sec
+        try:
+            return MoexSecurity(sec, self.mi, cache_rows=0)
+        except Exception as e:
+            return str(e)
+
+    def _fill(self, data, dates, fields, col, stride, sec, dtfrom, dttill, board, ts):
+        """Internal method requests pages of history for the ticker and writes
+        them into column `col` of every field block as they arrive. Failed
+        pages are retried by `MoexSecurity._loadPages`, MoexPartialResultError
+        is raised if a page still fails.
+        """
+        _tb = board if board else sec.mainboard
+        if _tb not in sec.boards:
+            raise RuntimeError(f'no board {_tb}')
+        _rdf = max(dtfrom, sec.boards[_tb]['dtfrom'])
+        _rdt = min(dttill, sec.boards[_tb]['dttill'])
+
+        def _write(_block):
+            _page = sec._parseHistory(_block)
+            if _page:
+                _pd = np.array([_r['TRADEDATE'] for _r in _page], dtype='datetime64[D]')
+                _pos = np.searchsorted(dates, _pd)
+                _ok = _pos < len(dates)
+                _ok[_ok] = dates[_pos[_ok]] == _pd[_ok]
+                for _fi, _fn in enumerate(fields):
+                    _v = np.array([_r.get(_fn) for _r in _page], dtype='float64')
+                    data[_pos[_ok], _fi * stride + col] = _v[_ok]
+            return _page
+
+        if _rdf <= _rdt:
+            sec._loadPages(
+                ('panel', _tb, ts, _rdf, _rdt),
+                lambda _st: self.mi.getHistoryQuotes(
+                    engine = sec.boards[_tb]['engine'],
+                    market = sec.boards[_tb]['market'],
+                    board = _tb,
+                    seccode = sec.seccode,
+                    dtfrom = _rdf,
+                    dttill = _rdt,
+                    tsession = ts,
+                    start = _st,
+                ),
+                'history',
+                _write,
+                [],
+            )
@@ -0,0 +1,58 @@
+class MoexPartialResultError(Exception):
+    """Exception raised when a page of a multi-page request still fails
+    after all retries.
+
+    The exception keeps rows loaded before the failure and the state of
+    every requested page. Completed pages are remembered by the object
+    that raised the exception, so `resume()` (or the same call repeated
+    later) requests only the failed page and the following ones.
+    """
+    def __init__(self, message, rows, pages, resume = None):
+        """Class constructor.
+
+        Parameters
+        ----------
+        message: str
+            Description of the failure.
+        rows: array_like
+            Rows loaded before the failure.
+        pages: array_like
+            Requested pages as dicts with keys:
+            'start' - cursor of the page,
+            'status' - 'ok' or 'failed',
+            'rows' - number of rows in the page,
+            'attempts' - number of requests of the page.
+        resume: callable, optional
+            Function that repeats the request.
+        """
+        super().__init__(message)
+        self.rows = rows
+        """Rows loaded before the failure.
+        """
+        self.pages = pages
+        """Requested pages.
+        """
+        self._resume = resume
+
+    def failedPages(self):
+        """Returns pages that failed.
+
+        Returns
+        -------
+        array_like
+            Pages with 'failed' status.
+        """
+        return [_p for _p in self.pages if _p['status'] == 'failed']
+
+    def resume(self):
+        """Repeats the request starting from the failed page.
+
+        Returns
+        -------
+        array_like
+            Complete result of the request. The exception is raised again
+            if the page fails once more.
+        """
+        if self._resume is None:
+            raise RuntimeError('the request cannot be resumed')
+        return self._resume()
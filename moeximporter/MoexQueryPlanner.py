@@ -0,0 +1,433 @@
+import concurrent.futures
+import sys
+import threading
+import pandas as pd
+from datetime import datetime, timedelta
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+from .MoexSessions import MoexSessions
+from .MoexCandlePeriods import MoexCandlePeriods
+from .MoexPartialResultError import MoexPartialResultError
+
+_derivable = {
+    MoexCandlePeriods.Period10Min: [MoexCandlePeriods.Period1Min],
+    MoexCandlePeriods.Period1Hour: [MoexCandlePeriods.Period10Min, MoexCandlePeriods.Period1Min],
+}
+"""Candle periods that may be built from finer periods, the preferred source first.
+"""
+
+_minutes = {
+    MoexCandlePeriods.Period1Min: 1,
+    MoexCandlePeriods.Period10Min: 10,
+    MoexCandlePeriods.Period1Hour: 60,
+}
+"""Length of intraday candle periods in minutes.
+"""
+
+_months = {
+    MoexCandlePeriods.Period1Month: 1,
+    MoexCandlePeriods.Period1Quarter: 3,
+}
+"""Length of monthly candle periods in months.
+"""
+
+class MoexQueryPlanner:
+    """Class MoexQueryPlanner implements planning and execution of
+    batches of quote requests.
+
+    Every request in the batch is a dict with keys:
+    'seccode' - ticker, `None` for all securities of the board,
+    'board' - board, the primary board of the security by default,
+    'engine', 'market' - required for whole-board requests only,
+    'dtfrom', 'dttill' - date range,
+    'interval' - MoexCandlePeriods for candles, `None` for history quotes,
+    'session' - MoexSessions for history quotes, the main session by default.
+
+    The planner deduplicates requests and merges overlapping and adjacent
+    date ranges of the same data. History of a security that is covered by
+    a whole-board request of the batch is taken from the board-wide
+    reply. History requests of many securities of the same board are
+    folded into whole-board requests when it takes fewer pages: a
+    security costs a page per `limit` days of its range, the board costs
+    `board_pages` pages per business day. Intraday candles that are covered by finer candles of the batch
+    are aggregated from them. Candles available in the local
+    MoexCandleStore are read from it. The remaining requests are executed
+    concurrently and results are split back per original request.
+
+    Instance of MoexImporter should be created before.
+    """
+    def __init__(self, mi, store = None, workers = 4):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        store: MoexCandleStore, optional
+            Local storage of candles to read from.
+        workers: int, optional
+            Number of concurrent requests.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.store = store
+        """Local storage of candles.
+        """
+        self.workers = workers
+        """Number of concurrent requests.
+        """
+        self.securities = {}
+        """MoexSecurity objects by ticker.
+        """
+        self.board_pages = 3
+        """Expected number of pages of a whole-board history reply for one day,
+        e.g. about 250 shares of TQBR with the limit of 100 rows.
+        """
+        self.last_report = None
+        """Report of the last executed batch.
+        """
+        self._lock = threading.Lock()
+        if not isinstance(mi, MoexImporter):
+            print('MoexQueryPlanner::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    @staticmethod
+    def _mergeRanges(ranges):
+        """Internal method merges overlapping and adjacent date ranges.
+        """
+        _res = []
+        for _dtf, _dtt in sorted(ranges):
+            if _res and _dtf <= _res[-1][1] + timedelta(days=1):
+                _res[-1] = (_res[-1][0], max(_res[-1][1], _dtt))
+            else:
+                _res.append((_dtf, _dtt))
+        return _res
+
+    @staticmethod
+    def _subtractRanges(ranges, covered):
+        """Internal method returns parts of date ranges that aren't covered.
+        """
+        _res = []
+        for _dtf, _dtt in ranges:
+            _cur = _dtf
+            for _cf, _ct in MoexQueryPlanner._mergeRanges(covered):
+                if _ct < _cur or _cf > _dtt:
+                    continue
+                if _cf > _cur:
+                    _res.append((_cur, _cf - timedelta(days=1)))
+                _cur = max(_cur, _ct + timedelta(days=1))
+                if _cur > _dtt:
+                    break
+            if _cur <= _dtt:
+                _res.append((_cur, _dtt))
+        return _res
+
+    def _loadSecurities(self, seccodes):
+        """Internal method creates MoexSecurity objects concurrently.
+        """
+        _todo = [_sc for _sc in set(seccodes) if _sc not in self.securities]
+        if _todo:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _futures = {_pool.submit(MoexSecurity, _sc, self.mi): _sc for _sc in _todo}
+                for _f in concurrent.futures.as_completed(_futures):
+                    _sc = _futures[_f]
+                    try:
+                        _sec = _f.result()
+                    except Exception as e:
+                        print('MoexQueryPlanner::_loadSecurities(): ', _sc, e, file=sys.stderr)
+                        continue
+                    if _sec.boards:
+                        with self._lock:
+                            self.securities[_sc] = _sec
+                    else:
+                        print('MoexQueryPlanner::_loadSecurities(): no data for', _sc, file=sys.stderr)
+
+    def _normalize(self, request):
+        """Internal method returns the data key and the range of the request.
+        The board of a security that isn't loaded is taken from the request.
+        """
+        _dtf, _dtt = request['dtfrom'], request['dttill']
+        _iv = request.get('interval')
+        _ts = request.get('session', MoexSessions.MainSession)
+        if request.get('seccode') is None:
+            return ('board', request['engine'], request['market'], request['board'], _ts), _dtf, _dtt
+        _sec = self.securities.get(request['seccode'])
+        _tb = request.get('board') or (_sec.mainboard if _sec else None)
+        if _iv is None:
+            return ('history', request['seccode'], _tb, _ts), _dtf, _dtt
+        return ('candles', request['seccode'], _tb, MoexCandlePeriods(_iv)), _dtf, _dtt
+
+    def plan(self, requests):
+        """Builds the execution plan for the batch of requests.
+
+        Parameters
+        ----------
+        requests: array_like
+            List of requests as dicts (see the class description).
+
+        Returns
+        -------
+        dict
+            Plan with keys:
+            'keys' - data key and range of every request,
+            'tasks' - list of tasks to execute,
+            'report' - numbers of requested, planned and cached fetches,
+            'errors' - messages by data keys that can't be requested.
+        """
+        self._loadSecurities([_r['seccode'] for _r in requests if _r.get('seccode') is not None])
+        _keys = [self._normalize(_r) for _r in requests]
+        _errors = {}
+        for _k, _dtf, _dtt in _keys:
+            if _k[0] != 'board' and _k[1] not in self.securities:
+                _errors[_k] = f'no data for security {_k[1]}'
+        _ranges = {}
+        for _k, _dtf, _dtt in _keys:
+            if _k not in _errors:
+                _ranges.setdefault(_k, []).append((_dtf, _dtt))
+        _ranges = {_k: self._mergeRanges(_v) for _k, _v in _ranges.items()}
+        self._foldBoards(_ranges)
+        _need = {}
+        for _k, _rg in _ranges.items():
+            _cov = []
+            if _k[0] == 'history':
+                for _bk, _brg in _ranges.items():
+                    if _bk[0] == 'board' and _bk[3] == _k[2] and _bk[4] == _k[3]:
+                        _cov += _brg
+            elif _k[0] == 'candles' and _k[3] in _derivable:
+                _fk = self._fineKey(_k, _ranges)
+                if _fk:
+                    _cov += _ranges[_fk]
+            _need[_k] = self._subtractRanges(_rg, _cov) if _cov else _rg
+        _tasks = []
+        for _k, _rg in _need.items():
+            for _dtf, _dtt in _rg:
+                if _k[0] == 'board':
+                    for _dt in pd.bdate_range(_dtf, _dtt):
+                        _tasks.append({'source': 'iss', 'key': _k, 'dtfrom': _dt.date(), 'dttill': _dt.date()})
+                    continue
+                _stored = []
+                if _k[0] == 'candles' and self.store is not None:
+                    _stored = self._storedRange(_k)
+                for _sf, _st in self._subtractRanges([(_dtf, _dtt)], _stored):
+                    _tasks.append({'source': 'iss', 'key': _k, 'dtfrom': _sf, 'dttill': _st})
+                for _cf, _ct in _stored:
+                    if _cf <= _dtt and _ct >= _dtf:
+                        _tasks.append({'source': 'store', 'key': _k, 'dtfrom': max(_cf, _dtf), 'dttill': min(_ct, _dtt)})
+        _naive = 0
+        for _k, _dtf, _dtt in _keys:
+            _naive += len(pd.bdate_range(_dtf, _dtt)) if _k[0] == 'board' else 1
+        _planned = len([_t for _t in _tasks if _t['source'] == 'iss'])
+        return {
+            'keys': _keys,
+            'tasks': _tasks,
+            'errors': _errors,
+            'report': {
+                'requested': len(requests),
+                'naive_fetches': _naive,
+                'planned_fetches': _planned,
+                'from_cache': len(_tasks) - _planned,
+                'saved': _naive - _planned,
+            },
+        }
+
+    def _foldBoards(self, ranges):
+        """Internal method adds whole-board history ranges to `ranges` where
+        they are cheaper than requests of separate securities. History of
+        securities of a board is clustered by overlapping ranges; a cluster
+        is requested for the whole board if the pages of its securities
+        exceed `board_pages` pages per business day of the cluster.
+        """
+        _groups = {}
+        for _k, _rg in ranges.items():
+            if _k[0] == 'history':
+                _groups.setdefault((_k[2], _k[3]), []).append(_k)
+        for (_tb, _ts), _keys in _groups.items():
+            if len(_keys) < 2:
+                continue
+            _board = self.securities[_keys[0][1]].boards[_tb]
+            _bk = ('board', _board['engine'], _board['market'], _tb, _ts)
+            _covered = ranges.get(_bk, [])
+            _todo = {_k: self._subtractRanges(ranges[_k], _covered) for _k in _keys}
+            for _cf, _ct in self._mergeRanges([_r for _rg in _todo.values() for _r in _rg]):
+                _sec = 0
+                for _rg in _todo.values():
+                    for _dtf, _dtt in _rg:
+                        if _dtf <= _ct and _dtt >= _cf:
+                            _n = len(pd.bdate_range(max(_dtf, _cf), min(_dtt, _ct)))
+                            _sec += max(1, -(-_n // self.mi.limit))
+                if _sec > len(pd.bdate_range(_cf, _ct)) * self.board_pages:
+                    _covered = _covered + [(_cf, _ct)]
+            if _covered:
+                ranges[_bk] = self._mergeRanges(_covered)
+
+    @staticmethod
+    def _fineKey(key, ranges):
+        """Internal method returns the key of finer candles of the batch
+        that may be aggregated to the candles of the key.
+        """
+        for _iv in _derivable.get(key[3], []):
+            _fk = ('candles', key[1], key[2], _iv)
+            if _fk in ranges:
+                return _fk
+        return None
+
+    def _storedRange(self, key):
+        """Internal method returns complete days available in the local storage.
+        The last stored day may be incomplete and isn't counted.
+        """
+        _res = []
+        _last = self.store.lastBegin(key[1], key[2], key[3])
+        if _last:
+            _first = self.store.query(key[1], key[2], key[3])['begin'][0].astype(datetime)
+            if _first.date() <= _last.date() - timedelta(days=1):
+                _res.append((_first.date(), _last.date() - timedelta(days=1)))
+        return _res
+
+    def _runTask(self, task):
+        """Internal method executes the task and returns rows.
+        """
+        _k = task['key']
+        if task['source'] == 'store':
+            _tmp = self.store.query(_k[1], _k[2], _k[3], task['dtfrom'], task['dttill'])
+            return [
+                {
+                    'begin': _b,
+                    'end': self._candleEnd(_b, _k[3]),
+                    'open': float(_o),
+                    'high': float(_h),
+                    'low': float(_l),
+                    'close': float(_c),
+                    'value': float(_v),
+                    'quantity': int(_q) if _q == _q else None,
+                } for _b, _o, _h, _l, _c, _v, _q in zip(
+                    _tmp['begin'].astype(datetime), _tmp['open'], _tmp['high'], _tmp['low'],
+                    _tmp['close'], _tmp['value'], _tmp['quantity'],
+                )
+            ]
+        if _k[0] == 'board':
+            _res = []
+            _st = 0
+            _isNext = True
+            while _isNext:
+                _isNext = False
+                _tmp = self.mi.getBoardHistoryQuotes(_k[1], _k[2], _k[3], task['dtfrom'], _k[4], _st)
+                if _tmp is None:
+                    raise RuntimeError(f'request failed for {_k[3]:s} {task["dtfrom"]}')
+                for _ti in _tmp:
+                    if 'history' in _ti:
+                        _thq = MoexSecurity._parseHistory(_ti['history'], keys=('SECID',))
+                        _res += _thq
+                        _st += self.mi.limit
+                        if len(_thq) == self.mi.limit:
+                            _isNext = True
+            return _res
+        _sec = self.securities[_k[1]]
+        if _k[0] == 'history':
+            _res = _sec.getHistoryQuotesAsArray(task['dtfrom'], task['dttill'], board=_k[2], ts=_k[3])
+        else:
+            _res = _sec.getCandleQuotesAsArray(task['dtfrom'], task['dttill'], board=_k[2], interval=_k[3])
+        if _res is None:
+            raise RuntimeError(f'request failed for {_k[1]:s}')
+        return _res
+
+    @staticmethod
+    def _candleEnd(begin, interval):
+        """Internal method returns the end of the candle that starts at `begin`.
+        """
+        if interval in _minutes:
+            return begin + timedelta(minutes=_minutes[interval], seconds=-1)
+        _b = begin.replace(hour=0, minute=0, second=0, microsecond=0)
+        if interval in _months:
+            _m = _b.month - 1 + _months[interval]
+            return _b.replace(year=_b.year + _m // 12, month=_m % 12 + 1, day=1) - timedelta(seconds=1)
+        return _b + timedelta(days=7 if interval == MoexCandlePeriods.Period1Week else 1, seconds=-1)
+
+    @staticmethod
+    def _resampleCandles(candles, interval):
+        """Internal method aggregates finer intraday candles to the interval.
+        """
+        _res = {}
+        _m = _minutes[interval]
+        for _c in sorted(candles, key=lambda _x: _x['begin']):
+            _b = _c['begin'].replace(second=0, microsecond=0)
+            _b = _b.replace(minute=_b.minute - _b.minute % _m) if _m < 60 else _b.replace(minute=0)
+            _a = _res.get(_b)
+            if _a is None:
+                _res[_b] = dict(_c, begin=_b)
+            else:
+                _a['high'] = max(_a['high'], _c['high'])
+                _a['low'] = min(_a['low'], _c['low'])
+                _a['close'] = _c['close']
+                _a['end'] = _c['end']
+                _a['value'] += _c['value']
+                _a['quantity'] += _c['quantity']
+        return list(_res.values())
+
+    def execute(self, requests):
+        """Plans and executes the batch of requests.
+
+        Parameters
+        ----------
+        requests: array_like
+            List of requests as dicts (see the class description).
+
+        Returns
+        -------
+        tuple
+            Pair (results, report). Results are in the order of requests:
+            history quotes and candles as arrays of dicts in the format of
+            `MoexSecurity.getHistoryQuotesAsArray` and
+            `MoexSecurity.getCandleQuotesAsArray`, whole-board requests
+            have additional key 'SECID'. Report contains numbers of
+            requested, planned and cached fetches and fetches saved, and
+            'errors' - messages by data keys of failed fetches. Rows of
+            failed fetches that were loaded before the failure are returned.
+        """
+        _results = None
+        _report = None
+        try:
+            _plan = self.plan(requests)
+            _report = _plan['report']
+            _report['errors'] = dict(_plan['errors'])
+            _rows = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _futures = {_pool.submit(self._runTask, _t): _t for _t in _plan['tasks']}
+                for _f in concurrent.futures.as_completed(_futures):
+                    _k = _futures[_f]['key']
+                    try:
+                        _rows.setdefault(_k, []).extend(_f.result() or [])
+                    except MoexPartialResultError as e:
+                        _rows.setdefault(_k, []).extend(e.rows)
+                        _report['errors'][_k] = str(e)
+                    except Exception as e:
+                        print('MoexQueryPlanner::execute(): ', _k, e, file=sys.stderr)
+                        _report['errors'][_k] = str(e)
+            _results = [self._split(_k, _dtf, _dtt, _rows) for _k, _dtf, _dtt in _plan['keys']]
+            self.last_report = _report
+        except Exception as e:
+            print('MoexQueryPlanner::execute(): ', e, file=sys.stderr)
+        return _results, _report
+
+    def _split(self, key, dtfrom, dttill, rows):
+        """Internal method collects rows for the original request.
+        """
+        if key[0] == 'board':
+            _res = [_r for _r in rows.get(key, []) if dtfrom <= _r['TRADEDATE'] <= dttill]
+            _res.sort(key=lambda _r: (_r['TRADEDATE'], _r['SECID']))
+            return _res
+        if key[0] == 'history':
+            _res = {_r['TRADEDATE']: _r for _r in rows.get(key, []) if dtfrom <= _r['TRADEDATE'] <= dttill}
+            for _bk, _br in rows.items():
+                if _bk[0] == 'board' and _bk[3] == key[2] and _bk[4] == key[3]:
+                    for _r in _br:
+                        if _r['SECID'] == key[1] and dtfrom <= _r['TRADEDATE'] <= dttill and _r['TRADEDATE'] not in _res:
+                            _res[_r['TRADEDATE']] = {_c: _v for _c, _v in _r.items() if _c != 'SECID'}
+            return [_res[_d] for _d in sorted(_res)]
+        _res = {_r['begin']: _r for _r in rows.get(key, []) if dtfrom <= _r['begin'].date() <= dttill}
+        _fk = self._fineKey(key, rows)
+        if _fk:
+            _fine = [_r for _r in rows[_fk] if dtfrom <= _r['begin'].date() <= dttill]
+            for _r in self._resampleCandles(_fine, key[3]):
+                if _r['begin'] not in _res:
+                    _res[_r['begin']] = _r
+        return [_res[_b] for _b in sorted(_res)]
@@ -1,9 +1,15 @@
+import concurrent.futures
 import sys
+import time
 import pandas as pd
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from .MoexImporter import MoexImporter
 from .MoexSessions import MoexSessions
 from .MoexCandlePeriods import MoexCandlePeriods
+from .MoexAdjuster import MoexAdjuster
+from .MoexPartialResultError import MoexPartialResultError
+from ._MoexRangeCache import _MoexRangeCache
+from ._MoexClock import _MoexClock
 
 class MoexSecurity:
     """Class MoexSecurity implements methods to
@@ -12,7 +18,7 @@ class MoexSecurity:
     Instance of MoexImporter should be created
     before.
     """
-    def __init__(self, seccode, mi):
+    def __init__(self, seccode, mi, cache_rows = 100000, retries = 3):
         """Class constructor initializes base variables
         and loads security-specific information from
         MOEX ISS.
@@ -25,6 +31,12 @@ class MoexSecurity:
             The object of MoexImporter that was
             created before. You can't use the class
             without this object.
+        cache_rows: int, optional
+            Maximum number of quotes and candles kept in memory to
+            answer repeated requests for overlapping ranges. Zero
+            disables the cache.
+        retries: int, optional
+            Number of repeated requests of a failed page.
         """
 
         self.seccode = seccode
@@ -66,6 +78,22 @@ class MoexSecurity:
         self.boards = {}
         """Boards for the security.
         """
+        self.corporate_actions = None
+        """Cached dividends and splits of the security.
+        """
+        self.memo = _MoexRangeCache(cache_rows)
+        """Memoization of loaded date ranges by board and session or interval.
+        Ranges ending before the current day are cached, least recently used
+        ranges are evicted when the limit of rows is reached.
+        """
+        self.retries = retries
+        """Number of repeated requests of a failed page.
+        """
+        self.retry_delay = 1.0
+        """Delay before the first repeated request in seconds. It's doubled
+        for every next attempt.
+        """
+        self._partial = {}
         if isinstance(mi, MoexImporter):
             _tmp = mi.getSecurity(seccode)
             for _ti in _tmp:
@@ -156,6 +184,8 @@ class MoexSecurity:
             _res = pd.DataFrame.from_dict(data=_tmp, )
             _res.set_index(['TRADEDATE',], inplace=True)
             _res.sort_index(inplace=True)
+        except MoexPartialResultError:
+            raise
         except Exception as e:
             print('MoexSecurity::getHistoryQuotesAsDataFrame(): ', e, file=sys.stderr)
         return _res
@@ -191,6 +221,8 @@ class MoexSecurity:
             'DURATION' - duration in days, may be None for non-bonds,  
             'VALUE' - trading value in rubles,  
             'QUANTITY' - trading value in securities.  
+            `None` is returned if the request failed with an error other
+            than MoexPartialResultError.
         """
         _res = []
         if isinstance(self.mi, MoexImporter):
@@ -199,39 +231,263 @@ class MoexSecurity:
                 _tb = board
             _rdf = max(dtfrom, self.boards[_tb]['dtfrom'])
             _rdt = min(dttill, self.boards[_tb]['dttill'])
-            _st = 0
-            _isNext = True
             try:
-                while _isNext:
-                    _isNext = False
-                    _tmp = self.mi.getHistoryQuotes(
-                        engine = self.boards[_tb]['engine'],
-                        market = self.boards[_tb]['market'],
-                        board = _tb,
-                        seccode = self.seccode,
-                        dtfrom = _rdf,
-                        dttill = _rdt,
-                        tsession = ts,
-                        start = _st,
-                    )
-
-                    for _ti in _tmp:
-                        if 'history' in _ti:
-#                            if _ti['history']:
-                            _thq = [
-                                {
-                                    ('VALUE' if _k =='VOLRUR' else 'QUANTITY' if _k == 'VOLUME' else 'YIELD' if _k == 'YIELDCLOSE' else _k): (datetime.strptime(_sq[_k], '%Y-%m-%d').date() if _k == 'TRADEDATE' else _sq[_k])
-                                    for _k in _sq
-                                    if _k in ['TRADEDATE', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'YIELD', 'DURATION', 'YIELDCLOSE', 'VOLUME', 'VALUE', 'WAPRICE', 'VOLRUR', 'FACEVALUE', 'ACCINT']
-                                } for _sq in _ti['history']
-                            ]
-                            _st += self.mi.limit
-                            _res += _thq
-                            if len(_thq) == self.mi.limit:
-                                _isNext = True
+                _res = self._memoized(
+                    ('history', _tb, ts), _rdf, _rdt,
+                    self._calendarLoad(_tb, ('history', ts), lambda _dtf, _dtt, _acc: self._loadHistory(_tb, _dtf, _dtt, ts, _acc)),
+                    lambda _r: _r['TRADEDATE'],
+                    _res,
+                )
+            except MoexPartialResultError as e:
+                e.rows = sorted(_res + e.rows, key=lambda _r: _r['TRADEDATE'])
+                e._resume = lambda: self.getHistoryQuotesAsArray(dtfrom, dttill, board=board, ts=ts)
+                raise
             except Exception as e:
+                _res = None
                 print('MoexSecurity::getHistoryQuotesAsArray(): ', e, file=sys.stderr)
         return _res
+
+    def getSessionsHistoryQuotesAsDataFrame(self, dtfrom, dttill, board = None, sessions = None, workers = 4):
+        """Returns quotes for several sessions as one pandas dataframe.
+        Sessions are requested in parallel. Every session is memoized
+        separately, so sessions already loaded for the range aren't
+        requested again.
+
+        Parameters
+        ----------
+        dtfrom: date
+            The left bound of the range to request quotes.
+        dttill: date
+            The right bound of the range to request quotes.
+        board: str, optional
+            Request quotes for the specific board. The primary board
+            is used if the parameter is ommited.
+        sessions: array_like, optional
+            MoexSessions to request. All sessions including `TotalSessions`
+            are requested if the parameter is ommited.
+        workers: int, optional
+            Number of sessions requested at the same time. The deadline of
+            `MoexImporter.deadline()` set in the calling thread applies to
+            all of them.
+
+        Returns
+        --------
+        pd.DataFrame
+            Quotes as pandas dataframe indexed by 'TRADEDATE' and 'session'
+            (value of MoexSessions). Columns are the same as in
+            `getHistoryQuotesAsDataFrame`, all of them are float64.
+            MoexPartialResultError of the first failed session is raised
+            after all sessions are finished; `resume()` of the exception
+            repeats this call.
+        """
+        _res = None
+        try:
+            _sessions = list(sessions) if sessions is not None else list(MoexSessions)
+            _rows = {}
+            _failed = None
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(_sessions)))) as _pool:
+                _left = self.mi.remaining()
+                _futures = {_pool.submit(self._sessionHistory, _left, dtfrom, dttill, board, _ts): _ts for _ts in _sessions}
+                for _f in concurrent.futures.as_completed(_futures):
+                    try:
+                        _rows[_futures[_f]] = _f.result()
+                    except MoexPartialResultError as e:
+                        _failed = _failed or e
+            if _failed is not None:
+                _failed._resume = lambda: self.getSessionsHistoryQuotesAsDataFrame(dtfrom, dttill, board=board, sessions=sessions, workers=workers)
+                raise _failed
+            _res = pd.DataFrame.from_records(
+                [dict(_r, session=int(_ts)) for _ts in _sessions for _r in _rows[_ts]],
+                columns=list(dict.fromkeys(['TRADEDATE', 'session'] + [_k for _ts in _sessions for _r in _rows[_ts] for _k in _r])),
+            )
+            _res = _res.astype({_c: 'float64' for _c in _res.columns if _c != 'TRADEDATE'} | {'session': 'int64'})
+            _res.set_index(['TRADEDATE', 'session'], inplace=True)
+            _res.sort_index(inplace=True)
+        except MoexPartialResultError:
+            raise
+        except Exception as e:
+            print('MoexSecurity::getSessionsHistoryQuotesAsDataFrame(): ', e, file=sys.stderr)
+        return _res
+
+    def _sessionHistory(self, left, dtfrom, dttill, board, ts):
+        """Internal method loads history quotes of the session in a worker
+        thread. The deadline of the calling thread is thread-local, so it's
+        passed as seconds left and entered again in the worker.
+        """
+        if left is None:
+            _res = self.getHistoryQuotesAsArray(dtfrom, dttill, board, ts)
+        else:
+            with self.mi.deadline(max(left, 0)):
+                _res = self.getHistoryQuotesAsArray(dtfrom, dttill, board, ts)
+        if _res is None:
+            raise RuntimeError(f'history of session {int(ts):d} failed')
+        return _res
+
+    def _loadHistory(self, board, dtfrom, dttill, ts, res):
+        """Internal method requests all pages of history quotes for the range
+        and appends them to `res`.
+        """
+        return self._loadPages(
+            ('history', board, ts, dtfrom, dttill),
+            lambda _st: self.mi.getHistoryQuotes(
+                engine = self.boards[board]['engine'],
+                market = self.boards[board]['market'],
+                board = board,
+                seccode = self.seccode,
+                dtfrom = dtfrom,
+                dttill = dttill,
+                tsession = ts,
+                start = _st,
+            ),
+            'history',
+            self._parseHistory,
+            res,
+        )
+
+    def _loadPages(self, key, request, block, parse, res):
+        """Internal method requests pages of the reply one by one and appends
+        rows of all pages to `res`. A page failed with a transient error
+        (timeout, network error, HTTP 5xx, 408 or 429) is requested again up
+        to `retries` times, other HTTP errors aren't retried. If the page
+        still fails, the loaded pages are kept by the
+        key and MoexPartialResultError is raised; the next call with the same
+        key continues from the failed page.
+
+        Parameters
+        ----------
+        key: tuple
+            Key of the request, e.g. ('history', board, session, dtfrom, dttill).
+        request: callable
+            Function `request(start)` returns the reply for the cursor or `None`.
+        block: str
+            Name of the block with rows.
+        parse: callable
+            Function converts the block to rows.
+        res: array_like
+            List to append rows to.
+
+        Returns
+        -------
+        array_like
+            `res` with all rows appended.
+        """
+        _state = self._partial.pop(key, None) or {'start': 0, 'rows': [], 'pages': []}
+        _isNext = True
+        while _isNext:
+            _isNext = False
+            _page = {'start': _state['start'], 'status': 'failed', 'rows': 0, 'attempts': 0}
+            _state['pages'].append(_page)
+            _tmp = None
+            while _tmp is None and _page['attempts'] <= self.retries:
+                if _page['attempts']:
+                    _delay = self.retry_delay * 2 ** (_page['attempts'] - 1)
+                    _left = self.mi.remaining()
+                    if _left is not None and _left <= _delay:
+                        break
+                    time.sleep(_delay)
+                _page['attempts'] += 1
+                _tmp = request(_page['start'])
+                if _tmp is None and not self._transient(self.mi.lastStatus()):
+                    break
+                if _tmp is not None and not any(block in _ti for _ti in _tmp):
+                    _tmp = None
+            if _tmp is None:
+                self._partial[key] = _state
+                _status = self.mi.lastStatus()
+                raise MoexPartialResultError(
+                    f'{self.seccode:s}: page {_page["start"]:d} of {block:s} failed after {_page["attempts"]:d} attempts'
+                    + (f' (HTTP {_status:d})' if _status else ''),
+                    list(_state['rows']),
+                    list(_state['pages']),
+                )
+            _rows = []
+            for _ti in _tmp:
+                if block in _ti:
+                    _rows += parse(_ti[block])
+            _page['status'] = 'ok'
+            _page['rows'] = len(_rows)
+            _state['rows'] += _rows
+            _state['start'] += self.mi.limit
+            if len(_rows) == self.mi.limit:
+                _isNext = True
+        res += _state['rows']
+        return res
+
+    @staticmethod
+    def _transient(status):
+        """Internal method returns `True` if a request that failed with the
+        HTTP status may succeed when repeated.
+        """
+        return status is None or status >= 500 or status in (408, 429)
+
+    def _calendarLoad(self, board, kind, load):
+        """Internal method wraps the loader `load(dtfrom, dttill, res)` to trim
+        requests by the trading calendar of MoexImporter object and skip
+        ranges known to be empty. The loader is returned as is if there is
+        no calendar.
+        """
+        _cal = self.mi.calendar
+        if _cal is None:
+            return load
+        _key = (self.seccode, board) + kind
+
+        def _load(dtfrom, dttill, res):
+            for _gf, _gt in _cal.pending(_key, board, dtfrom, dttill, self.boards[board]['engine'], self.boards[board]['market']):
+                _n = len(res)
+                load(_gf, _gt, res)
+                if kind[0] == 'history':
+                    _cal.learnHistory(self.seccode, board, _gf, _gt, res[_n:], kind[1])
+                if len(res) == _n:
+                    _cal.markEmpty(_key, _gf, _gt)
+            return res
+        return _load
+
+    def _memoized(self, key, dtfrom, dttill, load, datefn, res, keyfn = None):
+        """Internal method answers the request from memoized ranges and loads
+        only uncovered gaps. The current Moscow day is always loaded and isn't
+        cached.
+
+        Parameters
+        ----------
+        key: tuple
+            Key of the data, e.g. ('history', board, session).
+        dtfrom: date
+            The left bound of the range.
+        dttill: date
+            The right bound of the range.
+        load: callable
+            Function `load(dtfrom, dttill, res)` that appends rows for the
+            range to `res`.
+        datefn: callable
+            Function returns the date of the row.
+        res: array_like
+            List to append rows to. Rows loaded before an exception stay in it.
+        keyfn: callable, optional
+            Function returns the unique key of the row, the date by default.
+
+        Returns
+        -------
+        array_like
+            Rows sorted by date.
+        """
+        _today = _MoexClock.today()
+        _cdt = min(dttill, _today - timedelta(days=1))
+        if self.memo.max_rows > 0 and dtfrom <= _cdt:
+            _gaps = self.memo.gaps(key, dtfrom, _cdt)
+            res += [dict(_r) for _r in self.memo.get(key, dtfrom, _cdt)]
+            for _gf, _gt in _gaps:
+                _tmp = []
+                try:
+                    load(_gf, _gt, _tmp)
+                finally:
+                    res += [dict(_r) for _r in _tmp]
+                self.memo.put(key, _gf, _gt, _tmp, datefn, keyfn)
+            res.sort(key=datefn)
+            if dttill >= _today:
+                load(max(dtfrom, _today), dttill, res)
+        else:
+            load(dtfrom, dttill, res)
+        return res
     
     def getCandleQuotesAsDataFrame(self, dtfrom, dttill, board = None, interval = MoexCandlePeriods.Period1Day):
         """Returns candles for the security as a pandas dataframe.
@@ -270,6 +526,8 @@ class MoexSecurity:
                 _res = pd.DataFrame.from_dict(data=_tmp, )
                 _res.set_index(['begin',], inplace=True)
                 _res.sort_index(inplace=True)
+        except MoexPartialResultError:
+            raise
         except Exception as e:
             print('MoexSecurity::getCandleQuotesAsDataFrame(): ', e, file=sys.stderr)
         return _res
@@ -303,6 +561,8 @@ class MoexSecurity:
             'close' - last price,
             'value' - trading value in rubles,
             'quantity' - trading value in securities.
+            `None` is returned if the request failed with an error other
+            than MoexPartialResultError.
         """
         _res = []
         if isinstance(self.mi, MoexImporter) and isinstance(interval, MoexCandlePeriods):
@@ -311,39 +571,158 @@ class MoexSecurity:
                 _tb = board
             _rdf = max(dtfrom, self.boards[_tb]['dtfrom'])
             _rdt = min(dttill, self.boards[_tb]['dttill'])
-            _st = 0
-            _isNext = True
             try:
-                while _isNext:
-                    _isNext = False
-                    _tmp = self.mi.getCandles(
-                        engine = self.boards[_tb]['engine'],
-                        market = self.boards[_tb]['market'],
-                        board = _tb,
-                        seccode = self.seccode,
-                        dtfrom = _rdf,
-                        dttill = _rdt,
-                        candleperiod = interval,
-                        start = _st,
-                    )
-
-                    for _ti in _tmp:
-                        if 'candles' in _ti:
-                            _thq = [
-                                {
-                                    ('quantity' if _k == 'volume' else _k): (datetime.strptime(_sq[_k], '%Y-%m-%d %H:%M:%S') if _k == 'begin' else datetime.strptime(_sq[_k], '%Y-%m-%d %H:%M:%S') if _k == 'end' else _sq[_k])
-                                    for _k in _sq
-                                    if _k in ['open', 'close', 'low', 'high', 'value', 'volume', 'begin', 'end',]
-                                } for _sq in _ti['candles']
-                            ]
-                            _st += self.mi.limit
-                            _res += _thq
-                            if len(_thq) == self.mi.limit:
-                                _isNext = True
+                _res = self._memoized(
+                    ('candles', _tb, interval), _rdf, _rdt,
+                    self._calendarLoad(_tb, ('candles', interval), lambda _dtf, _dtt, _acc: self._loadCandles(_tb, _dtf, _dtt, interval, _acc)),
+                    lambda _r: _r['begin'].date(),
+                    _res,
+                    lambda _r: _r['begin'],
+                )
+            except MoexPartialResultError as e:
+                e.rows = sorted(_res + e.rows, key=lambda _r: _r['begin'])
+                e._resume = lambda: self.getCandleQuotesAsArray(dtfrom, dttill, board=board, interval=interval)
+                raise
             except Exception as e:
+                _res = None
                 print('MoexSecurity::getCandleQuotesAsArray(): ', e, file=sys.stderr)
         return _res
-            
+
+    def _loadCandles(self, board, dtfrom, dttill, interval, res):
+        """Internal method requests all pages of candles for the range
+        and appends them to `res`.
+        """
+        return self._loadPages(
+            ('candles', board, interval, dtfrom, dttill),
+            lambda _st: self.mi.getCandles(
+                engine = self.boards[board]['engine'],
+                market = self.boards[board]['market'],
+                board = board,
+                seccode = self.seccode,
+                dtfrom = dtfrom,
+                dttill = dttill,
+                candleperiod = interval,
+                start = _st,
+            ),
+            'candles',
+            self._parseCandles,
+            res,
+        )
+
+    def getCorporateActions(self, refresh = False):
+        """Returns dividends and splits of the security. Actions are requested
+        from MOEX ISS once and cached in the `corporate_actions` attribute.
+
+        Parameters
+        ----------
+        refresh: boolean, optional
+            If `True`, actions are requested again.
+
+        Returns
+        --------
+        array_like
+            Actions sorted by date as an array of dicts.
+            Dict keys:
+            'type' - 'dividend' or 'split',
+            'date' - registry close date for dividends, trade date for splits,
+            'value' - dividend per share, `None` for splits,
+            'before' - number of shares before the split, `None` for dividends,
+            'after' - number of shares after the split, `None` for dividends.
+        """
+        if isinstance(self.mi, MoexImporter) and (refresh or self.corporate_actions is None):
+            try:
+                _dv = self.mi.getDividends(self.seccode)
+                _sp = self.mi.getSplits(self.seccode)
+                if _dv is not None and _sp is not None:
+                    self.corporate_actions = MoexAdjuster._parseCorporateActions(_dv, _sp)
+            except Exception as e:
+                print('MoexSecurity::getCorporateActions(): ', e, file=sys.stderr)
+        return self.corporate_actions
+
+    def getAdjustedHistoryQuotesAsDataFrame(self, dtfrom, dttill, board = None, ts = MoexSessions.MainSession, dividends = True):
+        """Returns quotes for the security adjusted for splits and dividends
+        as a pandas dataframe. Prices are multiplied by cumulative adjustment
+        factors, quantity is adjusted for splits only.
+
+        Parameters
+        ----------
+        dtfrom: date
+            The left bound of the range to request quotes.
+        dttill: date
+            The right bound of the range to request quotes.
+        board: str, optional
+            Request quotes for the specific board. The primary board
+            is used if the parameter is ommited.
+        ts: MoexSessions, optional
+            Request quotes for the specific session. The main session
+            is used if the parameter is ommited.
+        dividends: boolean, optional
+            If `False`, quotes are adjusted for splits only.
+
+        Returns
+        --------
+        pd.DataFrame
+            Adjusted quotes with the same columns as `getHistoryQuotesAsDataFrame`.
+            MoexPartialResultError of the quotes is raised as is.
+        """
+        _res = None
+        try:
+            _tmp = self.getHistoryQuotesAsDataFrame(dtfrom=dtfrom, dttill=dttill, board=board, ts=ts)
+            _acts = self.getCorporateActions()
+            if _tmp is not None and _acts is not None:
+                _res = MoexAdjuster.applyActions({self.seccode: _tmp}, {self.seccode: _acts}, dividends=dividends)[self.seccode]
+        except MoexPartialResultError:
+            raise
+        except Exception as e:
+            print('MoexSecurity::getAdjustedHistoryQuotesAsDataFrame(): ', e, file=sys.stderr)
+        return _res
+
+    @staticmethod
+    def _parseHistory(history, keys = ()):
+        """Internal method to convert raw history quotes from MOEX ISS reply.
+
+        Parameters
+        ----------
+        history: array_like
+            Content of the `history` block of the reply.
+        keys: array_like, optional
+            Additional keys to keep, e.g. 'SECID' for board-wide replies.
+
+        Returns
+        --------
+        array_like
+            Quotes as an array of dicts in the format of `getHistoryQuotesAsArray`.
+        """
+        return [
+            {
+                ('VALUE' if _k =='VOLRUR' else 'QUANTITY' if _k == 'VOLUME' else 'YIELD' if _k == 'YIELDCLOSE' else _k): (datetime.strptime(_sq[_k], '%Y-%m-%d').date() if _k == 'TRADEDATE' else _sq[_k])
+                for _k in _sq
+                if _k in ['TRADEDATE', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'YIELD', 'DURATION', 'YIELDCLOSE', 'VOLUME', 'VALUE', 'WAPRICE', 'VOLRUR', 'FACEVALUE', 'ACCINT'] or _k in keys
+            } for _sq in history
+        ]
+
+    @staticmethod
+    def _parseCandles(candles):
+        """Internal method to convert raw candles from MOEX ISS reply.
+
+        Parameters
+        ----------
+        candles: array_like
+            Content of the `candles` block of the reply.
+
+        Returns
+        --------
+        array_like
+            Candles as an array of dicts in the format of `getCandleQuotesAsArray`.
+        """
+        return [
+            {
+                ('quantity' if _k == 'volume' else _k): (datetime.strptime(_sq[_k], '%Y-%m-%d %H:%M:%S') if _k == 'begin' else datetime.strptime(_sq[_k], '%Y-%m-%d %H:%M:%S') if _k == 'end' else _sq[_k])
+                for _k in _sq
+                if _k in ['open', 'close', 'low', 'high', 'value', 'volume', 'begin', 'end',]
+            } for _sq in candles
+        ]
+
     def __str__(self):
         _res = f'''
 Security {self.seccode:s} ({self.shortname:s})
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import socket
+import sys
+import time
+from .MoexBulkLoader import MoexBulkLoader, _loadJob, _releaseImporter
+from ._MoexLease import _MoexLease
+
+class MoexShardedLoader(MoexBulkLoader):
+    """Class MoexShardedLoader runs the bulk download of one job spec on
+    several nodes (hosts or processes) that share a directory.
+
+    Jobs are split between nodes deterministically by the hash of the job id,
+    every node starts with its own shard. Before a job is executed, the node
+    claims it with a lease file in `<shared>/leases`; the lease is renewed
+    while the job runs and expires if the node dies. When its shard is done,
+    the node takes over jobs of other shards that aren't leased, so jobs of
+    a dead node are finished by the others after the lease expires. Chunks
+    already written by the dead node are kept by checkpoints.
+
+    Replies of requests that end more than a day before the current Moscow
+    date are stored in the content-addressed cache `<shared>/cache` and read by all nodes, so the
+    same data is requested from MOEX ISS once.
+
+    The `output` directory of the spec should be on the shared storage as
+    well. Clocks of hosts should be synchronized, because lease expiry uses
+    wall clock.
+    """
+    def __init__(self, spec, shared, node = 0, nodes = 1, lease_ttl = 60.0, workers = None, processes = False, rate = None, header = None):
+        """Class constructor parses the job spec.
+
+        Parameters
+        ----------
+        spec: dict or str
+            Job spec or a path to the JSON file with it.
+        shared: str
+            Directory shared by all nodes for leases and the response cache.
+        node: int, optional
+            Number of the node from 0 to `nodes - 1`.
+        nodes: int, optional
+            Total number of nodes.
+        lease_ttl: float, optional
+            Lease time in seconds. A job of a dead node is taken over after
+            this time.
+        workers: int, optional
+            Number of workers of the node.
+        processes: boolean, optional
+            If `True`, jobs are executed in a process pool instead of threads.
+        rate: float, optional
+            Budget of requests per second of the node.
+        header: dict, optional
+            HTTP-header for MoexImporter objects of workers.
+        """
+        super().__init__(spec, workers=workers, processes=processes, rate=rate, header=header)
+        self.shared = shared
+        """Directory shared by all nodes.
+        """
+        self.node = node
+        """Number of the node.
+        """
+        self.nodes = max(1, nodes)
+        """Total number of nodes.
+        """
+        self.lease_ttl = lease_ttl
+        """Lease time in seconds.
+        """
+        self.name = f'{socket.gethostname():s}:{os.getpid():d}:{node:d}'
+        """Name of the node in lease files.
+        """
+
+    def shard(self, job):
+        """Returns the number of the node the job belongs to.
+
+        Parameters
+        ----------
+        job: dict
+            Normalized job from the `jobs` attribute.
+
+        Returns
+        -------
+        int
+            Number of the node.
+        """
+        return int(hashlib.sha1(job['id'].encode('utf-8')).hexdigest(), 16) % self.nodes
+
+    def _options(self):
+        """Internal method returns options passed to workers.
+        """
+        _res = super()._options()
+        _res['cache'] = os.path.join(self.shared, 'cache')
+        _res['leases'] = os.path.join(self.shared, 'leases')
+        _res['node'] = self.name
+        _res['lease_ttl'] = self.lease_ttl
+        return _res
+
+    def run(self, progress = True):
+        """Executes pending jobs until all jobs of the spec are completed by
+        this or other nodes. Jobs of the own shard are executed first, then
+        jobs of other shards in the order of nodes after this one.
+
+        Parameters
+        ----------
+        progress: boolean, optional
+            If `True`, throughput and ETA are printed to stderr.
+
+        Returns
+        -------
+        dict
+            Summary with the number of jobs completed and failed by this node,
+            jobs completed by other nodes (`skipped`), rows loaded by this node
+            and errors by job id.
+        """
+        os.makedirs(self.output, exist_ok=True)
+        _res = {
+            'jobs': len(self.jobs),
+            'completed': 0,
+            'failed': 0,
+            'skipped': 0,
+            'rows': 0,
+            'errors': {},
+        }
+        try:
+            while True:
+                _pending = [_job for _job in self.jobs if _job['id'] not in _res['errors'] and self.pendingChunks(_job)]
+                if not _pending:
+                    break
+                _pending.sort(key=lambda _job: (self.shard(_job) - self.node) % self.nodes)
+                _tmp = self._runJobs(_pending, progress, _loadShardedJob)
+                for _k in ['completed', 'failed', 'rows']:
+                    _res[_k] += _tmp[_k]
+                _res['errors'].update(_tmp['errors'])
+                if _tmp['completed'] + _tmp['failed'] == 0:
+                    # all pending jobs are leased by other nodes
+                    time.sleep(min(1.0, self.lease_ttl / 4))
+        finally:
+            _releaseImporter(self._run)
+        _res['skipped'] = _res['jobs'] - _res['completed'] - _res['failed']
+        return _res
+
+def _loadShardedJob(job, options, progress):
+    """Internal function claims the job and executes it while the lease is held.
+    The job is skipped if it's leased by another node or completed.
+    """
+    _lease = _MoexLease(options['leases'], job['id'], options['node'], options['lease_ttl'])
+    try:
+        _claimed = _lease.acquire()
+    except Exception as e:
+        print('MoexShardedLoader::_loadShardedJob(): ', job['id'], e, file=sys.stderr)
+        progress.put(('error', job['id'], str(e)))
+        return
+    if not _claimed:
+        progress.put(('skipped', job['id'], None))
+        return
+    try:
+        _ckpt = MoexBulkLoader._readCheckpoint(options['output'], job)
+        if _ckpt and _ckpt['done_till'] and MoexBulkLoader._jobChunks(job)[-1][1].isoformat() <= _ckpt['done_till']:
+            progress.put(('skipped', job['id'], None))
+            return
+        _lease.keepAlive()
+        _loadJob(job, options, progress, fence=_lease.held)
+    finally:
+        _lease.release()
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from multiprocessing import shared_memory, resource_tracker
+
+class MoexSharedFrames:
+    """Class MoexSharedFrames implements sharing of loaded dataframes between
+    processes of one host through `multiprocessing.shared_memory`.
+
+    The publisher process copies numeric columns and the index of a dataframe
+    into a shared memory block once. Consumer processes attach to the block
+    and get a dataframe of numpy views without copying, so the data is loaded
+    once and kept in RAM once per host.
+
+    Published frames are listed in a small registry block with the name
+    `<namespace>_registry`. Republishing a frame creates a new block, consumers
+    attached to the previous version keep their data until they detach.
+    Only one process should publish frames to the namespace.
+    """
+    _align = 64
+    """Alignment of arrays in the block.
+    """
+    _tracker_lock = threading.Lock()
+    """Lock of the resource tracker registration while a block is attached.
+    """
+
+    def __init__(self, namespace = 'moex', registry_size = 1 << 20, timeout = 5.0):
+        """Class constructor.
+
+        Parameters
+        ----------
+        namespace: str, optional
+            Namespace of shared memory blocks.
+        registry_size: int, optional
+            Size of the registry block in bytes.
+        timeout: float, optional
+            Time in seconds to wait for the registry being written by the
+            publisher.
+        """
+        self.namespace = namespace
+        """Namespace of shared memory blocks.
+        """
+        self.registry_size = registry_size
+        """Size of the registry block in bytes.
+        """
+        self.timeout = timeout
+        """Time in seconds to wait for the registry being written.
+        """
+        self._registry = None
+        self._owner = False
+        self._published = {}
+        self._attached = {}
+
+    @classmethod
+    def _open(cls, name):
+        """Internal method attaches to the existing block. The block isn't
+        tracked, so it isn't unlinked when the consumer process exits.
+
+        Before Python 3.13 attaching always registers the block with the
+        resource tracker. Unregistering it afterwards would also drop the
+        registration of the publisher if the tracker is shared (the same
+        process or its children), so the registration of the block is
+        skipped instead.
+        """
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            pass
+        with cls._tracker_lock:
+            _register = resource_tracker.register
+
+            def _skip(_name, _rtype):
+                if _rtype != 'shared_memory' or _name.lstrip('/') != name:
+                    _register(_name, _rtype)
+
+            resource_tracker.register = _skip
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = _register
+
+    def _openRegistry(self, create):
+        """Internal method opens or creates the registry block.
+        """
+        if self._registry is None:
+            _rn = f'{self.namespace}_registry'
+            try:
+                self._registry = self._open(_rn)
+            except FileNotFoundError:
+                if not create:
+                    raise
+                self._registry = shared_memory.SharedMemory(name=_rn, create=True, size=self.registry_size)
+                self._owner = True
+                np.ndarray((2,), dtype='<u8', buffer=self._registry.buf)[:] = 0
+        return self._registry
+
+    def _readRegistry(self):
+        """Internal method reads the registry. The header keeps the sequence
+        number (odd while the registry is written) and the length of JSON.
+        TimeoutError is raised if the registry stays in writing longer than
+        `timeout`, e.g. the publisher died during the write.
+        """
+        _reg = self._openRegistry(False)
+        _hdr = np.ndarray((2,), dtype='<u8', buffer=_reg.buf)
+        _till = time.monotonic() + self.timeout
+        while True:
+            _seq = int(_hdr[0])
+            if _seq % 2 == 0:
+                _len = int(_hdr[1])
+                _raw = bytes(_reg.buf[16:16 + _len])
+                if int(_hdr[0]) == _seq:
+                    return json.loads(_raw) if _len else {}
+            if time.monotonic() > _till:
+                raise TimeoutError(f'registry {_reg.name:s} is being written for more than {self.timeout:g} s')
+            time.sleep(0.001)
+
+    def _writeRegistry(self, entries):
+        """Internal method writes the registry. The sequence number is made odd
+        first, so the registry left in writing by a dead publisher is recovered.
+        """
+        _reg = self._openRegistry(True)
+        _raw = json.dumps(entries).encode('utf-8')
+        if len(_raw) + 16 > _reg.size:
+            raise ValueError('registry is full')
+        _hdr = np.ndarray((2,), dtype='<u8', buffer=_reg.buf)
+        _seq = int(_hdr[0]) | 1
+        _hdr[0] = _seq
+        _reg.buf[16:16 + len(_raw)] = _raw
+        _hdr[1] = len(_raw)
+        _hdr[0] = _seq + 1
+
+    def _publishedEntries(self):
+        """Internal method reads the registry for the publisher. The registry
+        left in writing by a dead publisher is started again.
+        """
+        try:
+            return self._readRegistry()
+        except FileNotFoundError:
+            return {}
+        except TimeoutError as e:
+            print('MoexSharedFrames::_publishedEntries(): registry is reset,', e, file=sys.stderr)
+            return {}
+
+    @staticmethod
+    def _array(values):
+        """Internal method converts values to a numpy array. Dates and
+        datetimes kept as objects (e.g. the index of
+        `MoexSecurity.getHistoryQuotesAsDataFrame`) are converted to
+        datetime64[ns].
+        """
+        _res = np.asarray(values)
+        if _res.dtype.kind == 'O' and len(_res) and isinstance(_res[0], (date, datetime)):
+            _res = pd.to_datetime(_res).to_numpy(dtype='datetime64[ns]')
+        return _res
+
+    @staticmethod
+    def _label(value):
+        """Internal method converts a column label to JSON.
+        """
+        return list(value) if isinstance(value, tuple) else value
+
+    def publish(self, name, df):
+        """Copies the dataframe to shared memory and registers it.
+
+        Parameters
+        ----------
+        name: str
+            Name of the frame.
+        df: pd.DataFrame
+            Dataframe to share. Numeric, boolean and datetime columns are
+            shared, other columns are skipped. The index should be numeric
+            or datetime; indexes and columns of `date` objects are shared as
+            datetime64[ns].
+
+        Returns
+        -------
+        str
+            Name of the shared memory block or `None` on failure.
+        """
+        _res = None
+        try:
+            _entries = self._publishedEntries()
+            _version = _entries.get(name, {}).get('version', 0) + 1
+            _arrays = [('index', self._array(df.index))]
+            _columns = []
+            for _i, _c in enumerate(df.columns):
+                _a = self._array(df.iloc[:, _i])
+                if _a.dtype.kind in 'biufM':
+                    _arrays.append((_c, _a))
+                    _columns.append(_c)
+                else:
+                    print('MoexSharedFrames::publish(): column is skipped', _c, file=sys.stderr)
+            _layout = []
+            _offset = 0
+            for _c, _a in _arrays:
+                _layout.append({'dtype': _a.dtype.str, 'offset': _offset})
+                _offset += -(-_a.nbytes // self._align) * self._align
+            _shm = None
+            while _shm is None:
+                _bn = f'{self.namespace}_{hashlib.md5(name.encode("utf-8")).hexdigest()[:12]}_{_version:d}'
+                try:
+                    _shm = shared_memory.SharedMemory(name=_bn, create=True, size=max(_offset, 1))
+                except FileExistsError:
+                    # the block is left by a dead publisher
+                    _version += 1
+            for (_c, _a), _l in zip(_arrays, _layout):
+                np.ndarray(_a.shape, dtype=_a.dtype, buffer=_shm.buf, offset=_l['offset'])[:] = _a
+            _entries[name] = {
+                'block': _bn,
+                'version': _version,
+                'rows': len(df),
+                'index': dict(_layout[0], name=self._label(df.index.name)),
+                'columns': [dict(_l, name=self._label(_c)) for _c, _l in zip(_columns, _layout[1:])],
+                'nlevels': df.columns.nlevels,
+                'names': [self._label(_n) for _n in df.columns.names],
+            }
+            self._writeRegistry(_entries)
+            _old = self._published.pop(name, None)
+            if _old is not None:
+                _old.close()
+                _old.unlink()
+            self._published[name] = _shm
+            _res = _bn
+        except Exception as e:
+            print('MoexSharedFrames::publish(): ', e, file=sys.stderr)
+        return _res
+
+    def unpublish(self, name):
+        """Removes the frame from the registry and frees its block. Consumers
+        attached to the frame keep their data until they detach.
+
+        Parameters
+        ----------
+        name: str
+            Name of the frame.
+        """
+        try:
+            _entries = self._publishedEntries()
+            _entries.pop(name, None)
+            self._writeRegistry(_entries)
+            _shm = self._published.pop(name, None)
+            if _shm is not None:
+                _shm.close()
+                _shm.unlink()
+        except Exception as e:
+            print('MoexSharedFrames::unpublish(): ', e, file=sys.stderr)
+
+    def names(self):
+        """Returns names and versions of published frames.
+
+        Returns
+        -------
+        dict
+            Versions by names of frames.
+        """
+        _res = {}
+        try:
+            _res = {_n: _e['version'] for _n, _e in self._readRegistry().items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print('MoexSharedFrames::names(): ', e, file=sys.stderr)
+        return _res
+
+    def attach(self, name):
+        """Returns the published frame as a dataframe of views of shared memory.
+        The data isn't copied and should be treated as read-only.
+
+        Parameters
+        ----------
+        name: str
+            Name of the frame.
+
+        Returns
+        -------
+        pd.DataFrame
+            Shared dataframe or `None` if the frame isn't published.
+        """
+        _res = None
+        try:
+            _entry = self._readRegistry().get(name)
+            if _entry is not None:
+                _shm = self._attached.get(_entry['block'])
+                if _shm is None:
+                    _shm = self._open(_entry['block'])
+                    self._attached[_entry['block']] = _shm
+
+                def _view(_l):
+                    _a = np.ndarray((_entry['rows'],), dtype=np.dtype(_l['dtype']), buffer=_shm.buf, offset=_l['offset'])
+                    _a.flags.writeable = False
+                    return _a
+
+                _labels = [tuple(_c['name']) if _entry['nlevels'] > 1 else _c['name'] for _c in _entry['columns']]
+                _res = pd.DataFrame(
+                    {_i: _view(_c) for _i, _c in enumerate(_entry['columns'])},
+                    index=pd.Index(_view(_entry['index']), name=_entry['index']['name'], copy=False),
+                    copy=False,
+                )
+                _res.columns = pd.MultiIndex.from_tuples(_labels, names=_entry['names']) if _entry['nlevels'] > 1 else pd.Index(_labels, name=_entry['names'][0])
+        except Exception as e:
+            print('MoexSharedFrames::attach(): ', e, file=sys.stderr)
+        return _res
+
+    def detach(self):
+        """Closes all attached blocks. Dataframes returned by `attach` must not
+        be used after the call.
+        """
+        for _bn in list(self._attached):
+            try:
+                self._attached.pop(_bn).close()
+            except BufferError:
+                print('MoexSharedFrames::detach(): block is still in use', _bn, file=sys.stderr)
+
+    def close(self):
+        """Detaches from all frames. Frames published by the object are freed
+        and the registry is removed if it was created by the object.
+        """
+        self.detach()
+        for _name in list(self._published):
+            self.unpublish(_name)
+        if self._registry is not None:
+            self._registry.close()
+            if self._owner:
+                self._registry.unlink()
+            self._registry = None
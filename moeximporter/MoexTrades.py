@@ -0,0 +1,239 @@
+import asyncio
+import concurrent.futures
+import sys
+import threading
+import numpy as np
+from .MoexImporter import MoexImporter
+from .MoexSecurity import MoexSecurity
+
+class MoexTrades:
+    """Class MoexTrades implements incremental loading of trades
+    (tick data) of the current session.
+
+    Trades are paged by the `tradeno` cursor: every request asks only
+    for trades following the last seen one, so loading can be resumed
+    at any time without repeated downloads. Trades are returned in
+    batches as numpy structured arrays with the `dtype` attribute.
+
+    Instance of MoexImporter should be created before.
+    """
+    dtype = np.dtype([
+        ('TRADENO', '<i8'),
+        ('SYSTIME', 'datetime64[s]'),
+        ('PRICE', '<f8'),
+        ('QUANTITY', '<i8'),
+        ('VALUE', '<f8'),
+        ('BUYSELL', 'S1'),
+    ])
+    """Type of trade arrays.
+    """
+
+    def __init__(self, mi, limit = 5000):
+        """Class constructor initializes base variables.
+
+        Parameters
+        ----------
+        mi: MoexImporter
+            The object of MoexImporter that was created before.
+        limit: int, optional
+            Maximum number of trades per request.
+        """
+        self.mi = mi
+        """MoexImporter object.
+        """
+        self.limit = limit
+        """Maximum number of trades per request.
+        """
+        self.cursors = {}
+        """Number of the last loaded trade by (ticker, board).
+        """
+        self._lock = threading.Lock()
+        if not isinstance(mi, MoexImporter):
+            print('MoexTrades::__init__(): must be initialized with MoexImporter object.', file=sys.stderr)
+
+    @classmethod
+    def _parseTrades(cls, trades):
+        """Internal method to convert the `trades` block of MOEX ISS reply
+        to the structured array.
+        """
+        _res = np.empty(len(trades), dtype=cls.dtype)
+        _res['TRADENO'] = [_t['TRADENO'] for _t in trades]
+        _res['SYSTIME'] = [_t['SYSTIME'] for _t in trades]
+        _res['PRICE'] = [_t['PRICE'] if _t['PRICE'] is not None else np.nan for _t in trades]
+        _res['QUANTITY'] = [_t['QUANTITY'] for _t in trades]
+        _res['VALUE'] = [_t['VALUE'] if _t['VALUE'] is not None else np.nan for _t in trades]
+        _res['BUYSELL'] = [(_t.get('BUYSELL') or '') for _t in trades]
+        return _res
+
+    def iterTrades(self, sec, board = None, tradeno = None):
+        """Returns the generator of trade batches for the security. Every
+        batch starts after the last trade of the previous one. The cursor is
+        saved in the `cursors` attribute, so the next call continues from
+        the last loaded trade.
+
+        Parameters
+        ----------
+        sec: MoexSecurity
+            The security to load trades for.
+        board: str, optional
+            Request trades for the specific board. The primary board
+            is used if the parameter is ommited.
+        tradeno: int, optional
+            Load trades following the trade with this number. The saved
+            cursor is used if the parameter is ommited.
+
+        Returns
+        -------
+        generator
+            Batches of trades as structured arrays with `dtype`.
+        """
+        if not isinstance(sec, MoexSecurity):
+            print('MoexTrades::iterTrades(): sec should be MoexSecurity', file=sys.stderr)
+            return
+        _tb = board if board else sec.mainboard
+        _key = (sec.seccode, _tb)
+        with self._lock:
+            _cursor = tradeno if tradeno is not None else self.cursors.get(_key)
+        _isNext = True
+        while _isNext:
+            _isNext = False
+            _tmp = self.mi.getTrades(
+                engine = sec.boards[_tb]['engine'],
+                market = sec.boards[_tb]['market'],
+                board = _tb,
+                seccode = sec.seccode,
+                tradeno = _cursor,
+                limit = self.limit,
+            )
+            if _tmp is None:
+                print('MoexTrades::iterTrades(): request failed, cursor', _cursor, file=sys.stderr)
+                break
+            for _ti in _tmp:
+                if 'trades' in _ti and _ti['trades']:
+                    _batch = self._parseTrades(_ti['trades'])
+                    _cursor = int(_batch['TRADENO'][-1])
+                    with self._lock:
+                        self.cursors[_key] = _cursor
+                    yield _batch
+                    if len(_batch) == self.limit:
+                        _isNext = True
+
+    def getTradesAsArray(self, sec, board = None, tradeno = None):
+        """Returns all trades for the security following the cursor as
+        one structured array. Arguments are the same as for `iterTrades`.
+
+        Returns
+        -------
+        np.ndarray
+            Trades as a structured array with `dtype`.
+        """
+        _res = np.empty(0, dtype=self.dtype)
+        try:
+            _batches = list(self.iterTrades(sec, board=board, tradeno=tradeno))
+            if _batches:
+                _res = np.concatenate(_batches)
+        except Exception as e:
+            print('MoexTrades::getTradesAsArray(): ', e, file=sys.stderr)
+        return _res
+
+    def loadParallel(self, secs, callback, board = None, workers = 4):
+        """Loads trades following the saved cursors for several securities
+        in parallel threads. Batches are passed to the callback as soon
+        as they arrive, so the memory is bounded by the batch size.
+
+        Parameters
+        ----------
+        secs: array_like
+            List of MoexSecurity objects.
+        callback: callable
+            Function called as `callback(seccode, batch)`. It may be called
+            from different threads. If it raises
+            `concurrent.futures.CancelledError`, loading of all securities
+            is stopped.
+        board: str, optional
+            Request trades for the specific board. Primary boards are used
+            if the parameter is ommited.
+        workers: int, optional
+            Number of threads.
+
+        Returns
+        -------
+        dict
+            Number of loaded trades by ticker.
+        """
+        _res = {}
+
+        def _load(_sec):
+            _n = 0
+            for _batch in self.iterTrades(_sec, board=board):
+                callback(_sec.seccode, _batch)
+                _n += len(_batch)
+            return _n
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as _pool:
+            _futures = {_pool.submit(_load, _sec): _sec.seccode for _sec in secs}
+            for _f in concurrent.futures.as_completed(_futures):
+                try:
+                    _res[_futures[_f]] = _f.result()
+                except concurrent.futures.CancelledError:
+                    for _p in _futures:
+                        _p.cancel()
+                except Exception as e:
+                    print('MoexTrades::loadParallel(): ', _futures[_f], e, file=sys.stderr)
+        return _res
+
+    async def stream(self, secs, board = None, workers = 4):
+        """Asynchronous version of `loadParallel`.
+
+        Parameters
+        ----------
+        secs: array_like
+            List of MoexSecurity objects.
+        board: str, optional
+            Request trades for the specific board. Primary boards are used
+            if the parameter is ommited.
+        workers: int, optional
+            Number of threads.
+
+        Returns
+        -------
+        async_generator
+            Pairs (seccode, batch) in the order of arrival. If the consumer
+            stops early, threads are stopped after their current requests.
+        """
+        _loop = asyncio.get_running_loop()
+        _queue = asyncio.Queue(maxsize=workers * 2)
+        _done = object()
+        _stop = threading.Event()
+
+        def _put(_item):
+            # The queue is bounded, so the put is waited for in short steps
+            # to notice that the consumer has gone.
+            _f = asyncio.run_coroutine_threadsafe(_queue.put(_item), _loop)
+            while True:
+                try:
+                    return _f.result(timeout=0.1)
+                except concurrent.futures.TimeoutError:
+                    if _stop.is_set():
+                        _f.cancel()
+                        raise concurrent.futures.CancelledError()
+
+        def _run():
+            try:
+                self.loadParallel(secs, lambda _seccode, _batch: _put((_seccode, _batch)), board=board, workers=workers)
+            finally:
+                try:
+                    _put(_done)
+                except concurrent.futures.CancelledError:
+                    pass
+
+        _task = _loop.run_in_executor(None, _run)
+        try:
+            while True:
+                _item = await _queue.get()
+                if _item is _done:
+                    break
+                yield _item
+        finally:
+            _stop.set()
+            await _task
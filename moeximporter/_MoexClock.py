@@ -0,0 +1,16 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+class _MoexClock:
+    """Internal clock of the exchange. Data of past days are decided by the
+    Moscow date, so they don't depend on the time zone of the host.
+    """
+    timezone = ZoneInfo('Europe/Moscow')
+    """Time zone of the exchange.
+    """
+
+    @classmethod
+    def today(cls):
+        """Returns the current Moscow date.
+        """
+        return datetime.now(cls.timezone).date()
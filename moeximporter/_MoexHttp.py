@@ -0,0 +1,46 @@
+import functools
+import http.client
+import ssl
+import urllib.request
+
+class _MoexHTTPConnection(http.client.HTTPConnection):
+    """Internal HTTP connection with separate connect and read timeouts.
+    The timeout of the connection is used to connect, then the socket
+    timeout is set to `read_timeout`.
+    """
+    def __init__(self, *args, read_timeout = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+class _MoexHTTPSConnection(http.client.HTTPSConnection):
+    """Internal HTTPS connection with separate connect and read timeouts.
+    """
+    def __init__(self, *args, read_timeout = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+class _MoexTimeoutHandler(urllib.request.HTTPSHandler):
+    """Internal handler opens HTTP and HTTPS urls with the read timeout.
+    The connect timeout is passed to `open` of the opener.
+    """
+    handler_order = 400
+
+    def __init__(self, read_timeout):
+        super().__init__(context=ssl._create_unverified_context())
+        self.read_timeout = read_timeout
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(_MoexHTTPConnection, read_timeout=self.read_timeout), req)
+
+    def https_open(self, req):
+        return self.do_open(functools.partial(_MoexHTTPSConnection, read_timeout=self.read_timeout), req, context=self._context)
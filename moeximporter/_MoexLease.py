@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+class _MoexLease:
+    """Internal lease of a job in a directory shared by several nodes.
+
+    Every claim of the job creates the next generation file
+    `<dir>/<job>/<generation>.json` with put-if-absent semantics (a hard
+    link of a complete temporary file), so only one node wins each
+    generation. The lease is held while its generation is the newest one
+    and it isn't expired. The holder renews the expiry; a node takes over
+    the job only after the expiry, e.g. when the holder died.
+    Expiry uses wall clock, clocks of nodes should be synchronized.
+    """
+    def __init__(self, path, job, node, ttl = 60.0):
+        """Class constructor.
+
+        Parameters
+        ----------
+        path: str
+            Directory of leases.
+        job: str
+            Id of the job.
+        node: str
+            Name of the node.
+        ttl: float, optional
+            Lease time in seconds.
+        """
+        self.path = os.path.join(path, job)
+        self.node = node
+        self.ttl = ttl
+        self.generation = None
+        self._token = uuid.uuid4().hex
+        self._stop = None
+
+    def _generations(self):
+        try:
+            return sorted(int(_n[:-5]) for _n in os.listdir(self.path) if _n.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def _read(self, generation):
+        with open(os.path.join(self.path, f'{generation:08d}.json'), 'r', encoding='utf-8') as _f:
+            return json.load(_f)
+
+    def _content(self, expires):
+        return json.dumps({'node': self.node, 'token': self._token, 'expires': expires}).encode('utf-8')
+
+    def acquire(self):
+        """Claims the job if it isn't leased or the lease is expired.
+
+        Returns
+        -------
+        boolean
+            `True` if the lease is acquired.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        _gens = self._generations()
+        if _gens and self._read(_gens[-1])['expires'] > time.time():
+            return False
+        _gen = _gens[-1] + 1 if _gens else 1
+        _tmp = os.path.join(self.path, f'{self._token:s}.tmp')
+        with open(_tmp, 'wb') as _f:
+            _f.write(self._content(time.time() + self.ttl))
+        try:
+            os.link(_tmp, os.path.join(self.path, f'{_gen:08d}.json'))
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(_tmp)
+        self.generation = _gen
+        return True
+
+    def held(self):
+        """Returns `True` if the lease is still held by the object.
+        """
+        if self.generation is None:
+            return False
+        _gens = self._generations()
+        if not _gens or _gens[-1] != self.generation:
+            return False
+        _lease = self._read(self.generation)
+        return _lease['token'] == self._token and _lease['expires'] > time.time()
+
+    def renew(self):
+        """Extends the lease.
+
+        Returns
+        -------
+        boolean
+            `False` if the lease is lost.
+        """
+        if not self.held():
+            return False
+        _path = os.path.join(self.path, f'{self.generation:08d}.json')
+        with open(_path + '.tmp', 'wb') as _f:
+            _f.write(self._content(time.time() + self.ttl))
+        os.replace(_path + '.tmp', _path)
+        return True
+
+    def keepAlive(self):
+        """Starts the background thread renewing the lease every third of its time.
+        """
+        self._stop = threading.Event()
+
+        def _renew():
+            while not self._stop.wait(self.ttl / 3):
+                if not self.renew():
+                    break
+        threading.Thread(target=_renew, daemon=True).start()
+
+    def release(self):
+        """Stops renewal and expires the lease, so the job can be claimed at once.
+        """
+        if self._stop is not None:
+            self._stop.set()
+        if self.held():
+            _path = os.path.join(self.path, f'{self.generation:08d}.json')
+            with open(_path + '.tmp', 'wb') as _f:
+                _f.write(self._content(0))
+            os.replace(_path + '.tmp', _path)
+        self.generation = None
@@ -0,0 +1,98 @@
+import bisect
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+class _MoexRangeCache:
+    """Internal memoization of already loaded date ranges.
+
+    Rows are kept in segments by key (e.g. board and session or interval).
+    Every segment covers a continuous date range, adjacent and overlapping
+    segments of the same key are merged. Total number of rows is limited,
+    the least recently used segments are evicted first.
+    """
+    def __init__(self, max_rows = 100000):
+        """Class constructor.
+
+        Parameters
+        ----------
+        max_rows: int
+            Maximum number of cached rows. Zero disables the cache.
+        """
+        self.max_rows = max_rows
+        self.rows = 0
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gaps(self, key, dtfrom, dttill):
+        """Returns parts of the date range that aren't cached for the key.
+        """
+        _res = []
+        _cur = dtfrom
+        with self._lock:
+            _segs = sorted((_sk[1], _sk[2]) for _sk in self._segments if _sk[0] == key)
+        for _sf, _st in _segs:
+            if _st < _cur or _sf > dttill:
+                continue
+            if _sf > _cur:
+                _res.append((_cur, _sf - timedelta(days=1)))
+            _cur = max(_cur, _st + timedelta(days=1))
+            if _cur > dttill:
+                break
+        if _cur <= dttill:
+            _res.append((_cur, dttill))
+        return _res
+
+    def get(self, key, dtfrom, dttill):
+        """Returns cached rows of the key for the date range sorted by date.
+        """
+        _res = []
+        with self._lock:
+            for _sk in sorted(_sk for _sk in self._segments if _sk[0] == key and _sk[1] <= dttill and _sk[2] >= dtfrom):
+                _dates, _rows = self._segments[_sk]
+                self._segments.move_to_end(_sk)
+                _lo = bisect.bisect_left(_dates, dtfrom)
+                _hi = bisect.bisect_right(_dates, dttill)
+                _res += _rows[_lo:_hi]
+        return _res
+
+    def put(self, key, dtfrom, dttill, rows, datefn, keyfn = None):
+        """Stores rows for the date range of the key. Rows must cover the whole
+        range, `datefn` returns the date of the row, `keyfn` returns the unique
+        key of the row (the date by default). When segments are merged, rows
+        with the same key are kept once, the stored rows are replaced by the
+        new ones.
+        """
+        if self.max_rows <= 0 or len(rows) > self.max_rows:
+            return
+        _keyfn = keyfn if keyfn else datefn
+        with self._lock:
+            _merge = [
+                _sk for _sk in self._segments
+                if _sk[0] == key and _sk[1] <= dttill + timedelta(days=1) and _sk[2] >= dtfrom - timedelta(days=1)
+            ]
+            _items = {}
+            for _sk in sorted(_merge):
+                _sd, _sr = self._segments.pop(_sk)
+                self.rows -= len(_sr)
+                dtfrom = min(dtfrom, _sk[1])
+                dttill = max(dttill, _sk[2])
+                _items.update((_keyfn(_r), _r) for _r in _sr)
+            _items.update((_keyfn(_r), _r) for _r in rows)
+            _rows = [_items[_k] for _k in sorted(_items)]
+            _dates = [datefn(_r) for _r in _rows]
+            self._segments[(key, dtfrom, dttill)] = (_dates, _rows)
+            self.rows += len(_rows)
+            while self.rows > self.max_rows and len(self._segments) > 1:
+                _sk, (_sd, _sr) = self._segments.popitem(last=False)
+                self.rows -= len(_sr)
+            if self.rows > self.max_rows:
+                self._segments.clear()
+                self.rows = 0
+
+    def clear(self):
+        """Removes all cached segments.
+        """
+        with self._lock:
+            self._segments.clear()
+            self.rows = 0
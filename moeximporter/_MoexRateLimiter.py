@@ -0,0 +1,39 @@
+import threading
+import time
+
+class _MoexRateLimiter:
+    """Internal thread-safe token bucket to keep the request rate to
+    MOEX ISS under a global budget.
+    """
+    def __init__(self, rate = 5.0, burst = 1):
+        """Class constructor.
+
+        Parameters
+        ----------
+        rate: float
+            Maximum number of requests per second. Zero or `None` disables
+            the limit.
+        burst: int, optional
+            Number of requests that may be sent at once after an idle period.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next request is allowed by the budget.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                _now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (_now - self._ts) * self.rate)
+                self._ts = _now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                _wait = (1.0 - self._tokens) / self.rate
+            time.sleep(_wait)
@@ -8,5 +8,12 @@ class _MoexRequests(IntEnum):
     GetSecuritiesForMarket = 102,
     GetSecuritiesSearch = 103,
     GetSecurity = 150,
+    GetBondization = 151,
+    GetDividends = 152,
+    GetBoardSecurities = 160,
+    GetSplits = 170,
+    GetFuturesSeries = 180,
     GetHistoryQuotes = 200,
-    GetCandleQuotes = 201,
\ No newline at end of file
+    GetCandleQuotes = 201,
+    GetBoardHistoryQuotes = 210,
+    GetTrades = 300,
\ No newline at end of file
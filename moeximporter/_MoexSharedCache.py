@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+import urllib.parse
+from datetime import date, timedelta
+from ._MoexClock import _MoexClock
+
+class _MoexSharedCache:
+    """Internal content-addressed cache of raw MOEX ISS replies in a directory
+    shared by several processes or hosts.
+
+    Reply bodies are stored once by their sha256 in `objects/`, request urls
+    are mapped to body hashes in `keys/`. Files are written to temporary
+    names and renamed, so readers never see partial files. Only replies of
+    requests that end (`till` parameter) at least `margin_days` days before
+    the current Moscow date are cached: the data of the last days may still
+    change after the evening session and clearing.
+    """
+    def __init__(self, path, margin_days = 1):
+        """Class constructor.
+
+        Parameters
+        ----------
+        path: str
+            Directory of the cache.
+        margin_days: int, optional
+            Number of full days before the current Moscow date that are
+            still considered mutable.
+        """
+        self.path = path
+        self.margin_days = margin_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, url):
+        """Returns `True` if the reply for the url is immutable.
+        """
+        _till = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get('till')
+        if not _till:
+            return False
+        try:
+            return date.fromisoformat(_till[0][:10]) < _MoexClock.today() - timedelta(days=self.margin_days)
+        except ValueError:
+            return False
+
+    def _file(self, kind, digest):
+        return os.path.join(self.path, kind, digest[:2], digest)
+
+    def _write(self, path, data):
+        """Internal method writes the file atomically.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _tmp = f'{path}.{os.getpid():d}.{threading.get_ident():d}.tmp'
+        with open(_tmp, 'wb') as _f:
+            _f.write(data)
+        os.replace(_tmp, path)
+
+    def get(self, url):
+        """Returns the cached raw reply or `None`.
+        """
+        _res = None
+        if self.cacheable(url):
+            try:
+                with open(self._file('keys', hashlib.sha256(url.encode('utf-8')).hexdigest()), 'rb') as _f:
+                    _digest = _f.read().decode('ascii')
+                with open(self._file('objects', _digest), 'rb') as _f:
+                    _res = _f.read()
+                if hashlib.sha256(_res).hexdigest() != _digest:
+                    _res = None
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            if _res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return _res
+
+    def put(self, url, raw):
+        """Stores the raw reply if it's immutable. The body is written before
+        the key, so a key always refers to a complete body.
+        """
+        if self.cacheable(url):
+            _digest = hashlib.sha256(raw).hexdigest()
+            _obj = self._file('objects', _digest)
+            if not os.path.exists(_obj):
+                self._write(_obj, raw)
+            self._write(self._file('keys', hashlib.sha256(url.encode('utf-8')).hexdigest()), _digest.encode('ascii'))
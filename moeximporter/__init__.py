@@ -3,10 +3,38 @@ from .MoexImporter import MoexImporter
 from .MoexSecurity import MoexSecurity
 from .MoexSessions import MoexSessions
 from .MoexCandlePeriods import MoexCandlePeriods
+from .MoexCandleFollower import MoexCandleFollower
+from .MoexBulkLoader import MoexBulkLoader
+from .MoexCandleStore import MoexCandleStore
+from .MoexTrades import MoexTrades
+from .MoexBondSchedules import MoexBondSchedules
+from .MoexAdjuster import MoexAdjuster
+from .MoexQueryPlanner import MoexQueryPlanner
+from .MoexPanel import MoexPanel
+from .MoexCalendar import MoexCalendar
+from .MoexPartialResultError import MoexPartialResultError
+from .MoexSharedFrames import MoexSharedFrames
+from .MoexFuturesChain import MoexFuturesChain
+from .MoexBondAnalytics import MoexBondAnalytics
+from .MoexShardedLoader import MoexShardedLoader
 
 __all__ = [
     'MoexImporter',
     'MoexSecurity',
     'MoexSessions',
     'MoexCandlePeriods',
+    'MoexCandleFollower',
+    'MoexBulkLoader',
+    'MoexCandleStore',
+    'MoexTrades',
+    'MoexBondSchedules',
+    'MoexAdjuster',
+    'MoexQueryPlanner',
+    'MoexPanel',
+    'MoexCalendar',
+    'MoexPartialResultError',
+    'MoexSharedFrames',
+    'MoexFuturesChain',
+    'MoexBondAnalytics',
+    'MoexShardedLoader',
 ]
\ No newline at end of file
@@ -0,0 +1,41 @@
+import argparse
+import sys
+from .MoexBulkLoader import MoexBulkLoader
+from .MoexShardedLoader import MoexShardedLoader
+
+def main(argv = None):
+    """Command-line entry point for bulk downloads.
+
+    Usage: `python -m moeximporter spec.json [--workers N] [--processes] [--rate R] [--quiet]
+    [--shared DIR --node I --nodes N [--lease-ttl S]]`
+    """
+    _parser = argparse.ArgumentParser(
+        prog='python -m moeximporter',
+        description='Resumable bulk download of MOEX ISS quotes described by a JSON job spec.',
+    )
+    _parser.add_argument('spec', help='path to the JSON job spec')
+    _parser.add_argument('--workers', type=int, default=None, help='number of workers')
+    _parser.add_argument('--processes', action='store_true', help='use processes instead of threads')
+    _parser.add_argument('--rate', type=float, default=None, help='total budget of requests per second')
+    _parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    _parser.add_argument('--shared', default=None, help='directory shared by nodes for leases and the response cache')
+    _parser.add_argument('--node', type=int, default=0, help='number of this node from 0')
+    _parser.add_argument('--nodes', type=int, default=1, help='total number of nodes')
+    _parser.add_argument('--lease-ttl', type=float, default=60.0, help='lease time of a job in seconds')
+    _args = _parser.parse_args(argv)
+
+    if _args.shared:
+        _loader = MoexShardedLoader(
+            _args.spec, _args.shared, node=_args.node, nodes=_args.nodes, lease_ttl=_args.lease_ttl,
+            workers=_args.workers, processes=_args.processes, rate=_args.rate,
+        )
+    else:
+        _loader = MoexBulkLoader(_args.spec, workers=_args.workers, processes=_args.processes, rate=_args.rate)
+    _res = _loader.run(progress=not _args.quiet)
+    print(f'jobs: {_res["jobs"]:d}, completed: {_res["completed"]:d}, failed: {_res["failed"]:d}, skipped: {_res["skipped"]:d}, rows: {_res["rows"]:d}')
+    for _jid, _err in _res['errors'].items():
+        print(f'{_jid:s}: {_err:s}', file=sys.stderr)
+    return 1 if _res['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,7 +18,7 @@ setup(
 	long_description=long_description,
  	long_description_content_type='text/markdown',
 	packages=find_packages(),
-	install_requires=['pandas', ],
+	install_requires=['pandas', 'numpy', ],
 	readme='README.md',
 	keywords=['python', 'MOEX', 'MOEX quotes', 'finance'],
 	classifiers= [
@@ -0,0 +1,75 @@
+import pytest
+from datetime import date, datetime, timedelta
+from moeximporter import MoexImporter
+
+
+class StubImporter(MoexImporter):
+    """MoexImporter that replies from memory instead of MOEX ISS.
+
+    History quotes have one row per business day, candles are taken from
+    `candles`. Pages listed in `fail` return `None` the given number of
+    times, e.g. `{('GetHistoryQuotes', 20): 2}`.
+    """
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.fail = {}
+        self.candles = []
+        self.dividends = {}
+        self.splits = {}
+
+    def _MoexRequest(self, _type, _pparams = None, _params = None, **kwargs):
+        _params = dict(_params or {})
+        self.calls.append((_type.name, _params))
+        _key = (_type.name, _params.get('start'))
+        if self.fail.get(_key, 0) > 0:
+            self.fail[_key] -= 1
+            return None
+        if _type.name == 'GetSecurity':
+            return [
+                {'description': [{'name': 'SHORTNAME', 'value': 'Stub'}]},
+                {'boards': [{
+                    'boardid': 'TQBR', 'history_from': '2010-01-01', 'history_till': '2030-01-01',
+                    'engine': 'stock', 'market': 'shares', 'title': 'T+', 'is_primary': 1,
+                }]},
+            ]
+        if _type.name == 'GetHistoryQuotes':
+            _rows = []
+            _dt = _params['from']
+            while _dt <= _params['till']:
+                if _dt.weekday() < 5:
+                    _rows.append({'TRADEDATE': _dt.isoformat(), 'BOARDID': 'TQBR', 'CLOSE': 1.0, 'OPEN': 1.0, 'VOLUME': 1})
+                _dt += timedelta(days=1)
+            return [{'history': _rows[_params['start']:_params['start'] + self.limit]}]
+        if _type.name == 'GetCandleQuotes':
+            _from = _params['from']
+            if not isinstance(_from, datetime):
+                _from = datetime(_from.year, _from.month, _from.day)
+            _rows = [_c for _c in self.candles if _c['begin'] >= _from.strftime('%Y-%m-%d %H:%M:%S')]
+            return [{'candles': _rows[_params['start']:_params['start'] + self.limit]}]
+        return None
+
+    def getDividends(self, seccode):
+        return self.dividends.get(seccode, [])
+
+    def getSplits(self, seccode):
+        return self.splits.get(seccode, [])
+
+    def requests(self, name):
+        """Returns `start` of every request of the type."""
+        return [_p.get('start') for _n, _p in self.calls if _n == name]
+
+
+def candle(minute, day = date(2024, 1, 9)):
+    """Returns the one-minute candle of the day in MOEX ISS format."""
+    _b = datetime(day.year, day.month, day.day, 10, 0) + timedelta(minutes=minute)
+    return {
+        'begin': _b.strftime('%Y-%m-%d %H:%M:%S'),
+        'end': (_b + timedelta(seconds=59)).strftime('%Y-%m-%d %H:%M:%S'),
+        'open': 1.0, 'close': 1.0, 'high': 1.0, 'low': 1.0, 'value': 1.0, 'volume': 1,
+    }
+
+
+@pytest.fixture
+def mi():
+    return StubImporter()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datetime import date
+from moeximporter import MoexAdjuster
+
+
+def quotes(dtfrom, dttill, close = 100.0):
+    _idx = pd.Index([_d.date() for _d in pd.bdate_range(dtfrom, dttill)], name='TRADEDATE')
+    return pd.DataFrame({'CLOSE': close, 'OPEN': close, 'QUANTITY': 10.0}, index=_idx)
+
+
+def test_split_scales_prices_and_quantity_before_trade_date():
+    _q = quotes('2024-01-01', '2024-01-31')
+    _a = [{'type': 'split', 'date': date(2024, 1, 10), 'value': None, 'before': 1.0, 'after': 10.0}]
+    _r = MoexAdjuster.applyActions({'A': _q}, {'A': _a})['A']
+    assert np.allclose(_r.loc[:date(2024, 1, 9), 'CLOSE'], 10.0)
+    assert np.allclose(_r.loc[:date(2024, 1, 9), 'QUANTITY'], 100.0)
+    assert (_r.loc[date(2024, 1, 10):, 'CLOSE'] == 100.0).all()
+    assert (_r.loc[date(2024, 1, 10):, 'QUANTITY'] == 10.0).all()
+
+
+def test_factors_are_cumulative_and_per_security():
+    _q = quotes('2024-01-01', '2024-01-31')
+    _a = {
+        'A': [
+            {'type': 'split', 'date': date(2024, 1, 10), 'value': None, 'before': 1.0, 'after': 10.0},
+            {'type': 'dividend', 'date': date(2024, 1, 22), 'value': 10.0, 'before': None, 'after': None},
+        ],
+        'B': [],
+    }
+    _r = MoexAdjuster.applyActions({'A': _q, 'B': _q.copy()}, _a)
+    # the last day with the dividend right is 2024-01-19, the ex-date is 2024-01-22
+    assert _r['A'].loc[date(2024, 1, 9), 'CLOSE'] == pytest.approx(100.0 * 0.1 * 0.9)
+    assert _r['A'].loc[date(2024, 1, 19), 'CLOSE'] == pytest.approx(90.0)
+    assert _r['A'].loc[date(2024, 1, 22), 'CLOSE'] == pytest.approx(100.0)
+    assert (_r['B']['CLOSE'] == 100.0).all()
+
+
+def test_future_actions_do_not_adjust():
+    _q = quotes('2024-01-01', '2024-01-31')
+    _a = [{'type': 'dividend', 'date': date(2024, 5, 20), 'value': 10.0, 'before': None, 'after': None}]
+    _r = MoexAdjuster.applyActions({'A': _q}, {'A': _a})['A']
+    assert (_r['CLOSE'] == 100.0).all()
+
+
+def test_adjust_recomputes_when_new_action_comes_into_effect(mi):
+    mi.dividends['A'] = [{'registryclosedate': '2024-01-23', 'value': 10.0}]
+    _ad = MoexAdjuster(mi)
+    _r = _ad.adjust({'A': quotes('2024-01-01', '2024-01-12')})
+    assert (_r['A']['CLOSE'] == 100.0).all()
+    _r = _ad.adjust({'A': quotes('2024-01-01', '2024-01-31')})
+    assert _r['A'].loc[date(2024, 1, 12), 'CLOSE'] == pytest.approx(90.0)
+    assert _r['A'].loc[date(2024, 1, 31), 'CLOSE'] == pytest.approx(100.0)
+
+
+def test_adjust_skips_securities_whose_actions_failed(mi):
+    mi.dividends['B'] = None
+    _ad = MoexAdjuster(mi)
+    _r = _ad.adjust({'A': quotes('2024-01-01', '2024-01-31'), 'B': quotes('2024-01-01', '2024-01-31')})
+    assert sorted(_r) == ['A']
+    assert 'B' in _ad.errors
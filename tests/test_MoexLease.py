@@ -0,0 +1,79 @@
+import queue
+import sys
+import time
+import uuid
+from datetime import date
+import pytest
+from moeximporter.MoexBulkLoader import MoexBulkLoader, _loadJob
+from moeximporter._MoexLease import _MoexLease
+
+_bulk = sys.modules['moeximporter.MoexBulkLoader']
+
+
+def test_lease_is_exclusive_until_expired(tmp_path):
+    _a = _MoexLease(str(tmp_path), 'job', 'a', ttl=0.2)
+    _b = _MoexLease(str(tmp_path), 'job', 'b', ttl=0.2)
+    assert _a.acquire()
+    assert not _b.acquire()
+    assert _a.renew()
+    time.sleep(0.3)
+    assert not _a.held()
+    assert _b.acquire()
+    assert _b.generation == _a.generation + 1
+    # the old holder is fenced off by the newer generation
+    assert not _a.renew()
+    assert not _a.held()
+    assert _b.held()
+
+
+def test_released_lease_is_claimed_at_once(tmp_path):
+    _a = _MoexLease(str(tmp_path), 'job', 'a', ttl=60.0)
+    _b = _MoexLease(str(tmp_path), 'job', 'b', ttl=60.0)
+    assert _a.acquire()
+    _a.release()
+    assert _b.acquire()
+    assert not _a.held()
+
+
+@pytest.fixture
+def options(mi, tmp_path):
+    _run = uuid.uuid4().hex
+    mi.limit = 10
+    _bulk._worker_importers[_run] = mi
+    yield {'run': _run, 'output': str(tmp_path), 'header': None, 'rate': 0}
+    _bulk._releaseImporter(_run)
+
+
+def job():
+    return MoexBulkLoader._normalizeJob({'dtfrom': '2024-01-01', 'dttill': '2024-03-31', 'chunk_days': 31}, 'SBER')
+
+
+def progress(q):
+    _res = []
+    while not q.empty():
+        _res.append(q.get()[0])
+    return _res
+
+
+def test_fenced_job_writes_nothing(options, tmp_path):
+    _a = _MoexLease(str(tmp_path / 'leases'), 'job', 'a', ttl=0.1)
+    _b = _MoexLease(str(tmp_path / 'leases'), 'job', 'b', ttl=60.0)
+    assert _a.acquire()
+    time.sleep(0.2)
+    assert _b.acquire()
+    _q = queue.Queue()
+    _job = job()
+    _loadJob(_job, options, _q, fence=_a.held)
+    assert progress(_q) == ['skipped']
+    assert MoexBulkLoader._readCheckpoint(options['output'], _job) is None
+
+
+def test_job_stops_when_lease_is_lost(options):
+    _held = iter([True, False])
+    _q = queue.Queue()
+    _job = job()
+    _loadJob(_job, options, _q, fence=lambda: next(_held))
+    assert progress(_q) == ['chunk', 'skipped']
+    _ckpt = MoexBulkLoader._readCheckpoint(options['output'], _job)
+    assert _ckpt['done_till'] == date(2024, 1, 31).isoformat()
+    assert _ckpt['rows'] == 23
@@ -0,0 +1,59 @@
+import pytest
+from datetime import date
+from conftest import candle
+from moeximporter import MoexSecurity, MoexPartialResultError, MoexCandleStore, MoexCandleFollower
+
+
+def security(mi):
+    _sec = MoexSecurity('SBER', mi, cache_rows=0)
+    _sec.retry_delay = 0.001
+    return _sec
+
+
+def test_failed_page_is_retried(mi):
+    mi.limit = 10
+    mi.fail[('GetHistoryQuotes', 20)] = 2
+    _res = security(mi).getHistoryQuotesAsArray(date(2024, 1, 1), date(2024, 2, 29))
+    assert len(_res) == 44
+    assert mi.requests('GetHistoryQuotes') == [0, 10, 20, 20, 20, 30, 40]
+
+
+def test_resume_requests_failed_page_and_following(mi):
+    mi.limit = 10
+    mi.fail[('GetHistoryQuotes', 30)] = 10
+    with pytest.raises(MoexPartialResultError) as e:
+        security(mi).getHistoryQuotesAsDataFrame(date(2024, 1, 1), date(2024, 2, 29))
+    assert len(e.value.rows) == 30
+    assert [_p['start'] for _p in e.value.failedPages()] == [30]
+    mi.fail.clear()
+    mi.calls.clear()
+    _res = e.value.resume()
+    assert mi.requests('GetHistoryQuotes') == [30, 40]
+    assert len(_res) == 44
+    assert _res[0]['TRADEDATE'] == date(2024, 1, 1)
+    assert _res[-1]['TRADEDATE'] == date(2024, 2, 29)
+
+
+def test_candle_store_update_raises_resumable_error(mi, tmp_path):
+    mi.candles = [candle(_i) for _i in range(250)]
+    mi.fail[('GetCandleQuotes', 100)] = 10
+    _store = MoexCandleStore(str(tmp_path))
+    with pytest.raises(MoexPartialResultError) as e:
+        _store.update(security(mi), date(2024, 1, 9), date(2024, 1, 9))
+    mi.fail.clear()
+    assert e.value.resume() == 250
+
+
+def test_candle_follower_poll_raises_resumable_error(mi):
+    mi.candles = [candle(_i) for _i in range(250)]
+    _follower = MoexCandleFollower(mi, rate=0)
+    _key = _follower.addSecurity(security(mi), dtfrom=date(2024, 1, 9))
+    mi.fail[('GetCandleQuotes', 200)] = 10
+    with pytest.raises(MoexPartialResultError) as e:
+        _follower.poll(_key)
+    assert len(e.value.rows) == 200
+    mi.fail.clear()
+    # received candles are already counted as seen, resume() returns the rest
+    _rest = e.value.resume()
+    assert len(_rest) == 50
+    assert _rest[0]['begin'] > e.value.rows[-1]['begin']
@@ -0,0 +1,65 @@
+from datetime import date, datetime
+from moeximporter import MoexSecurity
+from moeximporter._MoexRangeCache import _MoexRangeCache
+
+
+def rows(dfrom, dtill, value):
+    return [{'TRADEDATE': date(2024, 1, _d), 'v': value} for _d in range(dfrom, dtill + 1)]
+
+
+def tradedate(row):
+    return row['TRADEDATE']
+
+
+def test_overlapping_segments_are_merged_without_duplicates():
+    _c = _MoexRangeCache(1000)
+    _c.put('h', date(2024, 1, 1), date(2024, 1, 10), rows(1, 10, 1), tradedate)
+    _c.put('h', date(2024, 1, 5), date(2024, 1, 15), rows(5, 15, 2), tradedate)
+    _res = _c.get('h', date(2024, 1, 1), date(2024, 1, 31))
+    assert [_r['TRADEDATE'].day for _r in _res] == list(range(1, 16))
+    assert [_r['v'] for _r in _res] == [1] * 4 + [2] * 11
+    assert _c.rows == 15
+    assert _c.gaps('h', date(2024, 1, 1), date(2024, 1, 20)) == [(date(2024, 1, 16), date(2024, 1, 20))]
+
+
+def test_adjacent_segments_are_merged():
+    _c = _MoexRangeCache(1000)
+    _c.put('h', date(2024, 1, 1), date(2024, 1, 5), rows(1, 5, 1), tradedate)
+    _c.put('h', date(2024, 1, 6), date(2024, 1, 9), rows(6, 9, 1), tradedate)
+    assert len(_c._segments) == 1
+    assert _c.gaps('h', date(2024, 1, 1), date(2024, 1, 9)) == []
+
+
+def test_rows_are_deduplicated_by_key():
+    _c = _MoexRangeCache(1000)
+    _candle = lambda _d, _h: {'begin': datetime(2024, 1, _d, _h)}
+    _date = lambda _r: _r['begin'].date()
+    _begin = lambda _r: _r['begin']
+    _c.put('c', date(2024, 1, 1), date(2024, 1, 2), [_candle(1, 10), _candle(1, 11), _candle(2, 10)], _date, _begin)
+    _c.put('c', date(2024, 1, 2), date(2024, 1, 3), [_candle(2, 10), _candle(3, 10)], _date, _begin)
+    _res = _c.get('c', date(2024, 1, 1), date(2024, 1, 3))
+    assert [_r['begin'] for _r in _res] == [datetime(2024, 1, 1, 10), datetime(2024, 1, 1, 11), datetime(2024, 1, 2, 10), datetime(2024, 1, 3, 10)]
+
+
+def test_least_recently_used_segments_are_evicted():
+    _c = _MoexRangeCache(10)
+    _c.put('a', date(2024, 1, 1), date(2024, 1, 5), rows(1, 5, 1), tradedate)
+    _c.put('b', date(2024, 1, 1), date(2024, 1, 5), rows(1, 5, 1), tradedate)
+    _c.get('a', date(2024, 1, 1), date(2024, 1, 5))
+    _c.put('c', date(2024, 1, 1), date(2024, 1, 5), rows(1, 5, 1), tradedate)
+    assert sorted(_sk[0] for _sk in _c._segments) == ['a', 'c']
+    assert _c.rows == 10
+
+
+def test_security_requests_only_uncached_ranges(mi):
+    _sec = MoexSecurity('SBER', mi, cache_rows=1000)
+    _sec.getHistoryQuotesAsArray(date(2024, 1, 1), date(2024, 1, 31))
+    mi.calls.clear()
+    _res = _sec.getHistoryQuotesAsArray(date(2024, 1, 10), date(2024, 1, 20))
+    assert mi.requests('GetHistoryQuotes') == []
+    assert len(_res) == 8
+    _res = _sec.getHistoryQuotesAsArray(date(2024, 1, 1), date(2024, 2, 29))
+    assert [_p['from'] for _n, _p in mi.calls if _n == 'GetHistoryQuotes'] == [date(2024, 2, 1)]
+    _dates = [_r['TRADEDATE'] for _r in _res]
+    assert _dates == sorted(set(_dates))
+    assert len(_res) == 44
@@ -0,0 +1,67 @@
+import uuid
+import numpy as np
+import pandas as pd
+import pytest
+from multiprocessing import resource_tracker
+from moeximporter import MoexSharedFrames
+
+
+@pytest.fixture
+def publisher():
+    _pub = MoexSharedFrames(f't{uuid.uuid4().hex[:8]}')
+    yield _pub
+    _pub.close()
+
+
+def frame(value = 1.0):
+    return pd.DataFrame({'CLOSE': np.full(5, value), 'QUANTITY': np.arange(5)}, index=pd.RangeIndex(5, name='N'))
+
+
+def test_attach_returns_views_of_published_frame(publisher):
+    publisher.publish('f', frame())
+    _con = MoexSharedFrames(publisher.namespace)
+    _df = _con.attach('f')
+    assert _df['CLOSE'].tolist() == [1.0] * 5
+    assert _df['QUANTITY'].tolist() == list(range(5))
+    assert not _df['CLOSE'].to_numpy().flags.writeable
+    del _df
+    _con.close()
+
+
+def test_attach_waits_for_registry_being_written(publisher):
+    publisher.publish('f', frame())
+    _hdr = np.ndarray((2,), dtype='<u8', buffer=publisher._registry.buf)
+    _hdr[0] += 1
+    _con = MoexSharedFrames(publisher.namespace, timeout=0.05)
+    assert _con.attach('f') is None
+    _hdr[0] += 1
+    _df = _con.attach('f')
+    assert _df['CLOSE'].tolist() == [1.0] * 5
+    del _df
+    _con.close()
+
+
+def test_republished_frame_keeps_attached_version(publisher):
+    publisher.publish('f', frame(1.0))
+    _con = MoexSharedFrames(publisher.namespace)
+    _old = _con.attach('f')
+    publisher.publish('f', frame(2.0))
+    assert _con.names() == {'f': 2}
+    assert _old['CLOSE'].tolist() == [1.0] * 5
+    _new = _con.attach('f')
+    assert _new['CLOSE'].tolist() == [2.0] * 5
+    del _old, _new
+    _con.close()
+
+
+def test_attach_leaves_publisher_registration(publisher, monkeypatch):
+    _block = publisher.publish('f', frame())
+    _calls = []
+    monkeypatch.setattr(resource_tracker, 'register', lambda _n, _t: _calls.append(('register', _n)))
+    monkeypatch.setattr(resource_tracker, 'unregister', lambda _n, _t: _calls.append(('unregister', _n)))
+    _con = MoexSharedFrames(publisher.namespace)
+    _df = _con.attach('f')
+    assert _df is not None
+    assert not [_c for _c in _calls if _c[1].lstrip('/') in (_block, f'{publisher.namespace}_registry')]
+    del _df
+    _con.close()